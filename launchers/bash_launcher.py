@@ -249,8 +249,19 @@ def test_complete():
                 continue
 
             try:
-                response = rag_instance.respond(query)
-                print(f"\n Assistant : {response}")
+                # Affichage des tokens au fil de leur génération
+                print("\n Assistant : ", end="", flush=True)
+                for event in rag_instance.respond_stream(query):
+                    if event["event"] in ("token", "answer"):
+                        print(event["data"], end="", flush=True)
+                    elif event["event"] == "done":
+                        print(event["data"]["sources_text"])
+                        timings = event["data"]["timings"]
+                        if "ttft_s" in timings:
+                            print(
+                                f"\n (premier token : {timings['ttft_s']:.2f} s, total : {timings['total_s']:.2f} s)"
+                            )
+                print()
             except Exception as e:
                 print(f" Erreur : {e}")
 
@@ -35,7 +35,7 @@ def main():
         st.header("⚙️ Configuration")
 
         # Lister les collections disponibles
-        collections = rag_instance.retrival.chroma_storage.list_collection_names()
+        collections = rag_instance.retrieval.chroma_storage.list_collection_names()
 
         if not collections:
             st.warning(" Aucune collection disponible")
@@ -47,16 +47,16 @@ def main():
 
         # Basculer vers la collection sélectionnée
         if selected_collection:
-            rag_instance.retrival.chroma_storage.switch_collection(selected_collection)
+            rag_instance.retrieval.chroma_storage.switch_collection(selected_collection)
 
             # Afficher les stats de la collection
-            stats = rag_instance.retrival.get_stats()
+            stats = rag_instance.retrieval.get_stats()
 
             st.metric(" Chunks", stats["total_documents"])
             st.metric(" Fichiers sources", stats["total_fichiers"])
 
             # Métadonnées de la collection
-            collection = rag_instance.retrival.chroma_storage.collection
+            collection = rag_instance.retrieval.chroma_storage.collection
             metadata = collection.metadata
 
             with st.expander(" Détails de la collection"):
@@ -98,33 +98,43 @@ def main():
 
     # Gestion de la soumission
     if submit_button and question:
-        with st.spinner(" Recherche en cours..."):
-            try:
-                # Appel du système RAG
-                reponse = rag_instance.respond(question)
-
-                # Affichage de la réponse
-                st.markdown("---")
-                st.subheader(" Réponse")
-
-                # Séparer la réponse des sources
-                if "Sources (Top-" in reponse:
-                    reponse_text, sources_text = reponse.split("\n\nSources (Top-", 1)
-                    sources_text = "Sources (Top-" + sources_text
-                else:
-                    reponse_text = reponse
-                    sources_text = None
-
-                # Afficher la réponse
-                st.markdown(reponse_text)
-
-                # Afficher les sources dans un expander
-                if sources_text:
-                    with st.expander(" Voir les sources", expanded=True):
-                        st.text(sources_text)
+        try:
+            st.markdown("---")
+            st.subheader(" Réponse")
+
+            sources_text = None
+            timings = {}
+            mode = None
+
+            # Appel du système RAG en streaming : les tokens s'affichent dès leur génération
+            def token_stream():
+                nonlocal sources_text, timings, mode
+                for event in rag_instance.respond_stream(question):
+                    if event["event"] in ("token", "answer"):
+                        yield event["data"]
+                    elif event["event"] == "done":
+                        sources_text = event["data"]["sources_text"].strip() or None
+                        timings = event["data"]["timings"]
+                        mode = event["data"].get("mode")
+
+            with st.spinner(" Recherche en cours..."):
+                st.write_stream(token_stream())
+
+            if mode == "extractive":
+                st.info(" Serveur LLM saturé : réponse composée de passages extraits des documents.")
+
+            # Afficher les sources dans un expander
+            if sources_text:
+                with st.expander(" Voir les sources", expanded=True):
+                    st.text(sources_text)
+
+            if "ttft_s" in timings:
+                st.caption(
+                    f"Premier token : {timings['ttft_s']:.2f} s — total : {timings['total_s']:.2f} s"
+                )
 
-            except Exception as e:
-                st.error(f" Erreur lors de la génération de la réponse : {e}")
+        except Exception as e:
+            st.error(f" Erreur lors de la génération de la réponse : {e}")
 
     elif submit_button and not question:
         st.warning(" Veuillez entrer une question")
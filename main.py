@@ -1,16 +1,96 @@
 import uvicorn
+import json
+import asyncio
 from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, PlainTextResponse
+from sse_starlette.sse import EventSourceResponse
 import traceback
+from contextlib import aclosing
 from pydantic import BaseModel, Field  
-from typing import Optional, List, Any
+from typing import Optional, List, Any, Literal
 
 from src.rag.settings import GlobalConfig
-from src.rag.rag import Rag 
+from src.rag.engine import RagEngine, UnknownCollectionError
+from src.rag.admission import QueryExecutor, SaturatedError
+from src.rag.ingest_jobs import IngestJobManager
+from src.rag.warmup import Warmup
+from src.rag.llm_pool import aclose_shared_clients, pools as llm_pools
+from src.rag import metrics, tracing, deadline, scheduler
+from src.rag.deadline import DeadlineExceeded
 
 app = FastAPI()
 
-# Variable globale
-rag_instance = None
+# Moteur RAG partagé : construit une fois, reconstruit seulement si config.json change
+engine = RagEngine("config.json")
+
+# Pool borné pour le pipeline bloquant (créé au démarrage depuis la config "server")
+executor: Optional[QueryExecutor] = None
+
+# Chauffe au démarrage et état de disponibilité (/healthz, /readyz)
+warmup: Optional[Warmup] = None
+
+# Échéance par défaut des requêtes (config "server"), remplacée par timeout_s de l'appelant
+default_timeout_s: Optional[float] = None
+
+# Intervalle de vérification de la connexion du client pendant /query
+disconnect_poll_s: float = 0.5
+
+# Ingestions en tâche de fond ; à la fin, le moteur rouvre la collection ingérée
+ingest_jobs = IngestJobManager(
+    on_complete=lambda job: engine.invalidate(job.params["collection"])
+)
+
+# --- Jauges calculées à la lecture de /metrics ---
+
+def _collect_embedding_models():
+    return [({"model": name}, 1) for name in engine.loaded_models()]
+
+def _collect_collection_sizes():
+    current_rag = engine.current
+    if current_rag is None:
+        return []
+    storage = current_rag.retrieval.chroma_storage
+    return [
+        ({"collection": name}, storage.chroma_client.get_collection(name).count())
+        for name in storage.list_collection_names()
+    ]
+
+def _collect_engine_memory():
+    return [
+        ({"collection": entry.name}, entry.index_bytes)
+        for entry in engine.engines()
+    ]
+
+def _collect_query_pool():
+    if executor is None:
+        return []
+    return [({"field": field}, value) for field, value in executor.stats().items()]
+
+def _collect_llm_backends():
+    samples = []
+    for pool in llm_pools():
+        for backend in pool.stats():
+            labels = {"backend": backend["base_url"]}
+            samples.append(({**labels, "field": "healthy"}, 1 if backend["state"] == "closed" else 0))
+            samples.append(({**labels, "field": "outstanding"}, backend["outstanding"]))
+            samples.append(({**labels, "field": "capacity"}, backend["capacity"]))
+            if backend["slots_busy"] is not None:
+                samples.append(({**labels, "field": "slots_busy"}, backend["slots_busy"]))
+    return samples
+
+def _collect_llm_queue():
+    depth = {name: 0 for name in scheduler.PRIORITIES}
+    for pool in llm_pools():
+        for name, count in pool.scheduler.queue_depth().items():
+            depth[name] += count
+    return [({"priority": name}, count) for name, count in depth.items()]
+
+metrics.EMBEDDING_MODELS_LOADED.set_callback(_collect_embedding_models)
+metrics.COLLECTION_DOCUMENTS.set_callback(_collect_collection_sizes)
+metrics.COLLECTION_ENGINE_MEMORY.set_callback(_collect_engine_memory)
+metrics.QUERY_POOL.set_callback(_collect_query_pool)
+metrics.LLM_BACKENDS.set_callback(_collect_llm_backends)
+metrics.LLM_QUEUE_DEPTH.set_callback(_collect_llm_queue)
 
 # --- Modèles de données (Contrat d'Interface) ---
 
@@ -23,6 +103,14 @@ class LegacyQueryRequest(BaseModel):
     # Node.js envoie souvent "query" ou "question", j'utilise un alias pour accepter "query"
     query: str 
     history: Optional[List[Any]] = Field(default=None)
+    # Collection à interroger (défaut : celle de config.json)
+    collection: Optional[str] = Field(default=None)
+    # Temps que l'appelant est prêt à attendre (s) : le pipeline s'y adapte
+    timeout_s: Optional[float] = Field(default=None, gt=0)
+    # Trafic batch (benchmarks, tests de charge) : servi après les questions interactives
+    priority: Literal["interactive", "batch"] = Field(default="interactive")
+    # Questions larges : réponses partielles en parallèle puis fusion (src/rag/map_reduce.py)
+    map_reduce: bool = Field(default=False)
 
 class LegacyQueryResponse(BaseModel):
     """
@@ -30,32 +118,159 @@ class LegacyQueryResponse(BaseModel):
     Le backend attend : data.response
     """
     response: str
+    # Mode de la réponse : "generative", "cached", "extractive" (LLM saturé, passages extraits),
+    # "gated" (aucun document assez pertinent, réponse sans LLM) ou "map_reduce"
+    mode: Optional[str] = None
+    # Taille du contexte passé au LLM (sélection adaptative, voir src/rag/relevance.py)
+    chunks: Optional[int] = None
+    context_tokens: Optional[int] = None
+    # Tokens après / avant compression du contexte (None si désactivée)
+    compression_ratio: Optional[float] = None
+
+
+class RetrieveRequest(BaseModel):
+    """
+    Retrieval seul (sans LLM), pour le backend Node.js et les scripts d'évaluation.
+    """
+    queries: List[str] = Field(min_length=1, max_length=64)
+    k: int = Field(default=5, ge=1, le=50)
+    collection: Optional[str] = Field(default=None)
+    timeout_s: Optional[float] = Field(default=None, gt=0)
+
+class RetrievedChunk(BaseModel):
+    id: str
+    content: str
+    source: str
+    position_debut: int
+    taille_texte: int
+    score_retrieval: float
+    score_local: float
+    score_final: float
+
+class RetrieveResponse(BaseModel):
+    collection: Optional[str]
+    results: List[List[RetrievedChunk]]
 
 
 @app.on_event("startup")
 async def startup_event():
     """Initialisation au démarrage"""
-    global rag_instance
+    global executor, warmup, default_timeout_s, disconnect_poll_s
     print(" Démarrage du RAG Container...")
+    config = GlobalConfig.load_config("config.json")
+    executor = QueryExecutor.from_settings(config.server)
+    default_timeout_s = config.server.request_timeout_s
+    disconnect_poll_s = config.server.disconnect_poll_s
+    print(f" Pool de requêtes : {config.server.max_workers} threads, {config.server.max_in_flight} en parallèle, file de {config.server.max_queue}")
+
+    # Construction du moteur partagé + chauffe en tâche de fond :
+    # /healthz répond tout de suite, /readyz passe à 200 une fois le moteur chaud
+    tracing.configure(config.server.trace_exporter, config.server.trace_path)
+
+    warmup = Warmup.from_settings(config.server)
+    asyncio.get_running_loop().run_in_executor(None, run_warmup)
+
+def run_warmup():
     try:
-        # Chargement intelligent (Docker vs Local)
-        config = GlobalConfig.load_config("config.json")
-        
-        rag_instance = Rag(
-            model=config.rag.model,
-            base_url=config.rag.base_url,
-            api_key=config.rag.api_key,
-            path_doc=config.rag.paths.docs,
-            chroma_persist_dir=config.rag.paths.chroma_dir,
-            processed_texts_dir=config.rag.paths.cache
-        )
-        print(" RAG Initialisé (Global)")
+        if warmup.run(engine):
+            print(" RAG Initialisé (Global)")
     except Exception as e:
         print(f" Erreur d'init globale : {e}")
         traceback.print_exc()
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    if executor is not None:
+        executor.shutdown()
+    ingest_jobs.shutdown()
+    await aclose_shared_clients()
+    # Traces encore en attente d'écriture
+    tracing.configure("none")
+
+# Pas de trace pour les sondes et le scraping
+UNTRACED_PATHS = {"/metrics", "/healthz", "/readyz"}
+
+@app.middleware("http")
+async def trace_requests(request: Request, call_next):
+    """
+    Une trace par requête : spans de chaque étape (voir tracing.py), résumés dans
+    l'en-tête Server-Timing. En streaming, l'en-tête ne couvre que ce qui précède
+    le flux ; la trace complète est exportée à la fin du flux.
+    """
+    if request.url.path in UNTRACED_PATHS:
+        return await call_next(request)
+
+    with tracing.start_trace(f"{request.method} {request.url.path}") as trace:
+        response = await call_next(request)
+        trace.attributes["status"] = response.status_code
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["X-Trace-Id"] = trace.trace_id
+        return response
+
+def saturated_response(error: SaturatedError) -> JSONResponse:
+    """Rejet rapide (503 + Retry-After) plutôt qu'un timeout côté client."""
+    return JSONResponse(
+        status_code=503,
+        headers={"Retry-After": str(error.retry_after)},
+        content={"response": f"Serveur saturé ({error}), réessayez dans {error.retry_after} s."},
+    )
+
+def unknown_collection_response(error: UnknownCollectionError) -> JSONResponse:
+    return JSONResponse(status_code=404, content={"response": str(error)})
+
+def deadline_response(error: DeadlineExceeded) -> JSONResponse:
+    """Échéance de l'appelant atteinte : le travail restant a été abandonné."""
+    return JSONResponse(status_code=504, content={"response": str(error)})
+
+def request_deadline(timeout_s: Optional[float]) -> Optional[deadline.Deadline]:
+    """Échéance de la requête, démarrée à son arrivée (timeout_s de l'appelant ou défaut)."""
+    timeout_s = timeout_s or default_timeout_s
+    return deadline.Deadline(timeout_s) if timeout_s else None
+
+class ClientDisconnected(Exception):
+    """Le client a fermé la connexion avant la réponse."""
+
+def client_disconnected_response() -> JSONResponse:
+    """Personne ne lira cette réponse (499 : convention nginx "client closed request")."""
+    return JSONResponse(status_code=499, content={"response": "Requête annulée : client déconnecté"})
+
+async def cancel_on_disconnect(request: Request, awaitable, endpoint: str):
+    """
+    Attend `awaitable` en surveillant la connexion. Si le client part en route (timeout
+    du backend Node, page Streamlit quittée), la tâche est annulée jusqu'à l'appel LLM :
+    la connexion vers llama.cpp est fermée et le slot libéré au lieu de générer pour
+    personne.
+
+    Raises:
+        ClientDisconnected: si le client est parti avant la fin.
+    """
+    task = asyncio.ensure_future(awaitable)
+    try:
+        while True:
+            done, _ = await asyncio.wait({task}, timeout=disconnect_poll_s)
+            if done:
+                return task.result()
+            if await request.is_disconnected():
+                metrics.CLIENT_DISCONNECTS.inc(endpoint=endpoint)
+                raise ClientDisconnected()
+    finally:
+        if not task.done():
+            task.cancel()
+            await asyncio.wait({task})
+
+async def answer_query(question: str, collection: Optional[str] = None, map_reduce: bool = False) -> dict:
+    """
+    Retrieval dans le pool de threads, génération asynchrone : l'attente du LLM
+    n'occupe aucun thread, les slots du serveur llama.cpp restent alimentés.
+    """
+    # Moteur chaud : la collection et son modèle sont déjà prêts
+    current_rag = await executor.run(engine.get, collection)
+    if map_reduce:
+        return await current_rag.map_reduce.aanswer(question, run_blocking=executor.run)
+    return await current_rag.aanswer(question, run_blocking=executor.run)
+
 @app.post("/query", response_model=LegacyQueryResponse)
-async def handle_query(payload: LegacyQueryRequest):
+async def handle_query(payload: LegacyQueryRequest, request: Request):
     """
     Endpoint query adapté.
     Reçoit : JSON strict (query, history)
@@ -69,76 +284,226 @@ async def handle_query(payload: LegacyQueryRequest):
         return LegacyQueryResponse(response="Erreur : Question vide")
 
     try:
-        config = GlobalConfig.load_config("config.json")
-
-        current_rag = Rag(
-            model=config.rag.model,
-            base_url=config.rag.base_url,
-            api_key=config.rag.api_key,
-            path_doc=config.rag.paths.docs,
-            chroma_persist_dir=config.rag.paths.chroma_dir,
-            processed_texts_dir=config.rag.paths.cache
-        )
-        
-        # Activation Collection
-        col_name = config.rag.retrieval.collection_name
-        print(f" Query sur la collection : {col_name}")
-        current_rag.retrieval.chroma_storage.switch_collection(col_name)
-        
-        response_text = current_rag.respond(question)
+        with deadline.bind(request_deadline(payload.timeout_s)), scheduler.priority(payload.priority):
+            async with executor.admit():
+                result = await cancel_on_disconnect(
+                    request, answer_query(question, payload.collection, payload.map_reduce), "/query"
+                )
         
         # Formatage pour le Node.js (champ 'response')
-        return LegacyQueryResponse(response=response_text)
-            
+        return LegacyQueryResponse(**result)
+
+    except ClientDisconnected:
+        return client_disconnected_response()
+    except SaturatedError as e:
+        return saturated_response(e)
+    except UnknownCollectionError as e:
+        return unknown_collection_response(e)
+    except DeadlineExceeded as e:
+        return deadline_response(e)
     except Exception as e:
         traceback.print_exc() 
         return LegacyQueryResponse(response=f"Error processing request: {str(e)}")
 
-@app.post("/ingest")
-async def trigger_ingest():
+@app.post("/query/stream")
+async def handle_query_stream(payload: LegacyQueryRequest):
+    """
+    Variante streaming (Server-Sent Events) de /query.
+    Événements : "sources" (immédiat), "token" (au fil de la génération), "done" (timings).
+    En map-reduce, un "partial" par groupe de documents, dès qu'il est prêt, avant les "token".
+    """
+    question = payload.query
+    if not question:
+        return LegacyQueryResponse(response="Erreur : Question vide")
+
+    # L'admission se fait AVANT d'ouvrir le flux pour pouvoir encore répondre 503
+    stream_deadline = request_deadline(payload.timeout_s)
+    try:
+        with deadline.bind(stream_deadline):
+            await executor.acquire()
+    except SaturatedError as e:
+        return saturated_response(e)
+    except DeadlineExceeded as e:
+        return deadline_response(e)
+
+    # Collection résolue avant d'ouvrir le flux (404 si inconnue)
+    try:
+        with deadline.bind(stream_deadline):
+            current_rag = await executor.run(engine.get, payload.collection)
+    except UnknownCollectionError as e:
+        executor.release()
+        return unknown_collection_response(e)
+    except DeadlineExceeded as e:
+        executor.release()
+        return deadline_response(e)
+    except Exception as e:
+        executor.release()
+        traceback.print_exc()
+        return LegacyQueryResponse(response=f"Error processing request: {str(e)}")
+
+    # La trace reste ouverte jusqu'à la fin du flux
+    trace = tracing.current_trace()
+    if trace is not None:
+        trace.detached = True
+
+    async def event_stream():
+        # Client parti : sse_starlette annule ce générateur ; aclosing ferme aussitôt la
+        # chaîne de flux jusqu'à la requête llama.cpp, qui arrête de générer
+        try:
+            with deadline.bind(stream_deadline), scheduler.priority(payload.priority):
+                if payload.map_reduce:
+                    events = current_rag.map_reduce.astream(question, run_blocking=executor.run)
+                else:
+                    events = current_rag.arespond_stream(question, run_blocking=executor.run)
+                async with aclosing(events):
+                    async for event in events:
+                        yield {
+                            "event": event["event"],
+                            "data": json.dumps(event["data"], ensure_ascii=False),
+                        }
+        except (asyncio.CancelledError, GeneratorExit):
+            metrics.CLIENT_DISCONNECTS.inc(endpoint="/query/stream")
+            raise
+        except (DeadlineExceeded, SaturatedError) as e:
+            yield {"event": "error", "data": json.dumps(str(e), ensure_ascii=False)}
+        except Exception as e:
+            traceback.print_exc()
+            yield {"event": "error", "data": json.dumps(f"Error processing request: {e}", ensure_ascii=False)}
+        finally:
+            executor.release()
+            if trace is not None:
+                trace.finish()
+
+    return EventSourceResponse(event_stream())
+
+def retrieve_chunks(queries: List[str], k: int, collection: Optional[str] = None) -> RetrieveResponse:
+    """Retrieval multi-requêtes bloquant, exécuté dans le pool de threads."""
+    current_rag = engine.get(collection)
+    all_hits = current_rag.retrieval.query_batch(queries, n=k)
+    return RetrieveResponse(
+        collection=current_rag.retrieval.chroma_storage.collection_name,
+        results=[
+            [
+                RetrievedChunk(
+                    id=hit["id"],
+                    content=hit["batch"],
+                    source=hit["chemin"],
+                    position_debut=hit["position_debut"],
+                    taille_texte=hit["taille_texte"],
+                    score_retrieval=hit["score_retrieval"],
+                    score_local=hit["score_local"],
+                    score_final=hit["score_final"],
+                )
+                for hit in hits
+            ]
+            for hits in all_hits
+        ],
+    )
+
+@app.post("/retrieve", response_model=RetrieveResponse)
+async def handle_retrieve(payload: RetrieveRequest):
+    """
+    Renvoie les chunks (ids, sources, positions, détail des scores) pour une liste
+    de requêtes, sans appeler le LLM.
+    """
+    try:
+        with deadline.bind(request_deadline(payload.timeout_s)):
+            async with executor.admit():
+                return await executor.run(
+                    retrieve_chunks, payload.queries, payload.k, payload.collection
+                )
+    except SaturatedError as e:
+        return saturated_response(e)
+    except DeadlineExceeded as e:
+        return JSONResponse(status_code=504, content={"error": str(e)})
+    except UnknownCollectionError as e:
+        return JSONResponse(status_code=404, content={"error": str(e)})
+    except Exception as e:
+        traceback.print_exc()
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/metrics", response_class=PlainTextResponse)
+async def prometheus_metrics():
+    """Métriques au format texte Prometheus (étapes du pipeline, caches, ingestion, pool)."""
+    # Les callbacks interrogent ChromaDB : on les exécute hors de la boucle asyncio
+    body = await asyncio.to_thread(metrics.REGISTRY.render)
+    return PlainTextResponse(body, media_type=metrics.CONTENT_TYPE)
+
+@app.get("/healthz")
+async def healthz():
+    """Liveness : le processus répond (ne dit rien de la chauffe)."""
+    return {"status": "alive"}
+
+@app.get("/readyz")
+async def readyz():
+    """
+    Readiness : 200 une fois le moteur chaud et capable de répondre, 503 sinon
+    (chauffe en cours ou en échec, LLM injoignable). Corps : détail des étapes.
+    """
+    if warmup is None:
+        return JSONResponse(status_code=503, content={"status": Warmup.STARTING})
+    # La sonde du LLM est un appel HTTP bloquant
+    await asyncio.to_thread(warmup.recheck_llm)
+    ready = warmup.is_ready()
+    return JSONResponse(status_code=200 if ready else 503, content=warmup.report())
+
+@app.get("/status")
+async def status():
+    """Profondeur de file et compteurs de rejet du pool de requêtes, collections chaudes."""
+    current_rag = engine.current
+    batcher = current_rag.retrieval.query_batcher if current_rag else None
+    return {
+        "query_pool": executor.stats() if executor else None,
+        "query_batching": batcher.stats() if batcher else None,
+        "collections": engine.stats(),
+    }
+
+class IngestRequest(BaseModel):
+    """
+    Paramètres optionnels d'une ingestion.
+    on_conflict : conduite si la collection existe déjà avec d'autres paramètres.
+    """
+    on_conflict: Literal["keep", "overwrite"] = Field(default="keep")
+
+@app.post("/ingest", status_code=202)
+async def trigger_ingest(payload: Optional[IngestRequest] = None):
     """
     Endpoint pour déclencher la vectorisation AVANCÉE.
-    Utilise vectorize_with_config pour gérer les métadonnées et la création propre.
+    Soumet un job en tâche de fond (vectorize_with_config) et renvoie son identifiant
+    immédiatement ; l'avancement se consulte via GET /ingest/{job_id}.
     """
     try:
         # Chargement de la configuration fraîche
         config = GlobalConfig.load_config("config.json")
-        
-        # Création de l'instance RAG temporaire
-        ingest_rag = Rag(
-            model=config.rag.model,
-            base_url=config.rag.base_url,
-            api_key=config.rag.api_key,
-            path_doc=config.rag.paths.docs,
-            chroma_persist_dir=config.rag.paths.chroma_dir,
-            processed_texts_dir=config.rag.paths.cache
-        )
-        
-        col_name = config.rag.retrieval.collection_name
-        print(f" Début ingestion vers : {col_name} (via vectorize_with_config)")
-        
+        on_conflict = payload.on_conflict if payload else "keep"
 
-        success = ingest_rag.retrieval.vectorize_with_config(
-            chunk_size=config.rag.retrieval.chunk_size,
-            overlap=config.rag.retrieval.overlap,
-            collection_name=col_name,
-            source_folder=str(config.rag.paths.docs), 
-            model_name=config.rag.retrieval.embedding_model, 
-        )
-        
-        if success:
-            return {
-                "status": "Succès",
-                "collection": col_name,
-                "chunk_size": config.rag.retrieval.chunk_size,
-                "nb_files": "Voir logs" 
-            }
-        else:
-            return {"error": "Echec de la vectorisation (voir logs Docker)"}
+        job = ingest_jobs.submit(config, on_conflict=on_conflict)
+        return job.to_dict()
             
     except Exception as e:
         traceback.print_exc()
-        return {"error": str(e)}
+        return JSONResponse(status_code=500, content={"error": str(e)})
+
+@app.get("/ingest")
+async def list_ingest_jobs():
+    """Liste des jobs d'ingestion (les plus récents d'abord)."""
+    return {"jobs": ingest_jobs.list()}
+
+@app.get("/ingest/{job_id}")
+async def ingest_status(job_id: str):
+    """Statut et avancement d'un job : fichiers extraits, chunks vectorisés/écrits, ETA."""
+    job = ingest_jobs.get(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Job inconnu : {job_id}"})
+    return job.to_dict()
+
+@app.delete("/ingest/{job_id}")
+async def cancel_ingest(job_id: str):
+    """Demande l'annulation d'un job (effective au prochain fichier ou lot de chunks)."""
+    job = ingest_jobs.cancel(job_id)
+    if job is None:
+        return JSONResponse(status_code=404, content={"error": f"Job inconnu : {job_id}"})
+    return job.to_dict()
     
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
\ No newline at end of file
@@ -7,6 +7,7 @@ sys.path.insert(0, str(ROOT_DIR))
 
 
 from src.rag import Retrieval
+from src.rag.relevance import RelevanceGate
 
 def get_collection_metadata(collection) -> Dict[str, Any]:
     """
@@ -170,6 +171,8 @@ def benchmark_collections(
 
     rag_instance = Retrieval()
     client = rag_instance.chroma_storage.chroma_client
+    # Sélection adaptative (seuils par défaut) : taille du contexte qui irait au LLM
+    gate = RelevanceGate()
 
     results = []
 
@@ -208,8 +211,17 @@ def benchmark_collections(
 
             # Test de recherche
             start_time = time.time()
-            contexts, sources, scores = rag_instance.query(query, n=n_results)
+            hits, _ = rag_instance.query_hits(query, n=n_results)
             query_time = time.time() - start_time
+            contexts = [hit["batch"] for hit in hits]
+            sources = [hit["chemin"] for hit in hits]
+            scores = [hit["score_final"] for hit in hits]
+            # Mêmes scores que le filtre de l'API : similarité du retrieval, hors reranking
+            retrieval_scores = [hit["score_retrieval"] for hit in hits]
+            kept_indices = gate.keep(retrieval_scores)
+            kept = len(kept_indices)
+            context_chars = sum(len(c) for c in contexts)
+            kept_chars = sum(len(contexts[i]) for i in kept_indices)
 
             result = {
                 "config_name": col_name,
@@ -221,6 +233,10 @@ def benchmark_collections(
                 "query_time": query_time,
                 "best_score": scores[0] if scores else 0,
                 "avg_score": sum(scores) / len(scores) if scores else 0,
+                "best_retrieval_score": max(retrieval_scores) if retrieval_scores else 0,
+                "kept_chunks": kept,
+                "context_chars": context_chars,
+                "kept_chars": kept_chars,
                 "top_context": contexts[0][:150] + "..." if contexts else "",
                 "top_source": sources[0] if sources else "N/A",
                 "created_by": params.get("created_by", "N/A"),
@@ -235,6 +251,14 @@ def benchmark_collections(
                 print(f"   • Temps recherche : {query_time:.3f}s")
                 print(f"   • Score top-1 : {result['best_score']:.3f}")
                 print(f"   • Score moyen : {result['avg_score']:.3f}")
+                print(f"   • Similarité top-1 (seuils du filtre) : {result['best_retrieval_score']:.3f}")
+                if kept == 0:
+                    print("   • Sélection adaptative : aucun chunk pertinent, réponse sans LLM")
+                else:
+                    print(
+                        f"   • Sélection adaptative : {kept}/{len(scores)} chunks, "
+                        f"contexte {kept_chars} / {context_chars} caractères"
+                    )
 
         except Exception as e:
             if verbose:
@@ -327,6 +351,13 @@ def benchmark_multiple_queries(
     return all_results
 
 
+def _context_ratio(result: Dict[str, Any]) -> str:
+    """Part du contexte gardée par la sélection adaptative (en caractères)."""
+    if not result["context_chars"]:
+        return "N/A"
+    return f"{result['kept_chars'] / result['context_chars'] * 100:.0f}%"
+
+
 def print_comparison_table(results: List[Dict[str, Any]], title: str = "RÉSULTATS"):
     """
     Affiche le tableau comparatif formaté.
@@ -347,7 +378,7 @@ def print_comparison_table(results: List[Dict[str, Any]], title: str = "RÉSULTA
     # En-tête
     print(
         f"{'Collection':<25} {'Size':<8} {'Overlap':<10} {'Chunks':<10} "
-        f"{'Files':<8} {'Temps (s)':<12} {'Score':<8}"
+        f"{'Files':<8} {'Temps (s)':<12} {'Score':<8} {'Gardés':<8} {'Contexte':<10}"
     )
     print("-" * 110)
 
@@ -361,7 +392,8 @@ def print_comparison_table(results: List[Dict[str, Any]], title: str = "RÉSULTA
         print(
             f"{r['config_name']:<25} {size_str:<8} {overlap_str:<10} "
             f"{r['total_chunks']:<10} {r['total_files']:<8} "
-            f"{r['query_time']:<12.3f} {r['best_score']:<8.3f}"
+            f"{r['query_time']:<12.3f} {r['best_score']:<8.3f} "
+            f"{r['kept_chunks']:<8} {_context_ratio(r):<10}"
         )
 
     # Recommandations
@@ -476,7 +508,8 @@ def export_results(
             f.write(f"   Chunk size : {r['chunk_size'] or 'N/A'}\n")
             f.write(f"   Overlap : {r['overlap'] * 100 if r['overlap'] else 'N/A'}%\n")
             f.write(f"   Score : {r['best_score']:.3f}\n")
-            f.write(f"   Temps : {r['query_time']:.3f}s\n\n")
+            f.write(f"   Temps : {r['query_time']:.3f}s\n")
+            f.write(f"   Chunks gardés : {r['kept_chunks']} (contexte : {_context_ratio(r)})\n\n")
 
     print(f"\nRésultats exportés : {filename}")
 
@@ -496,7 +529,10 @@ def export_multi_query_results(
             f.write("-" * 100 + "\n")
 
             for r in results:
-                f.write(f"{r['config_name']:<30} Score: {r['best_score']:.3f}\n")
+                f.write(
+                    f"{r['config_name']:<30} Score: {r['best_score']:.3f}   "
+                    f"Gardés: {r['kept_chunks']} ({_context_ratio(r)})\n"
+                )
 
             if results:
                 best = max(results, key=lambda x: x["best_score"])
@@ -0,0 +1,284 @@
+"""
+Test de charge de l'API RAG (main.py), de bout en bout.
+
+Envoie des questions sur /query à concurrence fixe (boucle fermée) ou à débit cible
+(boucle ouverte, --rps), puis rapporte le débit, les codes de réponse et les
+latences p50 / p95 / p99 par étape, lues dans l'en-tête Server-Timing de l'API,
+ainsi que la taille du contexte envoyé au LLM (chunks, tokens, taux de compression)
+et les modes de réponse.
+Avec --compare, les écarts avec un rapport précédent (--json) sont affichés : par
+exemple avant / après la sélection adaptative des chunks (rag.relevance.enabled).
+
+Avec scripts/mock_llm_server.py à la place de llama.cpp, la capacité se mesure sur
+n'importe quelle machine Linux, sans GPU.
+
+Usage :
+    python scripts/mock_llm_server.py --port 8080 &
+    python main.py &
+    python scripts/load_generator.py --concurrency 8 --duration 60
+    python scripts/load_generator.py --rps 2 --requests 200 --json logs/load_generator.json
+    python scripts/load_generator.py --rps 2 --requests 200 --compare logs/load_generator.json
+"""
+import json
+import time
+import random
+import asyncio
+import argparse
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
+
+DEFAULT_QUESTIONS = [
+    "Quels sont les droits des agents en matière de congés ?",
+    "Comment est calculée la prime annuelle ?",
+    "Quelle est la durée de la période d'essai ?",
+    "Qui contacter en cas d'accident du travail ?",
+    "Quelles sont les règles du télétravail ?",
+    "Comment demander une formation ?",
+    "Quel est le délai de préavis en cas de démission ?",
+    "Les heures supplémentaires sont-elles majorées ?",
+]
+
+
+def parse_server_timing(header: Optional[str]) -> Dict[str, float]:
+    """'retrieval;dur=12.3, llm;dur=840.0, app;dur=860.1' -> {étape: secondes}"""
+    stages: Dict[str, float] = {}
+    if not header:
+        return stages
+    for part in header.split(","):
+        name, _, params = part.strip().partition(";")
+        for param in params.split(";"):
+            key, _, value = param.strip().partition("=")
+            if key == "dur":
+                try:
+                    stages[name] = stages.get(name, 0.0) + float(value) / 1000
+                except ValueError:
+                    pass
+    return stages
+
+
+def percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    index = min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))
+    return ordered[index]
+
+
+class LoadTest:
+    """Génère la charge et agrège les mesures."""
+
+    def __init__(self, args: argparse.Namespace, questions: List[str]):
+        self.args = args
+        self.questions = questions
+        self.stages: Dict[str, List[float]] = {}
+        self.context: Dict[str, List[float]] = {"chunks": [], "context_tokens": [], "compression_ratio": []}
+        self.modes: Dict[str, int] = {}
+        self.statuses: Dict[str, int] = {}
+        self.sent = 0
+        self.started = 0.0
+        self.finished = 0.0
+
+    def _stop(self) -> bool:
+        if self.args.requests is not None and self.sent >= self.args.requests:
+            return True
+        return time.perf_counter() - self.started >= self.args.duration
+
+    def _payload(self) -> dict:
+        payload = {"query": random.choice(self.questions), "priority": self.args.priority}
+        if self.args.collection:
+            payload["collection"] = self.args.collection
+        return payload
+
+    async def _one(self, client: httpx.AsyncClient):
+        self.sent += 1
+        t0 = time.perf_counter()
+        try:
+            response = await client.post(self.args.path, json=self._payload())
+            status = str(response.status_code)
+            timings = parse_server_timing(response.headers.get("server-timing"))
+            body = response.json() if status == "200" else {}
+        except (httpx.HTTPError, ValueError) as e:
+            status = type(e).__name__
+            timings, body = {}, {}
+        elapsed = time.perf_counter() - t0
+
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+        if status != "200":
+            return
+        # "client" : latence vue par l'appelant (réseau + file d'attente comprises)
+        timings["client"] = elapsed
+        for stage, seconds in timings.items():
+            self.stages.setdefault(stage, []).append(seconds)
+        mode = str(body.get("mode"))
+        self.modes[mode] = self.modes.get(mode, 0) + 1
+        for key, values in self.context.items():
+            if body.get(key) is not None:
+                values.append(body[key])
+
+    async def _closed_loop(self, client: httpx.AsyncClient):
+        async def worker():
+            while not self._stop():
+                await self._one(client)
+
+        await asyncio.gather(*(worker() for _ in range(self.args.concurrency)))
+
+    async def _open_loop(self, client: httpx.AsyncClient):
+        interval = 1.0 / self.args.rps
+        pending = set()
+        next_at = time.perf_counter()
+        while not self._stop():
+            # Arrivées poissoniennes : les requêtes partent sans attendre les précédentes
+            task = asyncio.create_task(self._one(client))
+            pending.add(task)
+            task.add_done_callback(pending.discard)
+            next_at += random.expovariate(1.0 / interval)
+            await asyncio.sleep(max(0.0, next_at - time.perf_counter()))
+        if pending:
+            await asyncio.gather(*pending)
+
+    async def run(self):
+        limits = httpx.Limits(max_connections=max(self.args.concurrency, 100))
+        timeout = httpx.Timeout(self.args.timeout)
+        async with httpx.AsyncClient(base_url=self.args.url, limits=limits, timeout=timeout) as client:
+            self.started = time.perf_counter()
+            if self.args.rps:
+                await self._open_loop(client)
+            else:
+                await self._closed_loop(client)
+            self.finished = time.perf_counter()
+
+    def report(self) -> dict:
+        elapsed = max(self.finished - self.started, 1e-9)
+        ok = self.statuses.get("200", 0)
+        stages = {
+            stage: {
+                "count": len(values),
+                "mean_ms": round(sum(values) / len(values) * 1000, 1),
+                "p50_ms": round(percentile(values, 0.50) * 1000, 1),
+                "p95_ms": round(percentile(values, 0.95) * 1000, 1),
+                "p99_ms": round(percentile(values, 0.99) * 1000, 1),
+            }
+            for stage, values in self.stages.items()
+        }
+        return {
+            "mode": f"rps={self.args.rps}" if self.args.rps else f"concurrency={self.args.concurrency}",
+            "duration_s": round(elapsed, 2),
+            "requests": self.sent,
+            "statuses": self.statuses,
+            "throughput_rps": round(ok / elapsed, 3),
+            "stages": stages,
+            "modes": self.modes,
+            "context": {
+                key: {
+                    "mean": round(sum(values) / len(values), 3),
+                    "p50": percentile(values, 0.50),
+                    "p95": percentile(values, 0.95),
+                }
+                for key, values in self.context.items()
+                if values
+            },
+        }
+
+
+def print_report(report: dict):
+    print("\n" + "=" * 80)
+    print(f" TEST DE CHARGE ({report['mode']}, {report['duration_s']} s)")
+    print("=" * 80)
+    print(f" Requêtes envoyées : {report['requests']}")
+    print(f" Codes de réponse  : {report['statuses']}")
+    print(f" Débit (200)       : {report['throughput_rps']} req/s\n")
+    print(f" {'Étape':<20}{'n':>7}{'moy.':>11}{'p50':>11}{'p95':>11}{'p99':>11}   (ms)")
+    print(" " + "-" * 78)
+    for stage, s in report["stages"].items():
+        print(
+            f" {stage:<20}{s['count']:>7}{s['mean_ms']:>11}{s['p50_ms']:>11}"
+            f"{s['p95_ms']:>11}{s['p99_ms']:>11}"
+        )
+    if report.get("context"):
+        print(f"\n Modes de réponse  : {report['modes']}")
+        print(f" {'Contexte LLM':<20}{'moy.':>11}{'p50':>11}{'p95':>11}")
+        print(" " + "-" * 52)
+        for key, s in report["context"].items():
+            print(f" {key:<20}{s['mean']:>11}{s['p50']:>11}{s['p95']:>11}")
+    print()
+
+
+def print_comparison(report: dict, baseline: dict):
+    """Écarts (en %) avec un rapport précédent : latences par étape et taille du contexte."""
+
+    def delta(new: float, old: float) -> str:
+        return f"{(new - old) / old * 100:+.1f}%" if old else "n/a"
+
+    print(f" COMPARAISON avec le rapport de référence ({baseline['mode']})")
+    print(f" {'':<20}{'moy.':>11}{'p50':>11}{'p95':>11}")
+    print(" " + "-" * 52)
+    for key, s in report.get("context", {}).items():
+        old = baseline.get("context", {}).get(key)
+        if old:
+            print(f" {key:<20}{delta(s['mean'], old['mean']):>11}{delta(s['p50'], old['p50']):>11}{delta(s['p95'], old['p95']):>11}")
+    for stage, s in report["stages"].items():
+        old = baseline.get("stages", {}).get(stage)
+        if old:
+            print(
+                f" {stage:<20}{delta(s['mean_ms'], old['mean_ms']):>11}"
+                f"{delta(s['p50_ms'], old['p50_ms']):>11}{delta(s['p95_ms'], old['p95_ms']):>11}"
+            )
+    print()
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Test de charge de l'API RAG")
+    parser.add_argument("--url", default="http://127.0.0.1:8000", help="Adresse de l'API")
+    parser.add_argument("--path", default="/query", help="Endpoint visé")
+    parser.add_argument("--concurrency", type=int, default=4, help="Requêtes simultanées (boucle fermée)")
+    parser.add_argument("--rps", type=float, default=None, help="Débit cible (boucle ouverte, remplace --concurrency)")
+    parser.add_argument("--duration", type=float, default=30.0, help="Durée du test (s)")
+    parser.add_argument("--requests", type=int, default=None, help="Nombre de requêtes (prioritaire sur --duration)")
+    parser.add_argument("--questions", type=Path, default=None, help="Fichier de questions (une par ligne)")
+    parser.add_argument("--collection", default=None, help="Collection interrogée (défaut : celle de l'API)")
+    parser.add_argument(
+        "--priority", choices=("interactive", "batch"), default="batch",
+        help="Priorité des requêtes face aux slots LLM (batch : passe après les vraies questions)",
+    )
+    parser.add_argument("--timeout", type=float, default=600.0, help="Délai max par requête (s)")
+    parser.add_argument("--json", type=Path, default=None, help="Écrit le rapport JSON dans ce fichier")
+    parser.add_argument("--compare", type=Path, default=None, help="Rapport JSON de référence (écarts de latence et de contexte)")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+    if args.concurrency < 1 or (args.rps is not None and args.rps <= 0):
+        parser.error("--concurrency doit être >= 1 et --rps > 0")
+    if args.requests is not None:
+        args.duration = float("inf")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+
+    questions = DEFAULT_QUESTIONS
+    if args.questions:
+        questions = [
+            line.strip()
+            for line in args.questions.read_text(encoding="utf-8").splitlines()
+            if line.strip()
+        ]
+
+    test = LoadTest(args, questions)
+    asyncio.run(test.run())
+    report = test.report()
+    print_report(report)
+    if args.compare:
+        print_comparison(report, json.loads(args.compare.read_text(encoding="utf-8")))
+
+    if args.json:
+        args.json.parent.mkdir(parents=True, exist_ok=True)
+        args.json.write_text(json.dumps(report, ensure_ascii=False, indent=2), encoding="utf-8")
+        print(f" Rapport écrit dans {args.json}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""
+Faux serveur LLM compatible OpenAI (imite llama.cpp), pour les tests de charge.
+
+Simule un serveur llama.cpp sans GPU ni modèle : délai de prefill proportionnel aux
+tokens du prompt, vitesse de génération, gigue, slots parallèles limités et injection
+d'erreurs, en mode normal et en streaming (SSE). Les réponses portent "usage" et les
+"timings" de llama.cpp (prompt_n, cache_n...), avec un cache de préfixe simplifié.
+
+Usage :
+    python scripts/mock_llm_server.py --port 8080 --prefill-ms-per-token 0.5 --tokens-per-s 20
+    # puis base_url = "http://127.0.0.1:8080/v1" (ou plusieurs ports dans base_urls)
+"""
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from typing import List, Optional
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+FILLER = (
+    "D'après les documents fournis, la réponse se trouve dans le passage cité [1]. "
+    "Les conditions sont précisées dans le texte de référence [2]. "
+)
+
+
+class MockLLM:
+    """Comportement du faux serveur (délais, erreurs, slots, cache de préfixe)."""
+
+    def __init__(self, args: argparse.Namespace):
+        self.args = args
+        self.slots = asyncio.Semaphore(args.slots)
+        self.busy = 0
+        self.requests = 0
+        self.errors = 0
+        # Préfixe (message système) gardé en cache par slot, comme le cache KV de llama.cpp
+        self.cached_prefixes: List[Optional[str]] = [None] * args.slots
+
+    @staticmethod
+    def count_tokens(text: str) -> int:
+        return max(1, int(len(text) / 3.5))
+
+    def jitter(self, seconds: float) -> float:
+        return max(0.0, seconds * random.uniform(1 - self.args.jitter, 1 + self.args.jitter))
+
+    def take_slot(self, requested: Optional[int]) -> int:
+        # Slot demandé (id_slot) s'il est valide, sinon chacun son tour
+        if requested is not None and 0 <= requested < self.args.slots:
+            return requested
+        return self.requests % self.args.slots
+
+    def answer_tokens(self, max_tokens: Optional[int]) -> List[str]:
+        n = self.args.completion_tokens
+        if max_tokens:
+            n = min(n, max_tokens)
+        words = (FILLER * (n // 20 + 1)).split(" ")
+        return [word + " " for word in words[:n]]
+
+    async def prefill(self, body: dict):
+        """Simule l'évaluation du prompt ; renvoie les compteurs façon llama.cpp."""
+        messages = body.get("messages") or []
+        system = next((m.get("content", "") for m in messages if m.get("role") == "system"), "")
+        prompt = "".join(m.get("content", "") for m in messages)
+        prompt_tokens = self.count_tokens(prompt)
+
+        slot = self.take_slot(body.get("id_slot"))
+        cache_n = 0
+        if body.get("cache_prompt") and system and self.cached_prefixes[slot] == system:
+            cache_n = self.count_tokens(system)
+        self.cached_prefixes[slot] = system
+
+        evaluated = max(1, prompt_tokens - cache_n)
+        prompt_s = self.jitter(evaluated * self.args.prefill_ms_per_token / 1000)
+        await asyncio.sleep(prompt_s)
+        return prompt_tokens, evaluated, cache_n, prompt_s
+
+    def maybe_fail(self) -> Optional[JSONResponse]:
+        if random.random() < self.args.error_rate:
+            self.errors += 1
+            return JSONResponse(
+                status_code=self.args.error_status,
+                content={"error": {"message": "erreur injectée", "type": "server_error"}},
+            )
+        return None
+
+    @staticmethod
+    def timings(evaluated: int, cache_n: int, prompt_s: float, predicted: int, predicted_s: float) -> dict:
+        return {
+            "prompt_n": evaluated,
+            "cache_n": cache_n,
+            "prompt_ms": round(prompt_s * 1000, 3),
+            "predicted_n": predicted,
+            "predicted_ms": round(predicted_s * 1000, 3),
+        }
+
+
+def create_app(args: argparse.Namespace) -> FastAPI:
+    app = FastAPI(title="Mock LLM")
+    mock = MockLLM(args)
+
+    @app.get("/health")
+    async def health():
+        return {"status": "ok"}
+
+    @app.get("/slots")
+    async def slots():
+        return [
+            {"id": i, "is_processing": i < mock.busy}
+            for i in range(args.slots)
+        ]
+
+    @app.get("/v1/models")
+    async def models():
+        return {"object": "list", "data": [{"id": args.model, "object": "model", "owned_by": "mock"}]}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        mock.requests += 1
+        failure = mock.maybe_fail()
+        if failure is not None:
+            return failure
+
+        created = int(time.time())
+        completion_id = f"chatcmpl-{uuid.uuid4().hex[:12]}"
+        tokens = mock.answer_tokens(body.get("max_tokens"))
+        # Réponse coupée par max_tokens : "length", comme llama.cpp
+        finish_reason = "length" if len(tokens) < args.completion_tokens else "stop"
+        token_s = 1.0 / args.tokens_per_s
+
+        if not body.get("stream"):
+            async with mock.slots:
+                mock.busy += 1
+                try:
+                    prompt_tokens, evaluated, cache_n, prompt_s = await mock.prefill(body)
+                    predicted_s = mock.jitter(len(tokens) * token_s)
+                    await asyncio.sleep(predicted_s)
+                finally:
+                    mock.busy -= 1
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": args.model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(tokens).strip()},
+                    "finish_reason": finish_reason,
+                }],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(tokens),
+                    "total_tokens": prompt_tokens + len(tokens),
+                },
+                "timings": mock.timings(evaluated, cache_n, prompt_s, len(tokens), predicted_s),
+            }
+
+        async def events():
+            async with mock.slots:
+                mock.busy += 1
+                try:
+                    _, evaluated, cache_n, prompt_s = await mock.prefill(body)
+                    t0 = time.perf_counter()
+                    for token in tokens:
+                        await asyncio.sleep(mock.jitter(token_s))
+                        chunk = {
+                            "id": completion_id,
+                            "object": "chat.completion.chunk",
+                            "created": created,
+                            "model": args.model,
+                            "choices": [{"index": 0, "delta": {"content": token}, "finish_reason": None}],
+                        }
+                        yield f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n"
+                    last = {
+                        "id": completion_id,
+                        "object": "chat.completion.chunk",
+                        "created": created,
+                        "model": args.model,
+                        "choices": [{"index": 0, "delta": {}, "finish_reason": finish_reason}],
+                        "timings": mock.timings(
+                            evaluated, cache_n, prompt_s, len(tokens), time.perf_counter() - t0
+                        ),
+                    }
+                    yield f"data: {json.dumps(last)}\n\n"
+                    yield "data: [DONE]\n\n"
+                finally:
+                    mock.busy -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    return app
+
+
+def parse_args(argv=None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Faux serveur LLM compatible OpenAI (llama.cpp)")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--model", default="Meta-Llama-3.1-8B-Instruct-Q4_K_M.gguf")
+    parser.add_argument("--prefill-ms-per-token", type=float, default=0.5, help="Délai de prefill par token de prompt (ms)")
+    parser.add_argument("--tokens-per-s", type=float, default=20.0, help="Vitesse de génération")
+    parser.add_argument("--completion-tokens", type=int, default=120, help="Longueur des réponses (tokens)")
+    parser.add_argument("--jitter", type=float, default=0.1, help="Gigue relative des délais (0.1 = ±10 %%)")
+    parser.add_argument("--slots", type=int, default=4, help="Requêtes traitées en parallèle (--parallel de llama.cpp)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Proportion de requêtes en erreur")
+    parser.add_argument("--error-status", type=int, default=500, help="Code HTTP des erreurs injectées")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args(argv)
+    if args.tokens_per_s <= 0 or args.slots < 1:
+        parser.error("--tokens-per-s doit être > 0 et --slots >= 1")
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    if args.seed is not None:
+        random.seed(args.seed)
+    print(
+        f" [MockLLM] http://{args.host}:{args.port}/v1 : {args.slots} slots, "
+        f"prefill {args.prefill_ms_per_token} ms/token, {args.tokens_per_s} tokens/s, "
+        f"erreurs {args.error_rate * 100:.0f} %"
+    )
+    uvicorn.run(create_app(args), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -3,25 +3,30 @@ Package RAG (Retrieval-Augmented Generation)
 Système de récupération et génération augmentée par documents
 """
 
-# Import des modules principaux
-from .chroma_storage import ChromaStorage
-from .document_processor import DocumentProcessor
-from .llm import LLM
-from .ocr_processor import PDFOCRProcessor
-from .rerank import Reranker
-from .retrieval import Retrieval
-from .vectorizor import Vectorizor
-from .rag import Rag
+import importlib
+
+# Exports publics et leur module. Importés à la demande (PEP 562) : les modules légers
+# (relevance, singleflight, answer_cache...) s'importent sans chromadb ni torch.
+_EXPORTS = {
+    'ChromaStorage': '.chroma_storage',
+    'DocumentProcessor': '.document_processor',
+    'LLM': '.llm',
+    'PDFOCRProcessor': '.ocr_processor',
+    'Reranker': '.rerank',
+    'Retrieval': '.retrieval',
+    'Vectorizor': '.vectorizor',
+    'Rag': '.rag',
+    'RagEngine': '.engine',
+}
+
+
+def __getattr__(name):
+    if name not in _EXPORTS:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    value = getattr(importlib.import_module(_EXPORTS[name], __name__), name)
+    globals()[name] = value
+    return value
 
 
 # Liste des exports publics
-__all__ = [
-    'ChromaStorage',
-    'DocumentProcessor',
-    'LLM',
-    'PDFOCRProcessor',
-    'Reranker',
-    'Retrieval',
-    'Vectorizor',
-    'Rag',
-]
\ No newline at end of file
+__all__ = list(_EXPORTS)
@@ -0,0 +1,148 @@
+import asyncio
+import contextvars
+import functools
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+
+from . import deadline
+
+
+class SaturatedError(RuntimeError):
+    """Levée quand la file d'attente est pleine ou que l'attente dépasse le délai."""
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueryExecutor:
+    """
+    Pool de threads borné + contrôle d'admission pour le chemin /query.
+
+    La préparation de la réponse est bloquante (encodage torch, recherche HNSW,
+    reranking, rendu du prompt) : on l'exécute hors de la boucle asyncio pour que l'API
+    reste réactive. La génération, elle, passe par le client LLM asynchrone sans
+    occuper de thread : `max_workers` se dimensionne sur le retrieval, pas sur la
+    latence du LLM.
+    Au plus `max_in_flight` requêtes sont traitées en même temps, au plus `max_queue`
+    attendent leur tour ; au-delà, la requête est rejetée immédiatement.
+    """
+
+    def __init__(
+        self,
+        max_workers: int = 4,
+        max_in_flight: int = 4,
+        max_queue: int = 16,
+        max_queue_wait_s: float = 10.0,
+        retry_after_s: int = 5,
+    ):
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight
+        self.max_queue = max_queue
+        self.max_queue_wait_s = max_queue_wait_s
+        self.retry_after_s = retry_after_s
+
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="rag-query"
+        )
+        self._semaphore = None  # Créé dans la boucle asyncio au premier usage
+
+        # Compteurs (lus par /status)
+        self.in_flight = 0
+        self.waiting = 0
+        self.completed = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    @classmethod
+    def from_settings(cls, settings) -> "QueryExecutor":
+        """Construit l'exécuteur depuis une ServerSettings."""
+        return cls(
+            max_workers=settings.max_workers,
+            max_in_flight=settings.max_in_flight,
+            max_queue=settings.max_queue,
+            max_queue_wait_s=settings.max_queue_wait_s,
+            retry_after_s=settings.retry_after_s,
+        )
+
+    async def acquire(self):
+        """
+        Réserve une place de traitement (à libérer avec release()).
+
+        Raises:
+            SaturatedError: si la file est pleine ou si l'attente est trop longue.
+            DeadlineExceeded: si l'échéance de la requête arrive pendant l'attente.
+        """
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        if self.in_flight + self.waiting >= self.max_in_flight + self.max_queue:
+            self.rejected_queue_full += 1
+            raise SaturatedError("File d'attente pleine", self.retry_after_s)
+
+        # On n'attend pas une place au-delà de l'échéance de la requête
+        wait_s = self.max_queue_wait_s
+        remaining = deadline.remaining()
+        if remaining is not None:
+            wait_s = min(wait_s, remaining)
+
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(self._semaphore.acquire(), timeout=wait_s)
+        except asyncio.TimeoutError:
+            self.rejected_timeout += 1
+            if deadline.expired():
+                raise deadline.exceeded("queue")
+            raise SaturatedError("Attente en file trop longue", self.retry_after_s)
+        finally:
+            self.waiting -= 1
+
+        self.in_flight += 1
+
+    def release(self):
+        """Libère une place réservée par acquire()."""
+        self.in_flight -= 1
+        self.completed += 1
+        self._semaphore.release()
+
+    @asynccontextmanager
+    async def admit(self):
+        """Réserve une place de traitement pour la durée du bloc `async with`."""
+        await self.acquire()
+        try:
+            yield
+        finally:
+            self.release()
+
+    async def run(self, fn, *args, **kwargs):
+        """
+        Exécute une fonction bloquante dans le pool et attend son résultat.
+        Le contexte (trace et échéance de la requête) suit l'appel dans le thread.
+        """
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        return await loop.run_in_executor(
+            self._pool, functools.partial(context.run, self._run_checked, fn, *args, **kwargs)
+        )
+
+    @staticmethod
+    def _run_checked(fn, *args, **kwargs):
+        # L'échéance a pu passer pendant l'attente d'un thread libre : inutile de commencer
+        deadline.check("pool")
+        return fn(*args, **kwargs)
+
+    def stats(self) -> dict:
+        """Profondeur de file et compteurs de rejet, pour dimensionner le déploiement."""
+        return {
+            "max_workers": self.max_workers,
+            "max_in_flight": self.max_in_flight,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.waiting,
+            "completed": self.completed,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
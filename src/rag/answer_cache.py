@@ -0,0 +1,228 @@
+import re
+import sys
+import time
+import hashlib
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, List, Optional, Sequence
+
+import numpy as np
+
+from .metrics import CACHE_REQUESTS
+
+
+def normalize_query(query: str) -> str:
+    """Forme canonique d'une question : casse, espaces et ponctuation finale ignorés."""
+    text = unicodedata.normalize("NFKC", query or "").lower()
+    text = re.sub(r"\s+", " ", text).strip()
+    return text.rstrip(" ?!.;:")
+
+
+class _Entry:
+    __slots__ = ("answer", "context_key", "embedding", "created_at", "size")
+
+    def __init__(self, answer: str, context_key: str, embedding: Optional[np.ndarray]):
+        self.answer = answer
+        self.context_key = context_key
+        self.embedding = embedding
+        self.created_at = time.monotonic()
+        self.size = sys.getsizeof(answer) + (embedding.nbytes if embedding is not None else 0)
+
+
+class AnswerCache:
+    """
+    Cache des réponses du LLM, placé devant la génération.
+
+    Clé = collection + question normalisée + ids des chunks retrouvés + empreinte du
+    template (+ modèle LLM) : si l'index change, les chunks retrouvés changent et
+    l'ancienne réponse n'est plus jamais servie. Éviction LRU, durée de vie (TTL) et
+    borne mémoire.
+
+    Mode sémantique (optionnel) : une question reformulée réutilise une réponse si son
+    embedding est à moins d'un seuil cosinus d'une question en cache ET que le
+    retrieval renvoie exactement les mêmes chunks.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        max_mb: float = 64.0,
+        ttl_s: float = 3600.0,
+        semantic: bool = False,
+        semantic_threshold: float = 0.95,
+    ):
+        """
+        Args:
+            max_entries (int): Nombre maximal de réponses gardées
+            max_mb (float): Mémoire maximale (réponses + embeddings), en Mo
+            ttl_s (float): Durée de vie d'une réponse
+            semantic (bool): Active la recherche de questions quasi identiques
+            semantic_threshold (float): Similarité cosinus minimale en mode sémantique
+        """
+        self.max_entries = max_entries
+        self.max_bytes = int(max_mb * 1024 * 1024)
+        self.ttl_s = ttl_s
+        self.semantic = semantic
+        self.semantic_threshold = semantic_threshold
+
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        # Mode sémantique : clés des entrées partageant un même contexte (mêmes chunks)
+        self._by_context: Dict[str, List[str]] = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+        self.evictions = 0
+
+    @classmethod
+    def from_settings(cls, settings) -> "AnswerCache":
+        """Construit le cache depuis une AnswerCacheSettings."""
+        return cls(
+            max_entries=settings.max_entries,
+            max_mb=settings.max_mb,
+            ttl_s=settings.ttl_s,
+            semantic=settings.semantic,
+            semantic_threshold=settings.semantic_threshold,
+        )
+
+    @staticmethod
+    def _digest(*parts) -> str:
+        return hashlib.sha256("\x1f".join(str(p) for p in parts).encode("utf-8")).hexdigest()
+
+    @classmethod
+    def context_key(
+        cls, collection: str, chunk_ids: Sequence[str], template_hash: str, model: str
+    ) -> str:
+        """Tout ce dont dépend la réponse, hors formulation de la question."""
+        return cls._digest(collection, ",".join(chunk_ids), template_hash, model)
+
+    @classmethod
+    def key(cls, query: str, context_key: str) -> str:
+        return cls._digest(normalize_query(query), context_key)
+
+    def get(
+        self, query: str, context_key: str, embedding: Optional[np.ndarray] = None
+    ) -> Optional[str]:
+        """
+        Returns:
+            str | None: Réponse en cache pour cette question et ce contexte, ou None.
+        """
+        key = self.key(query, context_key)
+        with self._lock:
+            entry = self._lookup_locked(key)
+            if entry is not None:
+                CACHE_REQUESTS.inc(cache="answers", result="hit")
+                return entry.answer
+            CACHE_REQUESTS.inc(cache="answers", result="miss")
+
+            if not self.semantic or embedding is None:
+                return None
+            entry = self._semantic_lookup_locked(context_key, embedding)
+            CACHE_REQUESTS.inc(
+                cache="answers_semantic", result="hit" if entry is not None else "miss"
+            )
+            return entry.answer if entry is not None else None
+
+    def put(
+        self,
+        query: str,
+        context_key: str,
+        answer: str,
+        embedding: Optional[np.ndarray] = None,
+    ):
+        key = self.key(query, context_key)
+        if embedding is not None and self.semantic:
+            embedding = np.asarray(embedding, dtype=np.float32)
+            norm = float(np.linalg.norm(embedding))
+            embedding = embedding / norm if norm > 0 else None
+        else:
+            embedding = None
+
+        entry = _Entry(answer, context_key, embedding)
+        if entry.size > self.max_bytes:
+            return
+
+        with self._lock:
+            self._remove_locked(key)
+            self._entries[key] = entry
+            self._bytes += entry.size
+            if embedding is not None:
+                self._by_context.setdefault(context_key, []).append(key)
+            while self._entries and (
+                len(self._entries) > self.max_entries or self._bytes > self.max_bytes
+            ):
+                oldest = next(iter(self._entries))
+                self._remove_locked(oldest)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_context.clear()
+            self._bytes = 0
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "size_mb": round(self._bytes / 1024 / 1024, 3),
+                "max_entries": self.max_entries,
+                "max_mb": round(self.max_bytes / 1024 / 1024, 3),
+                "ttl_s": self.ttl_s,
+                "semantic": self.semantic,
+                "evictions": self.evictions,
+                "hits": CACHE_REQUESTS.value(cache="answers", result="hit"),
+                "misses": CACHE_REQUESTS.value(cache="answers", result="miss"),
+                "semantic_hits": CACHE_REQUESTS.value(cache="answers_semantic", result="hit"),
+            }
+
+    # --- Interne (appelé sous verrou) ---
+
+    def _expired(self, entry: _Entry) -> bool:
+        return time.monotonic() - entry.created_at > self.ttl_s
+
+    def _lookup_locked(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry):
+            self._remove_locked(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def _semantic_lookup_locked(self, context_key: str, embedding: np.ndarray) -> Optional[_Entry]:
+        keys = self._by_context.get(context_key)
+        if not keys:
+            return None
+
+        query = np.asarray(embedding, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if norm == 0:
+            return None
+        query = query / norm
+
+        best_key, best_score = None, self.semantic_threshold
+        for key in list(keys):
+            entry = self._lookup_locked(key)
+            if entry is None or entry.embedding is None:
+                continue
+            score = float(np.dot(query, entry.embedding))
+            if score >= best_score:
+                best_key, best_score = key, score
+
+        if best_key is None:
+            return None
+        self._entries.move_to_end(best_key)
+        return self._entries[best_key]
+
+    def _remove_locked(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        self._bytes -= entry.size
+        keys = self._by_context.get(entry.context_key)
+        if keys is not None and key in keys:
+            keys.remove(key)
+            if not keys:
+                del self._by_context[entry.context_key]
@@ -0,0 +1,146 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+from .metrics import QUERY_BATCH_SIZE, QUERY_BATCH_WAIT, stage_timer
+
+
+class _PendingQuery:
+    __slots__ = ("query", "future", "enqueued_at")
+
+    def __init__(self, query: str):
+        self.query = query
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+
+
+class QueryBatcher:
+    """
+    Micro-batching des embeddings de requêtes.
+
+    Les requêtes qui arrivent dans une courte fenêtre (window_ms) sont regroupées,
+    jusqu'à max_batch_size, et encodées en un seul appel model.encode() au lieu
+    d'une passe batch=1 par requête. Si aucune autre requête n'est en cours,
+    le lot part immédiatement : pas de latence ajoutée à faible charge.
+    """
+
+    def __init__(self, vectorizor, window_ms: float = 5.0, max_batch_size: int = 16):
+        """
+        Args:
+            vectorizor (Vectorizor): Vectorizor dont le modèle courant encode les lots
+            window_ms (float): Attente maximale pour compléter un lot
+            max_batch_size (int): Taille maximale d'un lot
+        """
+        self.vectorizor = vectorizor
+        self.window_s = window_ms / 1000.0
+        self.max_batch_size = max_batch_size
+
+        # Histogrammes partagés (exposés sur /metrics)
+        self.batch_size_histogram = QUERY_BATCH_SIZE
+        self.queue_wait_histogram = QUERY_BATCH_WAIT
+
+        self._queue: "queue.Queue" = queue.Queue()
+        self._lock = threading.Lock()
+        self._callers = 0  # Appels à encode_query() en attente de leur vecteur
+        self._stopped = False
+
+        self._thread = threading.Thread(
+            target=self._loop, name="rag-query-batcher", daemon=True
+        )
+        self._thread.start()
+
+    def encode_query(self, query: str) -> np.ndarray:
+        """Même contrat que Vectorizor.encode_query(), mais mutualisé entre threads."""
+        with self._lock:
+            if self._stopped:
+                pending = None
+            else:
+                pending = _PendingQuery(query)
+                self._callers += 1
+                self._queue.put(pending)
+
+        if pending is None:
+            return self.vectorizor.encode_query(query)
+
+        try:
+            return pending.future.result()
+        finally:
+            with self._lock:
+                self._callers -= 1
+
+    def stop(self):
+        """Arrête le thread ; les appels suivants encodent directement."""
+        with self._lock:
+            self._stopped = True
+            self._queue.put(None)
+
+    def stats(self) -> dict:
+        return {
+            "window_ms": self.window_s * 1000.0,
+            "max_batch_size": self.max_batch_size,
+            "batch_size": self.batch_size_histogram.snapshot(),
+            "queue_wait_s": self.queue_wait_histogram.snapshot(),
+        }
+
+    # --- Thread de batching ---
+
+    def _collect(self, first: _PendingQuery) -> list:
+        batch = [first]
+        deadline = time.perf_counter() + self.window_s
+
+        while len(batch) < self.max_batch_size:
+            # Tous les appelants en cours sont déjà dans le lot : inutile d'attendre
+            with self._lock:
+                if self._callers <= len(batch) and self._queue.empty():
+                    break
+
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # Signal d'arrêt traité au tour suivant
+                break
+            batch.append(item)
+
+        return batch
+
+    def _encode(self, batch: list):
+        now = time.perf_counter()
+        for item in batch:
+            self.queue_wait_histogram.observe(now - item.enqueued_at)
+        self.batch_size_histogram.observe(len(batch))
+
+        try:
+            with stage_timer("embed_batch"):
+                embeddings = self.vectorizor.encode_queries([item.query for item in batch])
+            for item, embedding in zip(batch, embeddings):
+                item.future.set_result(embedding)
+        except Exception as e:
+            for item in batch:
+                item.future.set_exception(e)
+
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            if first is None:
+                break
+            self._encode(self._collect(first))
+
+        # Arrêt : on sert les requêtes déposées avant le signal
+        leftovers = []
+        while True:
+            try:
+                item = self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                leftovers.append(item)
+        for i in range(0, len(leftovers), self.max_batch_size):
+            self._encode(leftovers[i : i + self.max_batch_size])
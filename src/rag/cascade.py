@@ -0,0 +1,301 @@
+"""
+Cascade de modèles : les questions faciles vont à un LLM plus petit et plus rapide.
+
+Les paliers sont essayés du plus petit au plus grand ; le premier dont les seuils
+acceptent la question la traite, sinon elle va au modèle principal (rag.model).
+Critères : confiance du retrieval (similarité cosinus du meilleur document,
+score_retrieval : même échelle avec ou sans reranking), longueur de la question,
+taille du contexte. Si le petit modèle s'abstient ("Je ne sais pas...") ou
+échoue, la question remonte au modèle principal ; en streaming, le début de sa
+réponse est retenu le temps de le vérifier.
+
+Chaque routage est tracé (span "route" : palier et critères, voir tracing.py) et
+compté par palier (rag_llm_tier_*), de quoi régler les seuils hors ligne.
+"""
+import time
+import unicodedata
+from typing import AsyncIterator, Iterator, List, Optional
+
+from .llm import LLM, is_error_reply
+from .scheduler import LLMQueueFullError
+from .metrics import stage_timer, LLM_TIER_REQUESTS, LLM_TIER_LATENCY
+
+MAIN_TIER = "main"
+
+# Débuts de réponse signalant une abstention (consigne 2 de prompts/rag_instructions.txt)
+ABSTAIN_MARKERS = (
+    "je ne sais pas",
+    "je ne peux pas repondre",
+    "les documents ne contiennent pas",
+    "les documents fournis ne contiennent pas",
+    "aucune information",
+)
+
+
+def _fold(text: str) -> str:
+    text = unicodedata.normalize("NFKD", text.lower())
+    return " ".join("".join(c for c in text if not unicodedata.combining(c)).split())
+
+
+class ModelTier:
+    """Un palier de la cascade : son client LLM et les seuils des questions qu'il accepte."""
+
+    def __init__(
+        self,
+        name: str,
+        llm: LLM,
+        max_query_chars: Optional[int] = None,
+        max_context_tokens: Optional[int] = None,
+        min_top_score: Optional[float] = None,
+    ):
+        self.name = name
+        self.llm = llm
+        self.max_query_chars = max_query_chars
+        self.max_context_tokens = max_context_tokens
+        self.min_top_score = min_top_score
+
+    def accepts(self, features: dict) -> bool:
+        if self.max_query_chars is not None and features["query_chars"] > self.max_query_chars:
+            return False
+        if self.max_context_tokens is not None and features["context_tokens"] > self.max_context_tokens:
+            return False
+        if self.min_top_score is not None and features["top_score"] < self.min_top_score:
+            return False
+        return True
+
+
+class Route:
+    """
+    Palier d'une question : `chosen` au routage, `tier` celui qui génère (le modèle
+    principal après une remontée).
+    """
+
+    __slots__ = ("tier", "chosen", "features", "escalated")
+
+    def __init__(self, tier: ModelTier, features: dict):
+        self.tier = tier
+        self.chosen = tier
+        self.features = features
+        self.escalated = False
+
+
+class Cascade:
+    """
+    Paliers de modèles devant le modèle principal.
+
+    Sans palier configuré, tout va au modèle principal (comportement historique) ;
+    l'usage et la latence restent comptés sous le palier "main".
+    """
+
+    def __init__(
+        self,
+        main: LLM,
+        tiers: Optional[List[ModelTier]] = None,
+        escalate_on_abstain: bool = True,
+        abstain_probe_chars: int = 120,
+    ):
+        """
+        Args:
+            main (LLM): Modèle principal, dernier palier
+            tiers (List[ModelTier], optional): Paliers plus petits, du plus petit au plus grand
+            escalate_on_abstain (bool): Remonte au modèle principal quand un palier s'abstient
+            abstain_probe_chars (int): Début de réponse examiné (et retenu en streaming)
+        """
+        self.main = ModelTier(MAIN_TIER, main)
+        self.tiers = list(tiers or [])
+        self.escalate_on_abstain = escalate_on_abstain
+        self.abstain_probe_chars = abstain_probe_chars
+
+    @classmethod
+    def from_settings(cls, settings, main: LLM, api_key: str, llm_settings=None) -> "Cascade":
+        """Construit la cascade depuis une CascadeSettings (un client LLM par palier)."""
+        tiers = [
+            ModelTier(
+                tier.name,
+                LLM(
+                    model=tier.model,
+                    base_url=tier.base_url,
+                    api_key=api_key,
+                    settings=llm_settings,
+                    base_urls=tier.base_urls,
+                ),
+                max_query_chars=tier.max_query_chars,
+                max_context_tokens=tier.max_context_tokens,
+                min_top_score=tier.min_top_score,
+            )
+            for tier in settings.tiers
+        ]
+        if tiers:
+            print(f" [Cascade] Paliers : {', '.join(t.name for t in tiers)} puis {main.model_name}")
+        return cls(
+            main,
+            tiers,
+            escalate_on_abstain=settings.escalate_on_abstain,
+            abstain_probe_chars=settings.abstain_probe_chars,
+        )
+
+    # --- Routage ---
+
+    @staticmethod
+    def features(query: str, prepared: dict) -> dict:
+        return {
+            "query_chars": len(query),
+            "context_tokens": prepared.get("context_tokens", 0),
+            "top_score": prepared.get("retrieval_score", 0.0),
+        }
+
+    def route(self, query: str, prepared: dict) -> Route:
+        """Premier palier acceptant la question, sinon le modèle principal."""
+        with stage_timer("route") as span:
+            features = self.features(query, prepared)
+            tier = next((t for t in self.tiers if t.accepts(features)), self.main)
+            span.set(tier=tier.name, **features)
+        return Route(tier, features)
+
+    def is_abstention(self, text: str) -> bool:
+        head = _fold(text[: self.abstain_probe_chars]).lstrip(" \"'«*-")
+        return any(head.startswith(marker) for marker in ABSTAIN_MARKERS)
+
+    def _verdict(self, text: str) -> str:
+        if is_error_reply(text):
+            return "error"
+        if self.is_abstention(text):
+            return "abstained"
+        return "answered"
+
+    def _should_escalate(self, route: Route, verdict: str) -> bool:
+        if route.tier is self.main:
+            return False
+        return verdict == "error" or (verdict == "abstained" and self.escalate_on_abstain)
+
+    def _record(self, route: Route, start: float, verdict: str):
+        LLM_TIER_LATENCY.observe(time.perf_counter() - start, tier=route.tier.name)
+        escalate = self._should_escalate(route, verdict)
+        LLM_TIER_REQUESTS.inc(tier=route.tier.name, outcome="escalated" if escalate else verdict)
+        if escalate:
+            route.tier = self.main
+            route.escalated = True
+        return escalate
+
+    # --- Génération ---
+
+    def infere(self, route: Route, prompt: str, **kwargs) -> str:
+        """Réponse du palier choisi, ou du modèle principal si le palier s'abstient."""
+        while True:
+            start = time.perf_counter()
+            try:
+                reply = route.tier.llm.infere(prompt, **kwargs)
+            except LLMQueueFullError:
+                # Palier saturé : le modèle principal prend la question
+                if not self._record(route, start, "error"):
+                    raise
+                continue
+            if not self._record(route, start, self._verdict(reply)):
+                return reply
+
+    async def ainfere(self, route: Route, prompt: str, **kwargs) -> str:
+        """Version asynchrone de infere()."""
+        while True:
+            start = time.perf_counter()
+            try:
+                reply = await route.tier.llm.ainfere(prompt, **kwargs)
+            except LLMQueueFullError:
+                if not self._record(route, start, "error"):
+                    raise
+                continue
+            if not self._record(route, start, self._verdict(reply)):
+                return reply
+
+    def infere_stream(self, route: Route, prompt: str, **kwargs) -> Iterator[str]:
+        """
+        Flux du palier choisi. Hors modèle principal, le début de la réponse est retenu
+        jusqu'à `abstain_probe_chars` caractères : s'il s'agit d'une abstention, il est
+        jeté et la réponse vient du modèle principal.
+        """
+        while True:
+            start = time.perf_counter()
+            probing = route.tier is not self.main
+            recorded = escalate = False
+            head = ""
+            stream = route.tier.llm.infere_stream(prompt, **kwargs)
+            try:
+                for token in stream:
+                    if len(head) < self.abstain_probe_chars:
+                        head += token
+                    if not probing:
+                        yield token
+                        continue
+                    verdict = self._verdict(head)
+                    if verdict == "answered" and len(head) < self.abstain_probe_chars:
+                        continue
+                    recorded = True
+                    escalate = self._record(route, start, verdict)
+                    if escalate:
+                        break
+                    probing = False
+                    yield head
+            except LLMQueueFullError:
+                if not probing or not self._record(route, start, "error"):
+                    raise
+                escalate = True
+            finally:
+                stream.close()
+            if escalate:
+                continue
+            if probing and head:
+                # Réponse plus courte que la zone examinée
+                yield head
+            if not recorded:
+                self._record(route, start, self._verdict(head))
+            return
+
+    async def ainfere_stream(self, route: Route, prompt: str, **kwargs) -> AsyncIterator[str]:
+        """Version asynchrone de infere_stream()."""
+        while True:
+            start = time.perf_counter()
+            probing = route.tier is not self.main
+            recorded = escalate = False
+            head = ""
+            stream = route.tier.llm.ainfere_stream(prompt, **kwargs)
+            try:
+                async for token in stream:
+                    if len(head) < self.abstain_probe_chars:
+                        head += token
+                    if not probing:
+                        yield token
+                        continue
+                    verdict = self._verdict(head)
+                    if verdict == "answered" and len(head) < self.abstain_probe_chars:
+                        continue
+                    recorded = True
+                    escalate = self._record(route, start, verdict)
+                    if escalate:
+                        break
+                    probing = False
+                    yield head
+            except LLMQueueFullError:
+                if not probing or not self._record(route, start, "error"):
+                    raise
+                escalate = True
+            finally:
+                await stream.aclose()
+            if escalate:
+                continue
+            if probing and head:
+                yield head
+            if not recorded:
+                self._record(route, start, self._verdict(head))
+            return
+
+    def stats(self) -> List[dict]:
+        return [
+            {
+                "tier": tier.name,
+                "model": tier.llm.model_name,
+                "base_urls": tier.llm.base_urls,
+                "max_query_chars": tier.max_query_chars,
+                "max_context_tokens": tier.max_context_tokens,
+                "min_top_score": tier.min_top_score,
+            }
+            for tier in self.tiers + [self.main]
+        ]
@@ -6,6 +6,8 @@ import json
 from typing import List, Tuple
 from collections import Counter
 
+from . import tracing
+
 
 #  DÉSACTIVER LA TÉLÉMÉTRIE **AVANT** l'import ChromaDB
 os.environ["ANONYMIZED_TELEMETRY"] = "False"
@@ -253,6 +255,9 @@ class ChromaStorage:
 
             similarities = [1.0 - dist for dist in distances]
             sources = [meta.get("chemin", "unknown") for meta in metadatas]
+            tracing.set_attributes(
+                collection=self.collection_name, n_results=n_results, hits=len(documents)
+            )
 
             return documents, sources, similarities
 
@@ -260,6 +265,59 @@ class ChromaStorage:
             print(f" Erreur de requête ChromaDB : {e}")
             return [], [], []
 
+    def query_similar_batch(
+        self, query_embeddings: np.ndarray, n_results: int = 3
+    ) -> List[List[dict]]:
+        """
+        Recherche des voisins pour plusieurs requêtes en un seul appel ChromaDB.
+
+        Args:
+            query_embeddings (np.ndarray): Matrice (nb_requêtes, dimension)
+            n_results (int): Nombre de résultats par requête
+
+        Returns:
+            List[List[dict]]: Pour chaque requête, les chunks trouvés avec
+                "id", "batch", "chemin", "position_debut", "taille_texte", "score_retrieval"
+        """
+        if isinstance(query_embeddings, np.ndarray):
+            query_embeddings = query_embeddings.tolist()
+
+        results = self.collection.query(
+            query_embeddings=query_embeddings,
+            n_results=n_results,
+            include=["documents", "metadatas", "distances"],
+        )
+
+        all_hits = []
+        for q in range(len(query_embeddings)):
+            ids = results["ids"][q] if results["ids"] else []
+            documents = results["documents"][q] if results["documents"] else []
+            metadatas = results["metadatas"][q] if results["metadatas"] else []
+            distances = results["distances"][q] if results["distances"] else []
+
+            hits = []
+            for doc_id, document, meta, dist in zip(ids, documents, metadatas, distances):
+                meta = meta or {}
+                hits.append(
+                    {
+                        "id": doc_id,
+                        "batch": document,
+                        "chemin": meta.get("chemin", "unknown"),
+                        "position_debut": meta.get("position_debut", 0),
+                        "taille_texte": meta.get("taille_texte", len(document or "")),
+                        "score_retrieval": 1.0 - dist,
+                    }
+                )
+            all_hits.append(hits)
+
+        tracing.set_attributes(
+            collection=self.collection_name,
+            queries=len(all_hits),
+            n_results=n_results,
+            hits=sum(len(hits) for hits in all_hits),
+        )
+        return all_hits
+
     def add_document(
         self, document: str, chemin: str, embedding: np.ndarray, position_debut: int = 0
     ) -> bool:
@@ -288,6 +346,49 @@ class ChromaStorage:
             print(f" Erreur ajout document : {e}")
             return False
 
+    def add_documents(
+        self,
+        documents: List[str],
+        chemins: List[str],
+        embeddings: List[np.ndarray],
+        positions_debut: List[int],
+    ) -> int:
+        """
+        Ajoute un lot de chunks en un seul appel ChromaDB (bien plus rapide que
+        des add_document() successifs sur une grosse ingestion).
+
+        Returns:
+            int: Nombre de chunks écrits (0 en cas d'échec)
+        """
+        import uuid
+
+        if not documents:
+            return 0
+
+        try:
+            self.collection.add(
+                documents=list(documents),
+                metadatas=[
+                    {
+                        "chemin": chemin,
+                        "position_debut": int(position),
+                        "taille_texte": len(document),
+                    }
+                    for document, chemin, position in zip(
+                        documents, chemins, positions_debut
+                    )
+                ],
+                embeddings=[
+                    emb.tolist() if isinstance(emb, np.ndarray) else emb
+                    for emb in embeddings
+                ],
+                ids=[str(uuid.uuid4()) for _ in documents],
+            )
+            return len(documents)
+        except Exception as e:
+            print(f" Erreur ajout lot de documents : {e}")
+            return 0
+
     def count_documents(self) -> int:
         return self.collection.count()
 
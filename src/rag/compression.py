@@ -0,0 +1,165 @@
+"""
+Compression extractive du contexte, guidée par la question, avant le rendu du prompt.
+
+Un chunk fait ~1000 caractères et souvent deux phrases seulement répondent à la
+question ; le reste coûte du prefill au LLM (sur CPU, l'essentiel de la latence avant
+le premier token). Les documents retenus sont découpés en phrases, notées par
+similarité avec l'embedding de la question (déjà calculé pour le retrieval) et par
+recouvrement de termes ; les meilleures sont gardées, dans l'ordre du texte, jusqu'au
+budget de tokens. Chaque document garde son id et sa source : les citations [id] et
+le bloc "Sources" restent valables.
+
+Optionnel (rag.compression.enabled) ; le taux de compression et la durée de l'étape
+sont rapportés par requête (timings, span "compress", réponse de l'API).
+"""
+from typing import Callable, List, Optional
+
+import numpy as np
+
+from .context_builder import TokenEstimator, document_cost
+from .metrics import COMPRESSION_RATIO
+from .text import SENTENCE_SPLIT, terms
+
+# Séparateur entre deux phrases non consécutives d'un même document
+ELLIPSIS = " […] "
+
+
+class ContextCompressor:
+    """Garde les phrases des documents les plus proches de la question, sous un budget de tokens."""
+
+    def __init__(
+        self,
+        encode: Optional[Callable[[List[str]], np.ndarray]] = None,
+        estimator: Optional[TokenEstimator] = None,
+        max_tokens: int = 768,
+        semantic_weight: float = 0.7,
+        min_sentence_chars: int = 20,
+    ):
+        """
+        Args:
+            encode (Callable, optional): Encodeur de phrases (Vectorizor.encode_passages) ;
+                None : score lexical seul
+            estimator (TokenEstimator, optional): Compteur de tokens (partagé avec le LLM)
+            max_tokens (int): Budget des documents compressés
+            semantic_weight (float): Poids de la similarité d'embedding face au score lexical
+            min_sentence_chars (int): Fragments plus courts rattachés à la phrase précédente
+        """
+        self.encode = encode
+        self.estimator = estimator or TokenEstimator()
+        self.max_tokens = max_tokens
+        self.semantic_weight = semantic_weight
+        self.min_sentence_chars = min_sentence_chars
+
+    @classmethod
+    def from_settings(cls, settings, encode=None, estimator=None) -> "ContextCompressor":
+        """Construit le compresseur depuis une CompressionSettings."""
+        return cls(
+            encode=encode,
+            estimator=estimator,
+            max_tokens=settings.max_tokens,
+            semantic_weight=settings.semantic_weight,
+            min_sentence_chars=settings.min_sentence_chars,
+        )
+
+    def _split(self, text: str) -> List[str]:
+        sentences: List[str] = []
+        for part in SENTENCE_SPLIT.split(text):
+            part = " ".join(part.split())
+            if not part:
+                continue
+            if sentences and len(part) < self.min_sentence_chars:
+                sentences[-1] += " " + part
+            else:
+                sentences.append(part)
+        return sentences
+
+    def _semantic_scores(self, sentences: List[str], query_embedding) -> Optional[np.ndarray]:
+        if self.encode is None or query_embedding is None or self.semantic_weight <= 0:
+            return None
+        try:
+            embeddings = np.asarray(self.encode(sentences), dtype=float)
+        except Exception as e:
+            print(f" [Compression] Encodage des phrases impossible, score lexical seul : {e}")
+            return None
+        query = np.asarray(query_embedding, dtype=float)
+        norms = np.linalg.norm(embeddings, axis=1) * (np.linalg.norm(query) or 1.0)
+        return embeddings @ query / np.where(norms == 0, 1.0, norms)
+
+    def compress(self, query: str, documents: List[dict], query_embedding=None) -> dict:
+        """
+        Args:
+            query (str): Question
+            documents (List[dict]): Documents du ContextBuilder (id, source_name, score, content)
+            query_embedding (np.ndarray, optional): Embedding de la question
+
+        Returns:
+            dict: {
+                "documents": documents compressés (renumérotés, dans le même ordre),
+                "tokens": tokens estimés des documents compressés,
+                "stats": {"sentences", "kept", "tokens_before", "tokens_after", "ratio"},
+            }
+        """
+        sentences, owners = [], []
+        for index, doc in enumerate(documents):
+            for sentence in self._split(doc["content"]):
+                sentences.append(sentence)
+                owners.append(index)
+        tokens_before = sum(document_cost(self.estimator, doc["content"]) for doc in documents)
+        if not sentences:
+            return self._result(documents, tokens_before, tokens_before, 0, 0)
+
+        # Recouvrement des termes de la question (sans accents, pluriels ramenés au singulier)
+        query_terms = terms(query)
+        lexical = np.array(
+            [len(query_terms & terms(s)) / max(len(query_terms), 1) for s in sentences]
+        )
+        semantic = self._semantic_scores(sentences, query_embedding)
+        if semantic is None:
+            scores = lexical
+        else:
+            scores = self.semantic_weight * semantic + (1 - self.semantic_weight) * lexical
+
+        # Meilleures phrases jusqu'au budget (une phrase trop longue n'empêche pas les suivantes)
+        budget = min(self.max_tokens, tokens_before)
+        selected = set()
+        used = 0
+        opened = set()
+        for i in np.argsort(-scores, kind="stable"):
+            owner = owners[i]
+            cost = self.estimator.count(sentences[i]) + 1
+            if owner not in opened:
+                cost += document_cost(self.estimator, "")
+            if used + cost > budget:
+                continue
+            selected.add(int(i))
+            opened.add(owner)
+            used += cost
+
+        compressed = []
+        for index, doc in enumerate(documents):
+            kept = [i for i in range(len(sentences)) if owners[i] == index and i in selected]
+            if not kept:
+                continue
+            parts = [sentences[kept[0]]]
+            for previous, i in zip(kept, kept[1:]):
+                parts.append((" " if i == previous + 1 else ELLIPSIS) + sentences[i])
+            compressed.append({**doc, "id": len(compressed) + 1, "content": "".join(parts)})
+
+        tokens_after = sum(document_cost(self.estimator, doc["content"]) for doc in compressed)
+        return self._result(compressed, tokens_before, tokens_after, len(sentences), len(selected))
+
+    @staticmethod
+    def _result(documents: List[dict], tokens_before: int, tokens_after: int, sentences: int, kept: int) -> dict:
+        ratio = tokens_after / tokens_before if tokens_before else 1.0
+        COMPRESSION_RATIO.observe(ratio)
+        return {
+            "documents": documents,
+            "tokens": tokens_after,
+            "stats": {
+                "sentences": sentences,
+                "kept": kept,
+                "tokens_before": tokens_before,
+                "tokens_after": tokens_after,
+                "ratio": round(ratio, 3),
+            },
+        }
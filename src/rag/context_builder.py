@@ -0,0 +1,231 @@
+import threading
+from pathlib import Path
+from typing import List, Optional
+
+
+class TokenEstimator:
+    """
+    Estimation du nombre de tokens d'un texte, sans tokenizer local.
+
+    Part d'un ratio caractères/token, puis se recale sur les comptes réels renvoyés
+    par le serveur LLM (usage.prompt_tokens) grâce à observe().
+    """
+
+    def __init__(self, chars_per_token: float = 3.5, smoothing: float = 0.1):
+        """
+        Args:
+            chars_per_token (float): Ratio initial (≈ 3.5 pour du français avec Llama 3)
+            smoothing (float): Poids d'une nouvelle observation dans la moyenne glissante
+        """
+        self.chars_per_token = chars_per_token
+        self.smoothing = smoothing
+        self.observations = 0
+        self._lock = threading.Lock()
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        return int(len(text) / self.chars_per_token) + 1
+
+    def observe(self, chars: int, tokens: int):
+        """Recale le ratio à partir d'un prompt dont le serveur a compté les tokens."""
+        if chars <= 0 or not tokens:
+            return
+        with self._lock:
+            self.chars_per_token += self.smoothing * (chars / tokens - self.chars_per_token)
+            self.observations += 1
+
+
+class _Block:
+    """Passage continu d'un fichier, fait d'un ou plusieurs chunks fusionnés."""
+
+    __slots__ = ("chemin", "start", "end", "text", "score", "ids")
+
+    def __init__(self, hit: dict):
+        self.chemin = hit["chemin"]
+        self.start = int(hit.get("position_debut", 0))
+        self.text = (hit.get("batch") or "").strip()
+        self.end = self.start + int(hit.get("taille_texte") or len(hit.get("batch") or ""))
+        self.score = float(hit.get("score_final", hit.get("score_retrieval", 0.0)))
+        self.ids = [hit.get("id")]
+
+
+def document_cost(estimator: TokenEstimator, text: str) -> int:
+    """Tokens d'un document dans le prompt, en-tête du template compris."""
+    return estimator.count(text) + estimator.count("x" * ContextBuilder.DOCUMENT_OVERHEAD_CHARS)
+
+
+def _overlap(left: str, right: str, max_overlap: int) -> int:
+    """Longueur du plus long suffixe de `left` qui est aussi un préfixe de `right`."""
+    for k in range(min(len(left), len(right), max_overlap), 0, -1):
+        if left.endswith(right[:k]):
+            return k
+    return 0
+
+
+class ContextBuilder:
+    """
+    Construit la liste de documents passée au template, sous un budget de tokens.
+
+    Les chunks arrivent triés par pertinence. Un chunk contenu dans un passage déjà
+    retenu est ignoré ; des chunks consécutifs d'un même fichier (position_debut) sont
+    fusionnés en un seul passage, sans répéter leur chevauchement. Le remplissage
+    s'arrête au budget : moins de tokens de prefill, c'est moins de latence LLM.
+    """
+
+    # En-tête ajouté par le template pour chaque document (ID, source, séparateurs)
+    DOCUMENT_OVERHEAD_CHARS = 60
+
+    def __init__(
+        self,
+        max_context_tokens: int = 3072,
+        estimator: Optional[TokenEstimator] = None,
+        merge_adjacent: bool = True,
+        max_overlap_chars: int = 1000,
+    ):
+        """
+        Args:
+            max_context_tokens (int): Budget des documents dans le prompt
+            estimator (TokenEstimator, optional): Compteur de tokens (partagé)
+            merge_adjacent (bool): Fusionne les chunks consécutifs d'un même fichier
+            max_overlap_chars (int): Chevauchement maximal recherché entre deux chunks
+        """
+        self.max_context_tokens = max_context_tokens
+        self.estimator = estimator or TokenEstimator()
+        self.merge_adjacent = merge_adjacent
+        self.max_overlap_chars = max_overlap_chars
+
+    def _cost(self, text: str) -> int:
+        return self.estimator.count(text)
+
+    def document_cost(self, text: str) -> int:
+        """Tokens d'un document dans le prompt, en-tête du template compris."""
+        return document_cost(self.estimator, text)
+
+    def _try_merge(self, block: _Block, hit_block: _Block, remaining: int) -> Optional[int]:
+        """
+        Fusionne hit_block dans block s'ils sont consécutifs.
+
+        Returns:
+            int | None: Tokens ajoutés, ou None si pas de fusion (non consécutifs, budget)
+        """
+        if hit_block.start == block.end:
+            k = _overlap(block.text, hit_block.text, self.max_overlap_chars)
+            added = hit_block.text[k:]
+            cost = self._cost(added)
+            if cost > remaining:
+                return None
+            block.text = block.text + ("" if k else "\n") + added
+            block.end = hit_block.end
+        elif hit_block.end == block.start:
+            k = _overlap(hit_block.text, block.text, self.max_overlap_chars)
+            added = hit_block.text[: len(hit_block.text) - k]
+            cost = self._cost(added)
+            if cost > remaining:
+                return None
+            block.text = added + ("" if k else "\n") + block.text
+            block.start = hit_block.start
+        else:
+            return None
+
+        block.score = max(block.score, hit_block.score)
+        block.ids.extend(hit_block.ids)
+        return cost
+
+    def _bridge(self, blocks: List[_Block], remaining: int) -> int:
+        """
+        Après une fusion, deux passages d'un même fichier peuvent devenir consécutifs.
+
+        Returns:
+            int: Budget restant, une fois les passages réunis
+        """
+        merged = True
+        while merged:
+            merged = False
+            for a in blocks:
+                for b in blocks:
+                    if a is b or a.chemin != b.chemin:
+                        continue
+                    before = self.document_cost(a.text) + self.document_cost(b.text)
+                    # Les tokens de b sont libérés par la fusion (-1 : saut de ligne de jonction)
+                    if self._try_merge(a, b, remaining + self.document_cost(b.text) - 1) is not None:
+                        remaining -= self.document_cost(a.text) - before
+                        blocks.remove(b)
+                        merged = True
+                        break
+                if merged:
+                    break
+        return remaining
+
+    def build(self, hits: List[dict], budget: Optional[int] = None) -> dict:
+        """
+        Args:
+            hits (List[dict]): Chunks triés par pertinence ("id", "batch", "chemin",
+                "position_debut", "taille_texte", "score_final")
+            budget (int, optional): Budget de tokens (défaut : max_context_tokens)
+
+        Returns:
+            dict: {
+                "documents": documents pour le template (id, source_name, score, content),
+                "chunk_ids": ids des chunks effectivement utilisés,
+                "tokens": tokens estimés des documents,
+                "stats": {"candidates", "merged", "duplicates", "dropped_budget"},
+            }
+        """
+        budget = self.max_context_tokens if budget is None else budget
+        remaining = budget
+        blocks: List[_Block] = []
+        stats = {"candidates": len(hits), "merged": 0, "duplicates": 0, "dropped_budget": 0}
+
+        for hit in hits:
+            candidate = _Block(hit)
+            if not candidate.text:
+                continue
+
+            # Déjà couvert par un passage retenu
+            if any(candidate.text in block.text for block in blocks):
+                stats["duplicates"] += 1
+                continue
+
+            if self.merge_adjacent:
+                cost = None
+                for block in blocks:
+                    if block.chemin == candidate.chemin:
+                        cost = self._try_merge(block, candidate, remaining)
+                        if cost is not None:
+                            break
+                if cost is not None:
+                    remaining -= cost
+                    stats["merged"] += 1
+                    remaining = self._bridge(blocks, remaining)
+                    continue
+
+            cost = self.document_cost(candidate.text)
+            if cost > remaining:
+                if not blocks and remaining > 0:
+                    # Même le meilleur chunk dépasse le budget : on le tronque (-1 : arrondi de count())
+                    max_chars = int(max(remaining - self.document_cost("") - 1, 1) * self.estimator.chars_per_token)
+                    candidate.text = candidate.text[:max_chars]
+                    cost = self.document_cost(candidate.text)
+                else:
+                    stats["dropped_budget"] += 1
+                    continue
+            blocks.append(candidate)
+            remaining -= cost
+
+        blocks.sort(key=lambda b: b.score, reverse=True)
+        documents = [
+            {
+                "id": i,
+                "source_name": Path(block.chemin).name,
+                "score": block.score,
+                "content": block.text,
+            }
+            for i, block in enumerate(blocks, start=1)
+        ]
+        return {
+            "documents": documents,
+            "chunk_ids": [chunk_id for block in blocks for chunk_id in block.ids],
+            "tokens": budget - remaining,
+            "stats": stats,
+        }
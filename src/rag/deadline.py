@@ -0,0 +1,154 @@
+"""
+Échéance par requête, visible de toutes les étapes du pipeline.
+
+L'API ouvre une échéance (timeout fourni par l'appelant) ; elle suit la requête dans
+les threads du pool et les tâches asyncio (contextvars). Chaque étape peut alors
+adapter son travail au temps restant : file d'attente écourtée, moins de candidats
+au retrieval, max_tokens réduit pour le LLM, ou abandon (DeadlineExceeded) quand
+l'appelant ne pourra de toute façon plus recevoir la réponse.
+
+Sans échéance (scripts, launchers), rien ne change.
+"""
+import time
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from .metrics import DEADLINE_EXCEEDED
+
+
+class DeadlineExceeded(TimeoutError):
+    """Levée quand l'échéance de la requête est atteinte (ou inatteignable) à une étape."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Délai de la requête dépassé (étape : {stage})")
+        self.stage = stage
+
+
+class Deadline:
+    """Instant limite d'une requête (horloge monotone)."""
+
+    def __init__(self, timeout_s: float):
+        self.timeout_s = timeout_s
+        self.expires_at = time.monotonic() + timeout_s
+
+    def remaining(self) -> float:
+        return max(0.0, self.expires_at - time.monotonic())
+
+    def expired(self) -> bool:
+        return time.monotonic() >= self.expires_at
+
+    def check(self, stage: str):
+        """Lève DeadlineExceeded si l'échéance est passée."""
+        if self.expired():
+            raise exceeded(stage)
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("rag_deadline", default=None)
+
+
+def current() -> Optional[Deadline]:
+    return _current.get()
+
+
+def remaining() -> Optional[float]:
+    """Temps restant en secondes, ou None hors échéance."""
+    deadline = _current.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def expired() -> bool:
+    deadline = _current.get()
+    return deadline is not None and deadline.expired()
+
+
+def check(stage: str):
+    """Lève DeadlineExceeded si la requête courante a dépassé son échéance."""
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.check(stage)
+
+
+def exceeded(stage: str) -> DeadlineExceeded:
+    """Compte le dépassement et renvoie l'exception à lever."""
+    DEADLINE_EXCEEDED.inc(stage=stage)
+    return DeadlineExceeded(stage)
+
+
+@contextmanager
+def bind(deadline: Optional[Deadline]):
+    """Rend l'échéance visible des étapes exécutées dans le bloc (None : sans échéance)."""
+    token = _current.set(deadline)
+    try:
+        yield deadline
+    finally:
+        try:
+            _current.reset(token)
+        except ValueError:
+            # Générateur repris dans un autre contexte : rien à restaurer
+            pass
+
+
+def scope(timeout_s: Optional[float]):
+    """Ouvre une échéance de `timeout_s` secondes (None : sans échéance)."""
+    return bind(Deadline(timeout_s) if timeout_s else None)
+
+
+class RateEstimator:
+    """
+    Débit du serveur LLM (tokens/s), en moyenne glissante : sert à prévoir ce qui tient
+    dans le temps restant. Part des valeurs configurées, recalées sur les "timings"
+    renvoyés par llama.cpp. Suit aussi la longueur moyenne des réponses, pour estimer
+    le temps de génération économisé quand une requête est abandonnée.
+    """
+
+    def __init__(
+        self,
+        prefill_tokens_per_s: float,
+        decode_tokens_per_s: float,
+        completion_tokens: float = 256.0,
+        smoothing: float = 0.2,
+    ):
+        self.prefill_tokens_per_s = prefill_tokens_per_s
+        self.decode_tokens_per_s = decode_tokens_per_s
+        self.completion_tokens = completion_tokens
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+
+    def observe(self, prompt_n: int, prompt_ms: float, predicted_n: int, predicted_ms: float):
+        with self._lock:
+            if prompt_n and prompt_ms and prompt_ms > 0:
+                rate = prompt_n / (prompt_ms / 1000)
+                self.prefill_tokens_per_s += self.smoothing * (rate - self.prefill_tokens_per_s)
+            if predicted_n and predicted_ms and predicted_ms > 0:
+                rate = predicted_n / (predicted_ms / 1000)
+                self.decode_tokens_per_s += self.smoothing * (rate - self.decode_tokens_per_s)
+
+    def observe_completion(self, completion_tokens: int):
+        """Longueur d'une réponse menée à son terme."""
+        if completion_tokens > 0:
+            with self._lock:
+                self.completion_tokens += self.smoothing * (completion_tokens - self.completion_tokens)
+
+    def remaining_generation_s(self, elapsed_s: float, prompt_tokens: int, generated_tokens: int = 0) -> float:
+        """
+        Temps que le serveur aurait encore passé sur une génération abandonnée après
+        `elapsed_s` secondes : prefill restant puis tokens d'une réponse moyenne.
+        """
+        expected_tokens = max(0.0, self.completion_tokens - generated_tokens)
+        decode_s = expected_tokens / self.decode_tokens_per_s
+        if generated_tokens:
+            return decode_s
+        prefill_s = prompt_tokens / self.prefill_tokens_per_s
+        return max(0.0, prefill_s + decode_s - elapsed_s)
+
+    def affordable_tokens(self, seconds: float, prompt_tokens: int) -> int:
+        """Tokens de réponse générables en `seconds` après le prefill de `prompt_tokens`."""
+        decode_s = seconds - prompt_tokens / self.prefill_tokens_per_s
+        return max(0, int(decode_s * self.decode_tokens_per_s))
+
+    def affordable_prompt_tokens(self, seconds: float, answer_tokens: int) -> int:
+        """Tokens de prompt évaluables en `seconds` en gardant le temps de `answer_tokens`."""
+        prefill_s = seconds - answer_tokens / self.decode_tokens_per_s
+        return max(0, int(prefill_s * self.prefill_tokens_per_s))
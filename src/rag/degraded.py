@@ -0,0 +1,219 @@
+"""
+Mode dégradé : réponses extractives quand le serveur LLM est saturé ou en panne.
+
+Le retrieval fonctionne encore quand le LLM ne suit plus : plutôt qu'un message
+d'erreur, la réponse reprend les phrases des meilleurs chunks les plus proches de la
+question, avec leurs sources. Le mode s'active sur la file d'attente LLM (voir
+scheduler.py), l'absence de serveur disponible ou le taux d'erreur récent, et se
+désactive seul une fois la charge retombée (hystérésis : conditions de sortie plus
+strictes que celles d'entrée, tenues pendant `recovery_s`).
+"""
+import time
+import threading
+from collections import deque
+from typing import TYPE_CHECKING, List, Optional
+
+from .metrics import DEGRADED_ACTIVE, DEGRADED_TRANSITIONS
+from .text import SENTENCE_SPLIT, terms
+
+if TYPE_CHECKING:
+    from .llm_pool import LLMPool
+
+# Mode de la réponse, renvoyé par Rag.answer() et l'API
+GENERATIVE = "generative"
+EXTRACTIVE = "extractive"
+CACHED = "cached"
+
+EXTRACTIVE_HEADER = (
+    "Le service de génération est momentanément saturé ou indisponible : voici les "
+    "passages des documents les plus proches de votre question."
+)
+
+def extractive_answer(query: str, documents: List[dict], max_sentences: int = 4, max_chunks: int = 3) -> str:
+    """
+    Réponse sans LLM : les phrases des `max_chunks` meilleurs documents qui partagent le
+    plus de termes avec la question, dans l'ordre des documents, avec leur citation [id].
+
+    Args:
+        query (str): Question
+        documents (List[dict]): Documents du contexte (id, content), triés par pertinence
+        max_sentences (int): Nombre max de phrases reprises
+        max_chunks (int): Documents parcourus
+
+    Returns:
+        str: Réponse extractive (sans le bloc "Sources")
+    """
+    if not documents:
+        return "Aucun document pertinent n'a été trouvé pour cette question."
+
+    query_terms = terms(query)
+    candidates = []
+    for rank, doc in enumerate(documents[:max_chunks]):
+        for position, sentence in enumerate(SENTENCE_SPLIT.split(doc["content"])):
+            sentence = " ".join(sentence.split())
+            if len(sentence) < 20:
+                continue
+            sentence_terms = terms(sentence)
+            overlap = len(query_terms & sentence_terms)
+            if not overlap:
+                continue
+            # Recouvrement normalisé par la longueur, léger bonus aux meilleurs documents
+            score = overlap / (len(sentence_terms) ** 0.5) + 0.1 * (max_chunks - rank)
+            candidates.append((score, rank, position, sentence, doc["id"]))
+
+    if not candidates:
+        # Aucune phrase ne reprend la question : début du meilleur document
+        first = " ".join(documents[0]["content"].split())[:400]
+        return f"{EXTRACTIVE_HEADER}\n\n- {first} [{documents[0]['id']}]"
+
+    best = sorted(candidates, key=lambda c: c[0], reverse=True)[:max_sentences]
+    best.sort(key=lambda c: (c[1], c[2]))
+    lines = [f"- {sentence} [{doc_id}]" for _, _, _, sentence, doc_id in best]
+    return EXTRACTIVE_HEADER + "\n\n" + "\n".join(lines)
+
+
+class DegradedMode:
+    """
+    Décide si les réponses doivent être extractives, à partir de la charge du pool LLM
+    et des derniers résultats de génération. Partagé par toutes les collections.
+    """
+
+    def __init__(
+        self,
+        pool: "LLMPool",
+        enabled: bool = True,
+        queue_depth_enter: int = 16,
+        queue_depth_exit: int = 2,
+        error_rate_enter: float = 0.5,
+        error_window_s: float = 30.0,
+        min_samples: int = 4,
+        recovery_s: float = 10.0,
+        max_sentences: int = 4,
+        max_chunks: int = 3,
+    ):
+        """
+        Args:
+            pool (LLMPool): Pool LLM observé (file d'attente, serveurs disponibles)
+            enabled (bool): Désactivé : toujours génératif
+            queue_depth_enter (int): Requêtes LLM en file déclenchant le mode dégradé
+            queue_depth_exit (int): File maximale pour en sortir
+            error_rate_enter (float): Taux d'échec des générations déclenchant le mode
+            error_window_s (float): Fenêtre du taux d'échec
+            min_samples (int): Générations minimales dans la fenêtre pour juger du taux
+            recovery_s (float): Durée pendant laquelle la charge doit rester basse pour sortir
+            max_sentences (int): Phrases d'une réponse extractive
+            max_chunks (int): Documents parcourus pour une réponse extractive
+        """
+        self.pool = pool
+        self.enabled = enabled
+        self.queue_depth_enter = queue_depth_enter
+        self.queue_depth_exit = queue_depth_exit
+        self.error_rate_enter = error_rate_enter
+        self.error_window_s = error_window_s
+        self.min_samples = min_samples
+        self.recovery_s = recovery_s
+        self.max_sentences = max_sentences
+        self.max_chunks = max_chunks
+
+        self.active_reason: Optional[str] = None
+        self._calm_since: Optional[float] = None
+        self._outcomes: deque = deque()
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings, pool: "LLMPool") -> "DegradedMode":
+        """Construit le mode dégradé depuis une DegradedSettings."""
+        return cls(
+            pool,
+            enabled=settings.enabled,
+            queue_depth_enter=settings.queue_depth_enter,
+            queue_depth_exit=settings.queue_depth_exit,
+            error_rate_enter=settings.error_rate_enter,
+            error_window_s=settings.error_window_s,
+            min_samples=settings.min_samples,
+            recovery_s=settings.recovery_s,
+            max_sentences=settings.max_sentences,
+            max_chunks=settings.max_chunks,
+        )
+
+    def record(self, ok: bool):
+        """Résultat d'une génération (False : erreur, serveur injoignable, file pleine)."""
+        now = time.monotonic()
+        with self._lock:
+            self._outcomes.append((now, ok))
+            self._trim_locked(now)
+
+    def _trim_locked(self, now: float):
+        while self._outcomes and now - self._outcomes[0][0] > self.error_window_s:
+            self._outcomes.popleft()
+
+    def error_rate(self) -> Optional[float]:
+        """Taux d'échec sur la fenêtre, None s'il y a trop peu de générations pour juger."""
+        with self._lock:
+            self._trim_locked(time.monotonic())
+            if len(self._outcomes) < self.min_samples:
+                return None
+            return sum(1 for _, ok in self._outcomes if not ok) / len(self._outcomes)
+
+    def _pressure(self) -> dict:
+        load = self.pool.load()
+        return {"queued": load["queued"], "available": load["available"], "error_rate": self.error_rate()}
+
+    def active(self) -> bool:
+        """True si la prochaine réponse doit être extractive (met l'état à jour)."""
+        if not self.enabled:
+            return False
+        pressure = self._pressure()
+        error_rate = pressure["error_rate"]
+
+        reason = None
+        if pressure["available"] == 0:
+            reason = "no_backend"
+        elif pressure["queued"] >= self.queue_depth_enter:
+            reason = "queue"
+        elif error_rate is not None and error_rate >= self.error_rate_enter:
+            reason = "errors"
+
+        now = time.monotonic()
+        with self._lock:
+            if self.active_reason is None:
+                if reason is not None:
+                    self._enter_locked(reason)
+                return self.active_reason is not None
+
+            calm = reason is None and pressure["queued"] <= self.queue_depth_exit
+            if not calm:
+                self._calm_since = None
+                return True
+            if self._calm_since is None:
+                self._calm_since = now
+            if now - self._calm_since >= self.recovery_s:
+                self._exit_locked()
+            return self.active_reason is not None
+
+    def _enter_locked(self, reason: str):
+        self.active_reason = reason
+        self._calm_since = None
+        DEGRADED_ACTIVE.set(1)
+        DEGRADED_TRANSITIONS.inc(direction="enter", reason=reason)
+        print(f" [Degraded] Mode extractif activé ({reason})")
+
+    def _exit_locked(self):
+        DEGRADED_TRANSITIONS.inc(direction="exit", reason=self.active_reason)
+        self.active_reason = None
+        self._calm_since = None
+        # Les échecs d'avant la reprise ne doivent pas la faire rebasculer aussitôt
+        self._outcomes.clear()
+        DEGRADED_ACTIVE.set(0)
+        print(" [Degraded] Retour au mode génératif")
+
+    def answer(self, query: str, documents: List[dict]) -> str:
+        return extractive_answer(query, documents, self.max_sentences, self.max_chunks)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "active": self.active_reason is not None,
+            "reason": self.active_reason,
+            **self._pressure(),
+        }
@@ -4,12 +4,18 @@ import hashlib
 import tempfile
 import shutil
 import subprocess
+import threading
 from pathlib import Path
 from datetime import datetime
-from typing import List, Optional, Tuple
+from typing import Callable, List, Optional, Tuple
 
 from docx import Document
 from .ocr_processor import PDFOCRProcessor
+from .metrics import CACHE_REQUESTS, INGEST_FILES
+
+
+class IngestionCancelled(Exception):
+    """Levée quand une ingestion est annulée en cours de route (voir ingest_jobs.py)."""
 
 
 class DocumentProcessor:
@@ -183,6 +189,8 @@ class DocumentProcessor:
         source: Optional[str] = None,
         fichiers_specifiques: Optional[List[str]] = None,
         force_reprocess: bool = False,
+        progress_callback: Optional[Callable[..., None]] = None,
+        cancel_event: Optional[threading.Event] = None,
     ) -> Tuple[List[str], List[str]]:
         """
         Extrait le texte d'une liste de fichiers ou d'un dossier source.
@@ -192,6 +200,8 @@ class DocumentProcessor:
             source (str, optional): Chemin vers un fichier/dossier source.
             fichiers_specifiques (List[str], optional): Liste de chemins de fichiers à traiter en priorité.
             force_reprocess (bool): Si True, ignore le cache et retraite tous les fichiers.
+            progress_callback (Callable, optional): Appelé avec files_total / files_extracted.
+            cancel_event (threading.Event, optional): Si positionné, interrompt le traitement.
 
         Returns:
             Tuple[List[str], List[str]]: Un tuple contenant la liste des textes extraits et la liste de leurs chemins.
@@ -217,7 +227,18 @@ class DocumentProcessor:
         if not force_reprocess:
             print("[DocumentProcessor] Utilisation du cache activée.")
 
-        for fichier in fichiers_a_traiter:
+        if progress_callback:
+            progress_callback(
+                stage="extraction",
+                files_total=len(fichiers_a_traiter),
+                files_extracted=0,
+            )
+
+        for num_fichier, fichier in enumerate(fichiers_a_traiter, start=1):
+            if cancel_event is not None and cancel_event.is_set():
+                raise IngestionCancelled("Extraction annulée")
+            if progress_callback and num_fichier > 1:
+                progress_callback(files_extracted=num_fichier - 1)
             if not fichier.is_file():
                 continue
             fichier_abs = fichier.resolve()
@@ -241,9 +262,12 @@ class DocumentProcessor:
                     textes.append(cached_text)
                     chemins.append(chemin_a_stocker)
                     cache_hits += 1
+                    CACHE_REQUESTS.inc(cache="documents", result="hit")
+                    INGEST_FILES.inc()
                     continue
 
             cache_misses += 1
+            CACHE_REQUESTS.inc(cache="documents", result="miss")
             print(f"  → Traitement de : {fichier.name}")
 
             handler = self._handlers.get(
@@ -259,6 +283,7 @@ class DocumentProcessor:
                         )
                         textes.append(texte_extrait)
                         chemins.append(chemin_a_stocker)
+                        INGEST_FILES.inc()
                     else:
                         print(
                             f"    /!\\ Fichier ignoré (aucun texte extrait) : {fichier.name}"
@@ -273,6 +298,8 @@ class DocumentProcessor:
         print(
             f"[DocumentProcessor] Statistiques du cache : {cache_hits} hits, {cache_misses} misses."
         )
+        if progress_callback:
+            progress_callback(files_extracted=len(fichiers_a_traiter))
         return textes, chemins
 
     def _process_text(self, file_path: Path) -> Tuple[str, str]:
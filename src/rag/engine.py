@@ -0,0 +1,382 @@
+import os
+import time
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from .settings import GlobalConfig
+from .rag import Rag
+from .llm import LLM
+from .chroma_storage import ChromaStorage
+from .vectorizor import Vectorizor
+from .answer_cache import AnswerCache
+from .degraded import DegradedMode
+from .cascade import Cascade
+from .metrics import COLLECTION_ENGINE_EVICTIONS
+
+
+class UnknownCollectionError(LookupError):
+    """Levée quand une requête nomme une collection absente de ChromaDB."""
+
+
+class CollectionEngine:
+    """
+    Moteur chaud d'une collection : son Rag (handle ChromaDB, modèle d'embedding,
+    métadonnées) et ses statistiques d'usage.
+    """
+
+    def __init__(self, name: str, rag: Rag, index_bytes: int):
+        self.name = name
+        self.rag = rag
+        self.index_bytes = index_bytes  # Estimation : nombre de chunks x dimension x float32
+        self.last_used = time.monotonic()
+        self.requests = 0
+
+    @property
+    def model_name(self) -> str:
+        return self.rag.retrieval.vectorizor.model_name
+
+    def touch(self):
+        self.last_used = time.monotonic()
+        self.requests += 1
+
+
+class _Generation:
+    """
+    Moteurs construits depuis une même configuration.
+
+    Tous partagent le client LLM et le cache de modèles d'embedding : deux collections
+    indexées avec le même modèle ne le chargent qu'une fois. Une nouvelle configuration
+    crée une nouvelle génération, qui remplace l'ancienne d'un seul coup.
+    """
+
+    def __init__(self, config: GlobalConfig, fingerprint: Optional[str]):
+        self.config = config
+        self.fingerprint = fingerprint
+        self.default_collection = config.rag.retrieval.collection_name
+
+        self.llm = LLM(
+            model=config.rag.model,
+            base_url=config.rag.base_url,
+            api_key=config.rag.api_key,
+            settings=config.rag.llm,
+            base_urls=config.rag.base_urls,
+        )
+        # Cache de réponses commun à toutes les collections (la collection fait partie de la clé)
+        self.answer_cache: Optional[AnswerCache] = None
+        if config.rag.answer_cache.enabled:
+            self.answer_cache = AnswerCache.from_settings(config.rag.answer_cache)
+        # Mode dégradé commun : la saturation du LLM concerne toutes les collections
+        self.degraded = DegradedMode.from_settings(config.rag.degraded, self.llm.pool)
+        # Paliers de la cascade : clients LLM partagés, comme le modèle principal
+        self.cascade = Cascade.from_settings(config.rag.cascade, self.llm, config.rag.api_key, config.rag.llm)
+
+        self.model_cache: dict = {}
+        self._model_bytes: Dict[str, int] = {}
+
+        # Client dédié à la liste des collections (ne sert aucune requête)
+        self.storage = ChromaStorage(persist_directory=str(config.rag.paths.chroma_dir))
+
+        # Ordre LRU : la collection la moins récemment utilisée en tête
+        self.engines: "OrderedDict[str, CollectionEngine]" = OrderedDict()
+        self.lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+
+    def get_engine(self, name: str) -> CollectionEngine:
+        """
+        Retourne le moteur de la collection, construit au premier usage.
+
+        Deux requêtes sur la même collection froide n'en construisent qu'un ;
+        des collections différentes se construisent en parallèle.
+        """
+        with self.lock:
+            entry = self.engines.get(name)
+            if entry is not None:
+                self.engines.move_to_end(name)
+                entry.touch()
+            build_lock = self._build_locks.setdefault(name, threading.Lock())
+
+        if entry is None:
+            with build_lock:
+                entry = self._build(name)
+
+        self.evict()
+        return entry
+
+    def _build(self, name: str) -> CollectionEngine:
+        with self.lock:
+            entry = self.engines.get(name)
+            if entry is not None:
+                entry.touch()
+                return entry
+
+        # La collection par défaut est créée si besoin (comportement historique),
+        # une collection demandée par une requête doit exister
+        if name != self.default_collection and name not in self.storage.list_collection_names():
+            raise UnknownCollectionError(f"Collection inconnue : {name}")
+
+        print(f" [Engine] Préparation de la collection '{name}'...")
+        rag = Rag.from_config(
+            self.config,
+            collection_name=name,
+            llm=self.llm,
+            model_cache=self.model_cache,
+            answer_cache=self.answer_cache,
+            degraded=self.degraded,
+            cascade=self.cascade,
+        )
+        entry = CollectionEngine(name, rag, self._estimate_index_bytes(rag))
+        entry.touch()
+
+        with self.lock:
+            self.engines[name] = entry
+        print(f" [Engine] Collection '{name}' prête (modèle : {entry.model_name})")
+        return entry
+
+    @staticmethod
+    def _estimate_index_bytes(rag: Rag) -> int:
+        retrieval = rag.retrieval
+        try:
+            dimension = retrieval.vectorizor.model.get_sentence_embedding_dimension() or 768
+            return retrieval.chroma_storage.collection.count() * dimension * 4
+        except Exception:
+            return 0
+
+    def _model_memory(self, name: str, model) -> int:
+        if name not in self._model_bytes:
+            self._model_bytes[name] = Vectorizor.model_memory_bytes(model)
+        return self._model_bytes[name]
+
+    def _memory_bytes_locked(self) -> int:
+        models = sum(
+            self._model_memory(name, model)
+            for name, model in list(self.model_cache.items())
+        )
+        return models + sum(entry.index_bytes for entry in self.engines.values())
+
+    def _purge_unused_models_locked(self):
+        used = {entry.model_name for entry in self.engines.values()}
+        for name in list(self.model_cache):
+            if name not in used:
+                self.model_cache.pop(name, None)
+                self._model_bytes.pop(name, None)
+                print(f" [Engine] Modèle libéré : {name}")
+
+    def evict(self):
+        """
+        Libère les collections inutilisées depuis plus de `collection_idle_ttl_s`,
+        puis, si le budget mémoire est dépassé, les modèles que plus aucune collection
+        n'utilise et les collections les moins récemment utilisées.
+        La collection par défaut n'est jamais libérée.
+        """
+        server = self.config.server
+        budget = server.collections_memory_budget_mb * 1024 * 1024
+        now = time.monotonic()
+        evicted = []
+
+        with self.lock:
+            for name, entry in list(self.engines.items()):
+                if name != self.default_collection and now - entry.last_used > server.collection_idle_ttl_s:
+                    evicted.append((self.engines.pop(name), "idle"))
+
+            if self._memory_bytes_locked() > budget:
+                self._purge_unused_models_locked()
+                for name in list(self.engines):
+                    if self._memory_bytes_locked() <= budget:
+                        break
+                    if name == self.default_collection:
+                        continue
+                    evicted.append((self.engines.pop(name), "budget"))
+                    self._purge_unused_models_locked()
+
+        for entry, reason in evicted:
+            COLLECTION_ENGINE_EVICTIONS.inc(reason=reason)
+            print(f" [Engine] Collection '{entry.name}' libérée ({reason})")
+            # Les requêtes en cours gardent leur référence au Rag
+            entry.rag.close()
+
+    def drop(self, name: str):
+        with self.lock:
+            entry = self.engines.pop(name, None)
+        if entry is not None:
+            entry.rag.close()
+
+    def close(self):
+        with self.lock:
+            entries = list(self.engines.values())
+            self.engines.clear()
+        for entry in entries:
+            entry.rag.close()
+
+    def stats(self) -> dict:
+        now = time.monotonic()
+        with self.lock:
+            memory = self._memory_bytes_locked()
+            collections = [
+                {
+                    "collection": entry.name,
+                    "model": entry.model_name,
+                    "requests": entry.requests,
+                    "idle_s": round(now - entry.last_used, 1),
+                    "index_mb": round(entry.index_bytes / 1024 / 1024, 1),
+                }
+                for entry in reversed(self.engines.values())
+            ]
+            models = {
+                name: round(self._model_memory(name, model) / 1024 / 1024, 1)
+                for name, model in list(self.model_cache.items())
+            }
+        return {
+            "default_collection": self.default_collection,
+            "answer_cache": self.answer_cache.stats() if self.answer_cache else None,
+            "llm_backends": self.llm.pool.stats(),
+            "degraded": self.degraded.stats(),
+            "cascade": self.cascade.stats(),
+            "memory_budget_mb": self.config.server.collections_memory_budget_mb,
+            "memory_estimated_mb": round(memory / 1024 / 1024, 1),
+            "models_mb": models,
+            "collections": collections,
+        }
+
+
+class RagEngine:
+    """
+    Registre de moteurs RAG "chauds" partagé par toutes les requêtes de l'API.
+
+    Chaque collection a son propre Rag (handle ChromaDB, modèle d'embedding,
+    métadonnées), construit à la première requête qui la nomme puis réutilisé :
+    des requêtes concurrentes sur des collections différentes ne se gênent pas et
+    ne rechargent rien. Client LLM et modèles d'embedding sont partagés.
+
+    Les moteurs ne sont reconstruits que si la configuration a réellement changé
+    (empreinte différente), et la nouvelle génération remplace l'ancienne d'un seul
+    coup : les requêtes en cours gardent l'ancienne instance.
+    """
+
+    def __init__(self, config_path: str = "config.json"):
+        """
+        Args:
+            config_path (str): Chemin du fichier de configuration JSON.
+        """
+        self.config_path = config_path
+        self.config: Optional[GlobalConfig] = None
+
+        self._generation: Optional[_Generation] = None
+        self._config_mtime: Optional[float] = None
+
+        # Un seul thread reconstruit à la fois, les autres continuent avec l'ancienne génération
+        self._build_lock = threading.Lock()
+
+    @staticmethod
+    def fingerprint(config: GlobalConfig) -> str:
+        """Empreinte stable d'une configuration (sert à détecter un vrai changement)."""
+        return hashlib.sha256(config.model_dump_json().encode("utf-8")).hexdigest()
+
+    def _current_mtime(self) -> Optional[float]:
+        try:
+            return os.path.getmtime(self.config_path)
+        except OSError:
+            return None
+
+    def _current_generation(self) -> _Generation:
+        """
+        Le fichier de configuration n'est relu que si sa date de modification a changé,
+        et les moteurs ne sont reconstruits que si le contenu validé diffère.
+        """
+        mtime = self._current_mtime()
+        generation = self._generation
+        if generation is not None and mtime == self._config_mtime:
+            return generation
+
+        # Une reconstruction est déjà en cours : on sert l'ancienne génération en attendant
+        if generation is not None and not self._build_lock.acquire(blocking=False):
+            return generation
+        if generation is None:
+            self._build_lock.acquire()
+
+        try:
+            # Un autre thread a pu terminer la reconstruction pendant l'attente
+            generation = self._generation
+            if generation is not None and mtime == self._config_mtime:
+                return generation
+
+            config = GlobalConfig.load_config(self.config_path)
+            fingerprint = self.fingerprint(config)
+
+            if generation is not None and fingerprint == generation.fingerprint:
+                # Fichier touché mais contenu identique : rien à reconstruire
+                self._config_mtime = mtime
+                return generation
+
+            print(" [Engine] Construction du moteur RAG...")
+            new_generation = _Generation(config, fingerprint)
+            # La collection par défaut est chaude avant la bascule
+            new_generation.get_engine(new_generation.default_collection)
+
+            # Bascule atomique : une seule affectation de référence
+            old_generation = self._generation
+            self.config = config
+            self._generation = new_generation
+            self._config_mtime = mtime
+            print(" [Engine] Moteur RAG prêt")
+
+            if old_generation is not None:
+                # Les requêtes encore en cours sur l'ancien Rag continuent (sans batching)
+                old_generation.close()
+            return new_generation
+        finally:
+            self._build_lock.release()
+
+    def get(self, collection: Optional[str] = None) -> Rag:
+        """
+        Retourne le Rag d'une collection, en le (re)construisant si nécessaire.
+
+        Args:
+            collection (str, optional): Collection à interroger (défaut : celle de la config)
+
+        Raises:
+            UnknownCollectionError: si la collection demandée n'existe pas.
+        """
+        generation = self._current_generation()
+        name = collection or generation.default_collection
+        return generation.get_engine(name).rag
+
+    @property
+    def current(self) -> Optional[Rag]:
+        """Rag de la collection par défaut (sans déclencher de construction), ou None."""
+        generation = self._generation
+        if generation is None:
+            return None
+        entry = generation.engines.get(generation.default_collection)
+        return entry.rag if entry is not None else None
+
+    def engines(self) -> List[CollectionEngine]:
+        """Moteurs de collection actuellement chauds."""
+        generation = self._generation
+        if generation is None:
+            return []
+        with generation.lock:
+            return list(generation.engines.values())
+
+    def loaded_models(self) -> List[str]:
+        """Modèles d'embedding actuellement en mémoire."""
+        generation = self._generation
+        return list(generation.model_cache) if generation is not None else []
+
+    def stats(self) -> Optional[dict]:
+        generation = self._generation
+        return generation.stats() if generation is not None else None
+
+    def invalidate(self, collection: Optional[str] = None):
+        """
+        Force une relecture à la prochaine requête : de la configuration entière,
+        ou seulement d'une collection (ex: après une ingestion dans cette collection).
+        """
+        generation = self._generation
+        if collection is not None and generation is not None:
+            generation.drop(collection)
+            return
+        self._config_mtime = None
+        if generation is not None:
+            generation.fingerprint = None
@@ -0,0 +1,271 @@
+import time
+import uuid
+import threading
+import traceback
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+from .document_processor import IngestionCancelled
+from .retrieval import Retrieval
+from .metrics import INGEST_OCR_PAGES, INGEST_THROUGHPUT
+
+
+class IngestJob:
+    """
+    Un job d'ingestion (vectorisation d'un dossier vers une collection) et son avancement.
+    """
+
+    PENDING = "pending"
+    RUNNING = "running"
+    SUCCEEDED = "succeeded"
+    FAILED = "failed"
+    CANCELLED = "cancelled"
+
+    def __init__(self, params: dict):
+        self.id = uuid.uuid4().hex
+        self.params = params
+        self.status = self.PENDING
+        self.error: Optional[str] = None
+
+        self.created_at = datetime.now().isoformat()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+        self.progress = {
+            "stage": None,
+            "files_total": 0,
+            "files_extracted": 0,
+            "chunks_total": 0,
+            "chunks_embedded": 0,
+            "chunks_written": 0,
+        }
+        self._vectorization_started_at: Optional[float] = None
+        self._ocr_pages_at_start = 0.0
+
+        self.cancel_event = threading.Event()
+        self._lock = threading.Lock()
+
+    def update(self, **counters):
+        """Callback d'avancement passé à Retrieval.vectorize_with_config()."""
+        with self._lock:
+            self.progress.update(counters)
+            if counters.get("stage") == "vectorisation":
+                self._vectorization_started_at = time.time()
+        self._publish_throughput()
+
+    def _publish_throughput(self):
+        """Met à jour les jauges de débit (fichiers, chunks, pages OCR par seconde)."""
+        if self.started_at is None:
+            return
+        now = time.time()
+        elapsed = max(now - self.started_at, 1e-6)
+        INGEST_THROUGHPUT.set(self.progress["files_extracted"] / elapsed, unit="files_per_s")
+        INGEST_THROUGHPUT.set(
+            (INGEST_OCR_PAGES.value() - self._ocr_pages_at_start) / elapsed,
+            unit="ocr_pages_per_s",
+        )
+        if self._vectorization_started_at:
+            vect_elapsed = max(now - self._vectorization_started_at, 1e-6)
+            INGEST_THROUGHPUT.set(
+                self.progress["chunks_written"] / vect_elapsed, unit="chunks_per_s"
+            )
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (self.SUCCEEDED, self.FAILED, self.CANCELLED)
+
+    def eta_s(self) -> Optional[float]:
+        """
+        Estimation du temps restant, extrapolée du débit observé
+        (chunks écrits pendant la vectorisation, sinon fichiers extraits).
+        """
+        if self.status != self.RUNNING or self.started_at is None:
+            return None
+
+        p = self.progress
+        if self._vectorization_started_at and p["chunks_written"] > 0:
+            elapsed = time.time() - self._vectorization_started_at
+            remaining = p["chunks_total"] - p["chunks_written"]
+            return elapsed / p["chunks_written"] * remaining
+
+        if p["files_extracted"] > 0 and p["files_total"]:
+            elapsed = time.time() - self.started_at
+            remaining = p["files_total"] - p["files_extracted"]
+            # Extraction seule : la vectorisation reste à faire, l'ETA est un minorant
+            return elapsed / p["files_extracted"] * remaining
+
+        return None
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            progress = dict(self.progress)
+        end = self.finished_at or time.time()
+        eta = self.eta_s()
+        return {
+            "job_id": self.id,
+            "status": self.status,
+            "params": self.params,
+            "created_at": self.created_at,
+            "elapsed_s": round(end - self.started_at, 1) if self.started_at else None,
+            "eta_s": round(eta, 1) if eta is not None else None,
+            "progress": progress,
+            "error": self.error,
+        }
+
+
+class IngestJobManager:
+    """
+    Exécute les ingestions en tâche de fond, une à la fois, dans un worker dédié.
+
+    Le worker possède sa propre instance de Retrieval (son propre Vectorizor) :
+    l'ingestion ne change jamais le modèle utilisé par le moteur de requêtes.
+    """
+
+    def __init__(
+        self,
+        on_complete: Optional[Callable[[IngestJob], None]] = None,
+        max_history: int = 50,
+    ):
+        """
+        Args:
+            on_complete (Callable, optional): Appelé à la fin de tout job lancé, réussi,
+                annulé ou en échec (ex: invalider le moteur de requêtes pour rouvrir la
+                collection).
+            max_history (int): Nombre de jobs terminés conservés pour consultation.
+        """
+        self.on_complete = on_complete
+        self.max_history = max_history
+
+        self._worker = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rag-ingest")
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._jobs_lock = threading.Lock()
+
+        # Retrieval réservé au worker, réutilisé tant que les chemins ne changent pas
+        self._retrieval: Optional[Retrieval] = None
+        self._retrieval_key = None
+
+    def submit(self, config, on_conflict: str = "keep") -> IngestJob:
+        """
+        Soumet une ingestion de `config.rag.paths.docs` vers la collection configurée.
+
+        Args:
+            config (GlobalConfig): Configuration à utiliser pour ce job
+            on_conflict (str): "keep" ou "overwrite" si la collection existe
+                avec d'autres paramètres (jamais de question interactive ici)
+
+        Returns:
+            IngestJob: Le job créé (en attente)
+        """
+        params = {
+            "collection": config.rag.retrieval.collection_name,
+            "source_folder": str(config.rag.paths.docs),
+            "chunk_size": config.rag.retrieval.chunk_size,
+            "overlap": config.rag.retrieval.overlap,
+            "model": config.rag.retrieval.embedding_model,
+            "on_conflict": on_conflict,
+        }
+        job = IngestJob(params)
+
+        with self._jobs_lock:
+            self._jobs[job.id] = job
+            self._prune()
+
+        self._worker.submit(self._run, job, config)
+        print(f" [Ingest] Job {job.id} soumis → {params['collection']}")
+        return job
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        return self._jobs.get(job_id)
+
+    def list(self) -> List[dict]:
+        with self._jobs_lock:
+            return [job.to_dict() for job in reversed(self._jobs.values())]
+
+    def cancel(self, job_id: str) -> Optional[IngestJob]:
+        """
+        Demande l'annulation d'un job. Un job en attente ne démarrera pas ;
+        un job en cours s'arrête au prochain fichier ou lot de chunks.
+        """
+        job = self.get(job_id)
+        if job is not None and not job.finished:
+            job.cancel_event.set()
+            print(f" [Ingest] Annulation demandée pour le job {job_id}")
+        return job
+
+    def shutdown(self):
+        for job in list(self._jobs.values()):
+            job.cancel_event.set()
+        self._worker.shutdown(wait=False, cancel_futures=True)
+
+    # --- Worker ---
+
+    def _get_retrieval(self, config) -> Retrieval:
+        key = (
+            str(config.rag.paths.docs),
+            str(config.rag.paths.chroma_dir),
+            str(config.rag.paths.cache),
+        )
+        if self._retrieval is None or self._retrieval_key != key:
+            self._retrieval = Retrieval(
+                path_doc=config.rag.paths.docs,
+                chroma_persist_dir=config.rag.paths.chroma_dir,
+                processed_texts_dir=config.rag.paths.cache,
+            )
+            self._retrieval_key = key
+        return self._retrieval
+
+    def _run(self, job: IngestJob, config):
+        if job.cancel_event.is_set():
+            job.status = IngestJob.CANCELLED
+            job.finished_at = time.time()
+            return
+
+        job.status = IngestJob.RUNNING
+        job.started_at = time.time()
+        job._ocr_pages_at_start = INGEST_OCR_PAGES.value()
+        params = job.params
+        print(f" [Ingest] Début du job {job.id} vers : {params['collection']}")
+
+        try:
+            retrieval = self._get_retrieval(config)
+            success = retrieval.vectorize_with_config(
+                chunk_size=params["chunk_size"],
+                overlap=params["overlap"],
+                collection_name=params["collection"],
+                source_folder=params["source_folder"],
+                model_name=params["model"],
+                on_conflict=params["on_conflict"],
+                progress_callback=job.update,
+                cancel_event=job.cancel_event,
+            )
+            if success:
+                job.status = IngestJob.SUCCEEDED
+            else:
+                job.status = IngestJob.FAILED
+                job.error = "Echec de la vectorisation (voir logs)"
+
+        except IngestionCancelled as e:
+            job.status = IngestJob.CANCELLED
+            job.error = str(e)
+        except Exception as e:
+            traceback.print_exc()
+            job.status = IngestJob.FAILED
+            job.error = str(e)
+        finally:
+            job.finished_at = time.time()
+            print(f" [Ingest] Job {job.id} terminé : {job.status}")
+
+        if self.on_complete:
+            # Même annulée ou en échec, une ingestion a pu modifier la collection
+            # (écriture partielle, collection écrasée avec on_conflict="overwrite")
+            try:
+                self.on_complete(job)
+            except Exception as e:
+                print(f" [Ingest] Erreur dans on_complete : {e}")
+
+    def _prune(self):
+        finished = [jid for jid, job in self._jobs.items() if job.finished]
+        for jid in finished[: max(0, len(finished) - self.max_history)]:
+            del self._jobs[jid]
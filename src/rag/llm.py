@@ -1,19 +1,71 @@
+import time
+import asyncio
+import hashlib
 import httpx
-from openai import OpenAI
+import openai
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Optional, Tuple
+
+from .metrics import (
+    stage_timer,
+    STAGE_DURATION,
+    LLM_PROMPT_TOKENS,
+    DEADLINE_ADJUSTMENTS,
+    LLM_CANCELLED,
+    LLM_RECLAIMED_SECONDS,
+)
+from .settings import LLMSettings
+from .context_builder import TokenEstimator
+from .llm_pool import Backend, NoBackendAvailableError, shared_pool
+from .scheduler import LLMQueueFullError, current_priority
+from .singleflight import SingleFlight
+from . import deadline
+from .deadline import DeadlineExceeded, RateEstimator
+
+UNREACHABLE_MESSAGE = "ERREUR CRITIQUE : Le serveur LLM est injoignable. Vérifiez './start.sh'."
+ERROR_PREFIX = "Une erreur est survenue pendant l'inférence du LLM"
+
+
+def is_error_reply(text: str) -> bool:
+    """Vrai si le texte est un message d'erreur renvoyé à la place d'une réponse."""
+    return bool(text) and (text.startswith(UNREACHABLE_MESSAGE) or text.startswith(ERROR_PREFIX))
+
 
 class LLM:
+    # Part du temps restant prévue pour la génération (le reste absorbe la variabilité)
+    DEADLINE_MARGIN = 0.85
+
     def __init__(
         self,
         model: str = "Meta-Llama-3.1-8B-Instruct-Q4_K_M.gguf",
         base_url: str = "http://127.0.0.1:8080/v1",
         api_key: str = "pas_de_clef",
+        settings: Optional[LLMSettings] = None,
+        base_urls: Optional[List[str]] = None,
     ):
+        """
+        Args:
+            base_url (str): Serveur LLM (utilisé si base_urls est vide)
+            base_urls (List[str], optional): Plusieurs serveurs, répartis par llm_pool.LLMPool
+        """
         self.model_name = model
-        self.base_url = base_url
+        self.base_urls = list(base_urls) if base_urls else [base_url]
+        self.base_url = self.base_urls[0]
+        self.settings = settings or LLMSettings()
+        # Estimation des tokens, recalée sur les comptes réels du serveur (usage)
+        self.token_estimator = TokenEstimator(self.settings.chars_per_token)
+        # Débits de prefill / génération, pour adapter max_tokens au temps restant
+        self.rates = RateEstimator(
+            self.settings.prefill_tokens_per_s,
+            self.settings.decode_tokens_per_s,
+            completion_tokens=min(256, self.settings.max_tokens),
+        )
         
-        # 3. Initialisation du client OpenAI pointant vers ton serveur local
-        # timeout=300.0 : On laisse 5 minutes max au modèle (sécurité pour les contextes longs)
-        self.client = OpenAI(base_url=base_url, api_key=api_key, timeout=300.0)
+        # 3. Clients OpenAI partagés pointant vers tes serveurs (pool httpx + keep-alive).
+        # Timeouts de connexion / lecture / total configurables (section "llm" de la config).
+        # Avec plusieurs serveurs, chaque requête va au moins chargé des serveurs sains.
+        self.pool = shared_pool(self.base_urls, api_key, self.settings)
+        primary = self.pool.backends[0]
+        self.client, self.async_client = primary.client, primary.async_client
 
         # Définition de la personnalité de l'IA
         self.system_message = {
@@ -26,58 +78,604 @@ class LLM:
             ),
         }
         
-        # 4. Vérification immédiate : est-ce que le serveur tourne ?
-        self._check_connection()
+        # Appels identiques en cours regroupés (voir singleflight.py)
+        self.single_flight = SingleFlight() if self.settings.coalesce_requests else None
+
+        # 4. Vérification immédiate (une seule fois par pool) : est-ce que les serveurs tournent ?
+        if not self.pool.connection_checked:
+            self.pool.connection_checked = True
+            self._check_connection()
 
     def _check_connection(self):
         """
-        Vérifie si le serveur Llama.cpp est accessible dès le démarrage.
+        Vérifie si les serveurs Llama.cpp sont accessibles dès le démarrage.
+        """
+        for backend in self.pool.backends:
+            try:
+                # Requête légère pour voir si le serveur répond
+                backend.client.models.list()
+                print(f" [LLM] Connecté avec succès sur {backend.base_url}")
+                print(f"   Modèle cible : {self.model_name}")
+            except (httpx.ConnectError, openai.APIConnectionError):
+                # Message d'erreur pédagogique si le serveur est éteint
+                print(f"\n [LLM] ERREUR : Impossible de se connecter à {backend.base_url}")
+                print("   -> Le serveur LLM semble éteint.")
+                print("   -> Avez-vous lancé './start.sh' dans un autre terminal ?")
+            except Exception as e:
+                print(f" [LLM] Avertissement connexion : {e}")
+
+    def is_reachable(self, timeout: float = 5.0) -> bool:
+        """
+        Sonde légère (liste des modèles) des serveurs LLM, sans message ni exception.
+        Sert au contrôle de disponibilité (/readyz) : vrai si au moins un serveur répond.
+        L'état des disjoncteurs n'est pas modifié (voir LLMPool.reachable()).
         """
         try:
-            # Requête légère pour voir si le serveur répond
-            self.client.models.list()
-            print(f" [LLM] Connecté avec succès sur {self.base_url}")
-            print(f"   Modèle cible : {self.model_name}")
-        except httpx.ConnectError:
-            # Message d'erreur pédagogique si le serveur est éteint
-            print(f"\n [LLM] ERREUR : Impossible de se connecter à {self.base_url}")
-            print("   -> Le serveur LLM semble éteint.")
-            print("   -> Avez-vous lancé './start.sh' dans un autre terminal ?")
-        except Exception as e:
-            print(f" [LLM] Avertissement connexion : {e}")
+            return self.pool.reachable(timeout=timeout)
+        except Exception:
+            return False
+
+    def _next_backend(self, tried: List[Backend], last_error: Optional[Exception]) -> Backend:
+        try:
+            return self.pool.acquire(exclude=tried)
+        except NoBackendAvailableError:
+            # Tous les serveurs essayés : on remonte la dernière vraie erreur
+            if last_error is not None:
+                raise last_error
+            raise
+
+    async def _anext_backend(self, tried: List[Backend], last_error: Optional[Exception]) -> Backend:
+        try:
+            return await self.pool.aacquire(exclude=tried)
+        except NoBackendAvailableError:
+            if last_error is not None:
+                raise last_error
+            raise
 
-    def infere(self, request: str) -> str:
+    def _call(self, request_fn: Callable, hold: bool = False) -> Tuple[Backend, object]:
         """
-        Envoie le prompt (qui contient déjà le Contexte + la Question via rag.py) au LLM.
+        Exécute request_fn(client) sur le serveur le moins chargé ; en cas d'échec du
+        serveur (connexion, timeout, 5xx), bascule sur le suivant.
+
+        Args:
+            hold (bool): Garde le serveur réservé au retour (flux : à rendre via pool.release)
         """
-        
+        tried: List[Backend] = []
+        last_error = None
+        while True:
+            backend = self._next_backend(tried, last_error)
+            tried.append(backend)
+            start = time.perf_counter()
+            try:
+                result = request_fn(backend.client)
+            except BaseException as e:
+                if isinstance(e, Exception) and deadline.expired():
+                    # Coupé par l'échéance de la requête : le serveur n'est pas en cause
+                    self.pool.release(backend, time.perf_counter() - start, DeadlineExceeded("llm"))
+                    raise deadline.exceeded("llm") from e
+                self.pool.release(backend, time.perf_counter() - start, e)
+                if not isinstance(e, Exception) or not self.pool.is_backend_failure(e):
+                    raise
+                print(f" [LLM] Échec sur {backend.base_url}, bascule : {e}")
+                last_error = e
+                continue
+            if not hold:
+                self.pool.release(backend, time.perf_counter() - start)
+            return backend, result
+
+    async def _acall(self, request_fn: Callable[..., Awaitable], hold: bool = False) -> Tuple[Backend, object]:
+        """Version asynchrone de _call() (request_fn reçoit le client async)."""
+        tried: List[Backend] = []
+        last_error = None
+        while True:
+            backend = await self._anext_backend(tried, last_error)
+            tried.append(backend)
+            start = time.perf_counter()
+            try:
+                result = await request_fn(backend.async_client)
+            except BaseException as e:
+                if isinstance(e, Exception) and deadline.expired():
+                    # Coupé par l'échéance de la requête : le serveur n'est pas en cause
+                    self.pool.release(backend, time.perf_counter() - start, DeadlineExceeded("llm"))
+                    raise deadline.exceeded("llm") from e
+                self.pool.release(backend, time.perf_counter() - start, e)
+                if not isinstance(e, Exception) or not self.pool.is_backend_failure(e):
+                    raise
+                print(f" [LLM] Échec sur {backend.base_url}, bascule : {e}")
+                last_error = e
+                continue
+            if not hold:
+                self.pool.release(backend, time.perf_counter() - start)
+            return backend, result
+
+    def build_system_prompt(self, instructions: str = "") -> str:
+        """
+        Préfixe statique du prompt : personnalité + consignes fixes du template.
+        À construire une fois et réutiliser tel quel (voir Rag.static_prefix).
+        """
+        if not instructions:
+            return self.system_message["content"]
+        return self.system_message["content"] + "\n\n" + instructions
+
+    def _build_messages(self, request: str, system: Optional[str] = None) -> list:
         # 5. Mode "Stateless" (Sans mémoire) pour le RAG
         # On recrée la conversation à chaque appel.
         # Pourquoi ? Parce que rag.py envoie un énorme bloc de texte (le contexte).
         # Si on gardait l'historique, la 2ème question enverrait (Contexte1 + Q1 + R1 + Contexte2 + Q2)...
         # ... et ferait exploser la limite de mémoire du modèle (8192 tokens).
-        messages = [
-            self.system_message,
+        # Le message système (préfixe statique) vient en premier : llama.cpp peut réutiliser
+        # son cache KV tant que ce préfixe est identique.
+        system_message = self.system_message if system is None else {"role": "system", "content": system}
+        return [
+            system_message,
             {"role": "user", "content": request}
         ]
 
+    def prompt_overhead_chars(self, system: Optional[str] = None) -> int:
+        """Caractères ajoutés au prompt par le message système."""
+        return len(self.system_message["content"] if system is None else system)
+
+    def _observe_prompt(self, request: str, prompt_tokens: Optional[int], system: Optional[str] = None):
+        self.token_estimator.observe(
+            len(request) + self.prompt_overhead_chars(system), prompt_tokens or 0
+        )
+
+    def _cache_hints(self) -> dict:
+        """
+        Paramètres propres à llama.cpp (ignorés par un serveur OpenAI standard) :
+        cache_prompt réutilise le cache KV du préfixe commun. Aucun slot n'est imposé
+        (id_slot) : le préfixe étant stable à l'octet près, le serveur le retrouve dans
+        le slot qui le porte, sans sérialiser une collection sur un seul slot.
+        """
+        extra = {}
+        if self.settings.cache_prompt:
+            extra["cache_prompt"] = True
+        return extra
+
+    def _prompt_tokens(self, request: str, system: Optional[str] = None) -> int:
+        """Taille estimée du prompt complet (message système compris), en tokens."""
+        return self.token_estimator.count(request) + self.token_estimator.count(
+            "x" * self.prompt_overhead_chars(system)
+        )
+
+    def _max_tokens(self, request: str, system: Optional[str] = None) -> int:
+        """
+        max_tokens de la requête : celui de la config, réduit à ce que le serveur peut
+        générer dans le temps restant de l'échéance (prefill du prompt compris).
+
+        Raises:
+            DeadlineExceeded: s'il ne reste pas le temps d'une réponse minimale.
+        """
+        remaining = deadline.remaining()
+        if remaining is None:
+            return self.settings.max_tokens
+        prompt_tokens = self._prompt_tokens(request, system)
+        affordable = self.rates.affordable_tokens(remaining * self.DEADLINE_MARGIN, prompt_tokens)
+        if affordable < min(self.settings.min_answer_tokens, self.settings.max_tokens):
+            raise deadline.exceeded("llm")
+        if affordable < self.settings.max_tokens:
+            DEADLINE_ADJUSTMENTS.inc(kind="max_tokens")
+            return affordable
+        return self.settings.max_tokens
+
+    def _completion_params(
+        self,
+        request: str,
+        system: Optional[str] = None,
+    ) -> dict:
+        params = dict(
+            model=self.model_name,
+            messages=self._build_messages(request, system),
+            temperature=0.1,  # Température basse = Réponses factuelles (pas d'invention)
+            top_p=0.9,
+            max_tokens=self._max_tokens(request, system),  # Limite la longueur de la réponse
+        )
+        extra_body = self._cache_hints()
+        if extra_body:
+            params["extra_body"] = extra_body
+        remaining = deadline.remaining()
+        if remaining is not None:
+            # La requête HTTP ne survit pas à l'échéance
+            params["timeout"] = remaining
+        return params
+
+    def _time_limit(self) -> float:
+        """Durée max de la génération : délai total, borné par l'échéance de la requête."""
+        remaining = deadline.remaining()
+        if remaining is None:
+            return self.settings.total_timeout_s
+        return min(self.settings.total_timeout_s, remaining)
+
+    def _timeout_reply(self) -> str:
+        if deadline.expired():
+            raise deadline.exceeded("llm")
+        return f"{ERROR_PREFIX} : délai total de {self.settings.total_timeout_s} s dépassé"
+
+    def _start_span(self, span, request: str, system: Optional[str], stream: bool = False):
+        system_prompt = self.system_message["content"] if system is None else system
+        span.set(
+            model=self.model_name,
+            prompt_chars=len(request) + len(system_prompt),
+            prefix_chars=len(system_prompt),
+            prefix_hash=hashlib.sha256(system_prompt.encode("utf-8")).hexdigest()[:12],
+            stream=stream,
+            **self._cache_hints(),
+        )
+
+    def _record_server_timings(self, span, response):
+        """
+        Durées renvoyées par llama.cpp ("timings") : prefill (évaluation du prompt) et
+        génération, tokens du prompt réutilisés depuis le cache KV. Permet de comparer
+        la latence avec et sans réutilisation du préfixe.
+        """
+        extra = getattr(response, "model_extra", None) or {}
+        timings = extra.get("timings")
+        if not isinstance(timings, dict):
+            return
+        prompt_ms = timings.get("prompt_ms")
+        predicted_ms = timings.get("predicted_ms")
+        if prompt_ms is not None:
+            STAGE_DURATION.observe(prompt_ms / 1000.0, stage="llm_prefill")
+        if predicted_ms is not None:
+            STAGE_DURATION.observe(predicted_ms / 1000.0, stage="llm_decode")
+        evaluated = timings.get("prompt_n") or 0
+        cached = timings.get("cache_n") or 0
+        self.rates.observe(evaluated, prompt_ms, timings.get("predicted_n") or 0, predicted_ms)
+        LLM_PROMPT_TOKENS.inc(evaluated, kind="evaluated")
+        LLM_PROMPT_TOKENS.inc(cached, kind="cached")
+        span.set(
+            prefill_ms=prompt_ms,
+            decode_ms=predicted_ms,
+            prompt_tokens_evaluated=evaluated,
+            prompt_tokens_cached=cached,
+        )
+
+    def _record_completion(self, span, completion, request: str, system: Optional[str]):
+        usage = getattr(completion, "usage", None)
+        if usage is not None:
+            span.set(
+                prompt_tokens=usage.prompt_tokens,
+                completion_tokens=usage.completion_tokens,
+            )
+            self._observe_prompt(request, usage.prompt_tokens, system)
+            self.rates.observe_completion(usage.completion_tokens)
+        self._record_server_timings(span, completion)
+
+    def _record_cancelled(
+        self,
+        span,
+        mode: str,
+        request: str,
+        system: Optional[str],
+        elapsed_s: float,
+        generated_tokens: int = 0,
+    ):
+        """
+        Génération interrompue (client parti) : la connexion HTTP fermée, llama.cpp libère
+        le slot. Compte le temps de génération qu'il y aurait encore passé.
+        """
+        reclaimed = self.rates.remaining_generation_s(
+            elapsed_s, self._prompt_tokens(request, system), generated_tokens
+        )
+        LLM_CANCELLED.inc(mode=mode)
+        LLM_RECLAIMED_SECONDS.inc(reclaimed, mode=mode)
+        span.set(cancelled=True, reclaimed_s=round(reclaimed, 3))
+
+    def _flight_key(self, request: str, system: Optional[str]) -> str:
+        """
+        Deux appels de même clé produiraient la même génération (mêmes messages et
+        réglages) avec la même place dans la file des slots (priorité).
+        """
+        parts = (
+            self.model_name,
+            str(self.settings.max_tokens),
+            current_priority(),
+            self.system_message["content"] if system is None else system,
+            request,
+        )
+        return hashlib.sha256("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+    def _report(self, report: Optional[dict], params: dict, finish_reason: Optional[str]):
+        """Indique à l'appelant si la réponse a pu être coupée (voir infere())."""
+        if report is not None:
+            report["truncated"] = (
+                params["max_tokens"] < self.settings.max_tokens or finish_reason == "length"
+            )
+
+    @staticmethod
+    def _expires_at() -> Optional[float]:
+        current = deadline.current()
+        return current.expires_at if current is not None else None
+
+    def infere(self, request: str, system: Optional[str] = None, report: Optional[dict] = None) -> str:
+        """
+        Envoie le prompt (qui contient déjà le Contexte + la Question via rag.py) au LLM.
+        Un appel identique déjà en cours est partagé au lieu d'être renvoyé au serveur.
+
+        Args:
+            request (str): Partie variable du prompt (contexte + question)
+            system (str, optional): Préfixe statique (défaut : message système seul)
+            report (dict, optional): Rempli en fin de génération : {"truncated": bool}, vrai si
+                la réponse a pu être coupée (max_tokens réduit par l'échéance, ou
+                finish_reason "length"). Reste vide pour une génération partagée
+                (celle d'un autre appel) ou en erreur.
+        """
+        if self.single_flight is None:
+            return self._infere(request, system, report)
         try:
-            completion = self.client.chat.completions.create(
-                model=self.model_name,
-                messages=messages,
-                temperature=0.1,  # Température basse = Réponses factuelles (pas d'invention)
-                top_p=0.9,
-                max_tokens=4096,  # Limite la longueur de la réponse
-                stream=False
+            return self.single_flight.do(
+                self._flight_key(request, system),
+                lambda: self._infere(request, system, report),
+                expires_at=self._expires_at(),
             )
+        except DeadlineExceeded:
+            # Échéance d'un leader (génération partagée) : pas celle de cet appel
+            if deadline.expired():
+                raise
+            return self._infere(request, system, report)
+
+    def infere_stream(self, request: str, system: Optional[str] = None, report: Optional[dict] = None) -> Iterator[str]:
+        """
+        Comme infere(), mais renvoie les tokens au fil de leur génération.
+
+        Returns:
+            Iterator[str]: Fragments de texte de la réponse, dans l'ordre
+        """
+        if self.single_flight is None:
+            return self._infere_stream(request, system, report)
+        return self._shared_stream(request, system, report)
+
+    def _shared_stream(self, request: str, system: Optional[str], report: Optional[dict]) -> Iterator[str]:
+        shared = self.single_flight.stream(
+            self._flight_key(request, system),
+            lambda: self._infere_stream(request, system, report),
+            expires_at=self._expires_at(),
+        )
+        started = False
+        try:
+            for token in shared:
+                started = True
+                yield token
+        except DeadlineExceeded:
+            # Le leader a au moins autant de temps que cet appel : seul un abandon avant
+            # le premier token (réponse minimale inatteignable pour lui) peut ne pas le concerner
+            if started or deadline.expired():
+                raise
+            yield from self._infere_stream(request, system, report)
+        finally:
+            shared.close()
+
+    async def ainfere(self, request: str, system: Optional[str] = None, report: Optional[dict] = None) -> str:
+        """
+        Version asynchrone de infere() : l'attente de la génération n'occupe aucun thread,
+        une seule boucle asyncio peut donc alimenter tous les slots du serveur llama.cpp.
+        """
+        if self.single_flight is None:
+            return await self._ainfere(request, system, report)
+        shared = self.single_flight.ado(
+            self._flight_key(request, system),
+            lambda: self._ainfere(request, system, report),
+            expires_at=self._expires_at(),
+        )
+        remaining = deadline.remaining()
+        try:
+            if remaining is None:
+                return await shared
+            # Une requête qui rejoint un appel en cours n'attend pas au-delà de sa propre échéance
+            return await asyncio.wait_for(shared, timeout=remaining)
+        except DeadlineExceeded:
+            # Échéance d'un leader (génération partagée) : pas celle de cet appel
+            # (avant TimeoutError, dont DeadlineExceeded hérite)
+            if deadline.expired():
+                raise
+            return await self._ainfere(request, system, report)
+        except asyncio.TimeoutError:
+            if deadline.expired():
+                raise deadline.exceeded("llm")
+            raise
+
+    def ainfere_stream(self, request: str, system: Optional[str] = None, report: Optional[dict] = None) -> AsyncIterator[str]:
+        """Version asynchrone de infere_stream()."""
+        if self.single_flight is None:
+            return self._ainfere_stream(request, system, report)
+        return self._ashared_stream(request, system, report)
+
+    async def _ashared_stream(self, request: str, system: Optional[str], report: Optional[dict]) -> AsyncIterator[str]:
+        shared = self.single_flight.astream(
+            self._flight_key(request, system),
+            lambda: self._ainfere_stream(request, system, report),
+            expires_at=self._expires_at(),
+        )
+        started = False
+        try:
+            async for token in shared:
+                started = True
+                yield token
+        except DeadlineExceeded:
+            if started or deadline.expired():
+                raise
+            own = self._ainfere_stream(request, system, report)
+            try:
+                async for token in own:
+                    yield token
+            finally:
+                await own.aclose()
+        finally:
+            await shared.aclose()
+
+    def _infere(self, request: str, system: Optional[str] = None, report: Optional[dict] = None) -> str:
+        try:
+            with stage_timer("llm") as span:
+                self._start_span(span, request, system)
+                params = self._completion_params(request, system)
+                backend, completion = self._call(
+                    lambda client: client.chat.completions.create(**params, stream=False)
+                )
+                span.set(backend=backend.base_url)
+                self._record_completion(span, completion, request, system)
             
             reply = completion.choices[0].message.content
+            self._report(report, params, completion.choices[0].finish_reason)
             return reply
 
+        except (DeadlineExceeded, LLMQueueFullError):
+            raise
+        except httpx.ConnectError:
+            return UNREACHABLE_MESSAGE
+        except Exception as e:
+            return f"{ERROR_PREFIX} : {e}"
+
+    def _infere_stream(self, request: str, system: Optional[str] = None, report: Optional[dict] = None) -> Iterator[str]:
+        try:
+            with stage_timer("llm") as span:
+                self._start_span(span, request, system, stream=True)
+                start = time.perf_counter()
+                stop_at = start + self._time_limit()
+                first_token = True
+                chunks = 0
+                params = self._completion_params(request, system)
+                # Bascule possible tant que rien n'a été envoyé au client
+                backend, stream = self._call(
+                    lambda client: client.chat.completions.create(**params, stream=True),
+                    hold=True,
+                )
+                span.set(backend=backend.base_url)
+                stream_error = None
+                finish_reason = None
+                try:
+                    for chunk in stream:
+                        if time.perf_counter() > stop_at:
+                            raise TimeoutError()
+                        # Le dernier fragment de llama.cpp porte les "timings"
+                        self._record_server_timings(span, chunk)
+                        if not chunk.choices:
+                            continue
+                        finish_reason = chunk.choices[0].finish_reason or finish_reason
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            if first_token:
+                                ttft = time.perf_counter() - start
+                                STAGE_DURATION.observe(ttft, stage="llm_first_token")
+                                span.set(ttft_s=round(ttft, 4))
+                                first_token = False
+                            chunks += 1
+                            yield delta
+                    self.rates.observe_completion(chunks)
+                    self._report(report, params, finish_reason)
+                except BaseException as e:
+                    stream_error = e
+                    if isinstance(e, GeneratorExit):
+                        self._record_cancelled(
+                            span, "stream", request, system, time.perf_counter() - start, chunks
+                        )
+                    raise
+                finally:
+                    span.set(chunks=chunks)
+                    # Ferme la connexion HTTP si le consommateur s'arrête en route
+                    stream.close()
+                    self.pool.release(backend, time.perf_counter() - start, stream_error)
+
+        except (DeadlineExceeded, LLMQueueFullError):
+            raise
+        except httpx.ConnectError:
+            yield UNREACHABLE_MESSAGE
+        except TimeoutError:
+            yield self._timeout_reply()
+        except Exception as e:
+            yield f"{ERROR_PREFIX} : {e}"
+
+    async def _ainfere(self, request: str, system: Optional[str] = None, report: Optional[dict] = None) -> str:
+        try:
+            with stage_timer("llm") as span:
+                self._start_span(span, request, system)
+                params = self._completion_params(request, system)
+                start = time.perf_counter()
+                try:
+                    backend, completion = await asyncio.wait_for(
+                        self._acall(
+                            lambda client: client.chat.completions.create(**params, stream=False)
+                        ),
+                        timeout=self._time_limit(),
+                    )
+                except asyncio.CancelledError:
+                    # Annulé par l'API (client parti) : la requête HTTP en cours est fermée
+                    self._record_cancelled(span, "call", request, system, time.perf_counter() - start)
+                    raise
+                span.set(backend=backend.base_url)
+                self._record_completion(span, completion, request, system)
+
+            self._report(report, params, completion.choices[0].finish_reason)
+            return completion.choices[0].message.content
+
+        except (DeadlineExceeded, LLMQueueFullError):
+            raise
+        except httpx.ConnectError:
+            return UNREACHABLE_MESSAGE
+        except asyncio.TimeoutError:
+            return self._timeout_reply()
+        except Exception as e:
+            return f"{ERROR_PREFIX} : {e}"
+
+    async def _ainfere_stream(self, request: str, system: Optional[str] = None, report: Optional[dict] = None) -> AsyncIterator[str]:
+        try:
+            with stage_timer("llm") as span:
+                self._start_span(span, request, system, stream=True)
+                start = time.perf_counter()
+                stop_at = start + self._time_limit()
+                first_token = True
+                chunks = 0
+                params = self._completion_params(request, system)
+                try:
+                    backend, stream = await self._acall(
+                        lambda client: client.chat.completions.create(**params, stream=True),
+                        hold=True,
+                    )
+                except asyncio.CancelledError:
+                    self._record_cancelled(span, "stream", request, system, time.perf_counter() - start)
+                    raise
+                span.set(backend=backend.base_url)
+                stream_error = None
+                finish_reason = None
+                try:
+                    async for chunk in stream:
+                        if time.perf_counter() > stop_at:
+                            raise asyncio.TimeoutError()
+                        self._record_server_timings(span, chunk)
+                        if not chunk.choices:
+                            continue
+                        finish_reason = chunk.choices[0].finish_reason or finish_reason
+                        delta = chunk.choices[0].delta.content
+                        if delta:
+                            if first_token:
+                                ttft = time.perf_counter() - start
+                                STAGE_DURATION.observe(ttft, stage="llm_first_token")
+                                span.set(ttft_s=round(ttft, 4))
+                                first_token = False
+                            chunks += 1
+                            yield delta
+                    self.rates.observe_completion(chunks)
+                    self._report(report, params, finish_reason)
+                except BaseException as e:
+                    stream_error = e
+                    if isinstance(e, (GeneratorExit, asyncio.CancelledError)):
+                        self._record_cancelled(
+                            span, "stream", request, system, time.perf_counter() - start, chunks
+                        )
+                    raise
+                finally:
+                    span.set(chunks=chunks)
+                    # Ferme la connexion : llama.cpp arrête la génération et libère le slot
+                    await stream.close()
+                    self.pool.release(backend, time.perf_counter() - start, stream_error)
+
+        except (DeadlineExceeded, LLMQueueFullError):
+            raise
         except httpx.ConnectError:
-            return "ERREUR CRITIQUE : Le serveur LLM est injoignable. Vérifiez './start.sh'."
+            yield UNREACHABLE_MESSAGE
+        except asyncio.TimeoutError:
+            yield self._timeout_reply()
         except Exception as e:
-            return f"Une erreur est survenue pendant l'inférence du LLM : {e}"
+            yield f"{ERROR_PREFIX} : {e}"
         
     def reset_conversation(self):
         """
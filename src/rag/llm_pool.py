@@ -0,0 +1,371 @@
+"""
+Pool de serveurs LLM (plusieurs llama.cpp derrière la même API OpenAI).
+
+Chaque requête part vers le serveur sain qui a le moins de requêtes en cours, dans
+la limite de ses slots libres (sinon elle attend son tour, voir scheduler.py).
+Un serveur qui échoue plusieurs fois de suite est éjecté (disjoncteur ouvert) ;
+après un délai, une requête d'essai ou la sonde périodique le réintègre s'il répond.
+"""
+import time
+import threading
+from collections import deque
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+
+from .settings import LLMSettings
+from .metrics import LLM_BACKEND_REQUESTS, LLM_BACKEND_LATENCY
+from .scheduler import SlotScheduler
+
+# Clients partagés par tout le processus, un couple (sync, async) par serveur et réglages
+_CLIENTS: Dict[tuple, Tuple[OpenAI, AsyncOpenAI]] = {}
+_CLIENTS_LOCK = threading.Lock()
+
+# Pools partagés (mêmes serveurs, mêmes réglages) : les statistiques survivent aux rechargements
+_POOLS: Dict[tuple, "LLMPool"] = {}
+
+
+def shared_clients(base_url: str, api_key: str, settings: LLMSettings) -> Tuple[OpenAI, AsyncOpenAI, bool]:
+    """
+    Clients OpenAI (sync et async) partagés, sur des pools httpx avec keep-alive.
+
+    Returns:
+        Tuple: (client sync, client async, True si les clients viennent d'être créés)
+    """
+    key = (base_url, api_key, settings.model_dump_json())
+    with _CLIENTS_LOCK:
+        if key in _CLIENTS:
+            return _CLIENTS[key] + (False,)
+
+        timeout = httpx.Timeout(
+            settings.read_timeout_s,
+            connect=settings.connect_timeout_s,
+            pool=settings.pool_timeout_s,
+        )
+        limits = httpx.Limits(
+            max_connections=settings.max_connections,
+            max_keepalive_connections=settings.max_keepalive_connections,
+            keepalive_expiry=settings.keepalive_expiry_s,
+        )
+        client = OpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            timeout=timeout,
+            max_retries=settings.max_retries,
+            http_client=httpx.Client(timeout=timeout, limits=limits),
+        )
+        async_client = AsyncOpenAI(
+            base_url=base_url,
+            api_key=api_key,
+            timeout=timeout,
+            max_retries=settings.max_retries,
+            http_client=httpx.AsyncClient(timeout=timeout, limits=limits),
+        )
+        _CLIENTS[key] = (client, async_client)
+        return client, async_client, True
+
+
+def shared_pool(base_urls: Sequence[str], api_key: str, settings: LLMSettings) -> "LLMPool":
+    """Pool partagé pour ces serveurs et ces réglages (créé au premier appel)."""
+    key = (tuple(base_urls), api_key, settings.model_dump_json())
+    with _CLIENTS_LOCK:
+        pool = _POOLS.get(key)
+    if pool is not None:
+        return pool
+
+    pool = LLMPool(base_urls, api_key, settings)
+    with _CLIENTS_LOCK:
+        existing = _POOLS.setdefault(key, pool)
+    if existing is not pool:
+        pool.close()
+        return existing
+    pool.start_health_checks()
+    pool.scheduler.start()
+    return pool
+
+
+def pools() -> List["LLMPool"]:
+    with _CLIENTS_LOCK:
+        return list(_POOLS.values())
+
+
+async def aclose_shared_clients():
+    """Ferme les pools de connexions et arrête les sondes (arrêt de l'API)."""
+    with _CLIENTS_LOCK:
+        clients = list(_CLIENTS.values())
+        _CLIENTS.clear()
+        llm_pools = list(_POOLS.values())
+        _POOLS.clear()
+    for pool in llm_pools:
+        pool.close()
+    for client, async_client in clients:
+        client.close()
+        await async_client.close()
+
+
+class NoBackendAvailableError(httpx.ConnectError):
+    """Aucun serveur LLM disponible (tous éjectés ou déjà essayés)."""
+
+
+class Backend:
+    """Un serveur LLM du pool : ses clients, son état de disjoncteur et ses statistiques."""
+
+    CLOSED = "closed"        # Sain : reçoit du trafic
+    OPEN = "open"            # Éjecté : ne reçoit rien jusqu'à la fin du délai
+    HALF_OPEN = "half_open"  # Délai écoulé : une seule requête d'essai à la fois
+
+    def __init__(self, base_url: str, api_key: str, settings: LLMSettings):
+        self.base_url = base_url
+        self.client, self.async_client, _ = shared_clients(base_url, api_key, settings)
+
+        self.state = self.CLOSED
+        self.outstanding = 0
+        self.requests = 0
+        self.errors = 0
+        self.consecutive_failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.last_error: Optional[str] = None
+        self._latencies: deque = deque(maxlen=512)
+
+    def stats(self) -> dict:
+        latencies = sorted(self._latencies)
+
+        def percentile(q: float) -> Optional[float]:
+            if not latencies:
+                return None
+            return round(latencies[min(len(latencies) - 1, int(q * len(latencies)))] * 1000, 1)
+
+        return {
+            "base_url": self.base_url,
+            "state": self.state,
+            "outstanding": self.outstanding,
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(self.errors / self.requests, 4) if self.requests else 0.0,
+            "latency_ms_p50": percentile(0.5),
+            "latency_ms_p95": percentile(0.95),
+            "last_error": self.last_error,
+        }
+
+
+class LLMPool:
+    """
+    Répartit les requêtes entre plusieurs serveurs LLM.
+
+    Routage : serveur disponible avec le moins de requêtes en cours (à égalité, le
+    moins sollicité). Disjoncteur : `breaker_failures` échecs consécutifs (connexion,
+    timeout, erreur 5xx) éjectent le serveur pendant `breaker_cooldown_s` ; ensuite une
+    requête d'essai (ou la sonde périodique) le réintègre si elle réussit.
+    Avec un seul serveur, le comportement est celui d'un client simple.
+    """
+
+    def __init__(self, base_urls: Sequence[str], api_key: str, settings: LLMSettings):
+        if not base_urls:
+            raise ValueError("Le pool LLM demande au moins un serveur")
+        self.settings = settings
+        urls = list(dict.fromkeys(base_urls))
+        # Avec plusieurs serveurs, basculer vaut mieux que réessayer sur un serveur en panne
+        client_settings = settings if len(urls) == 1 else settings.model_copy(update={"max_retries": 0})
+        self.backends = [Backend(url, api_key, client_settings) for url in urls]
+        self.connection_checked = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._health_thread: Optional[threading.Thread] = None
+        self.scheduler = SlotScheduler(self, settings)
+
+    @staticmethod
+    def is_backend_failure(error: BaseException) -> bool:
+        """Erreur imputable au serveur (et non à la requête ou à un client parti)."""
+        if isinstance(error, (httpx.ConnectError, httpx.TimeoutException)):
+            return True
+        if isinstance(error, openai.APIConnectionError):  # Inclut APITimeoutError
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code >= 500
+        return False
+
+    def _available_locked(self, backend: Backend, now: float) -> bool:
+        if backend.state == Backend.OPEN and now - backend.opened_at >= self.settings.breaker_cooldown_s:
+            backend.state = Backend.HALF_OPEN
+            backend.probing = False
+        if backend.state == Backend.HALF_OPEN:
+            return not backend.probing
+        return backend.state == Backend.CLOSED
+
+    def _try_reserve_locked(self, exclude: Sequence[Backend] = ()) -> Optional[Backend]:
+        """
+        Réserve le serveur le moins chargé parmi ceux qui ont une place libre.
+
+        Returns:
+            Optional[Backend]: None si les serveurs disponibles sont tous pleins
+
+        Raises:
+            NoBackendAvailableError: si aucun serveur n'est disponible.
+        """
+        now = time.monotonic()
+        candidates = [
+            b for b in self.backends
+            if b not in exclude and self._available_locked(b, now)
+        ]
+        if not candidates:
+            raise NoBackendAvailableError("Aucun serveur LLM disponible")
+        free = [b for b in candidates if b.outstanding < self.scheduler.capacity_locked(b)]
+        if not free:
+            return None
+        backend = min(free, key=lambda b: (b.outstanding, b.requests))
+        backend.outstanding += 1
+        backend.requests += 1
+        if backend.state == Backend.HALF_OPEN:
+            backend.probing = True
+        return backend
+
+    def _unreserve_locked(self, backend: Backend):
+        """Annule une réservation jamais utilisée (demandeur parti avant l'envoi)."""
+        backend.outstanding -= 1
+        backend.requests -= 1
+        backend.probing = False
+        self.scheduler.dispatch_locked()
+
+    def acquire(self, exclude: Sequence[Backend] = (), priority: Optional[str] = None) -> Backend:
+        """
+        Réserve le serveur le moins chargé (à rendre avec release()), en attendant une
+        place libre si tous sont pleins.
+
+        Raises:
+            NoBackendAvailableError: si aucun serveur n'est disponible.
+            LLMQueueFullError: si la file d'attente rejette la requête.
+        """
+        return self.scheduler.acquire(exclude, priority)
+
+    async def aacquire(self, exclude: Sequence[Backend] = (), priority: Optional[str] = None) -> Backend:
+        """Version asynchrone de acquire()."""
+        return await self.scheduler.aacquire(exclude, priority)
+
+    def release(self, backend: Backend, duration_s: float, error: Optional[BaseException] = None):
+        failure = error is not None and self.is_backend_failure(error)
+        with self._lock:
+            backend.outstanding -= 1
+            backend.probing = False
+            if failure:
+                self._record_failure_locked(backend, error)
+            elif error is None:
+                backend._latencies.append(duration_s)
+                self._record_success_locked(backend)
+            # Une place s'est libérée : la prochaine requête en attente part
+            self.scheduler.dispatch_locked()
+
+        if failure:
+            LLM_BACKEND_REQUESTS.inc(backend=backend.base_url, result="error")
+        elif error is None:
+            LLM_BACKEND_REQUESTS.inc(backend=backend.base_url, result="ok")
+            LLM_BACKEND_LATENCY.observe(duration_s, backend=backend.base_url)
+        else:
+            # Erreur de la requête elle-même ou client parti : le serveur n'est pas en cause
+            LLM_BACKEND_REQUESTS.inc(backend=backend.base_url, result="aborted")
+
+    def _record_success_locked(self, backend: Backend):
+        backend.consecutive_failures = 0
+        if backend.state != Backend.CLOSED:
+            backend.state = Backend.CLOSED
+            print(f" [LLM] Serveur réintégré : {backend.base_url}")
+
+    def _record_failure_locked(self, backend: Backend, error: BaseException):
+        backend.errors += 1
+        backend.consecutive_failures += 1
+        backend.last_error = repr(error)[:200]
+        if backend.state == Backend.HALF_OPEN or (
+            backend.state == Backend.CLOSED
+            and backend.consecutive_failures >= self.settings.breaker_failures
+        ):
+            backend.state = Backend.OPEN
+            backend.opened_at = time.monotonic()
+            print(f" [LLM] Serveur éjecté ({backend.consecutive_failures} échecs) : {backend.base_url}")
+
+    # --- Sondes ---
+
+    def reachable(self, timeout: float = 5.0) -> bool:
+        """
+        Vrai si au moins un serveur répond à la liste des modèles. Sans effet sur les
+        disjoncteurs : une sonde de disponibilité lente n'éjecte pas un serveur, et une
+        liste des modèles servie ne réhabilite pas un serveur dont les complétions échouent.
+        """
+        for backend in self.backends:
+            try:
+                backend.client.with_options(timeout=timeout, max_retries=0).models.list()
+            except Exception:
+                continue
+            return True
+        return False
+
+    def probe(self, timeout: float = 5.0, only_ejected: bool = False) -> bool:
+        """
+        Sonde légère (liste des modèles) des serveurs ; met à jour leur disjoncteur.
+
+        Args:
+            timeout (float): Délai max par serveur
+            only_ejected (bool): Ne sonde que les serveurs éjectés dont le délai est écoulé
+
+        Returns:
+            bool: True si au moins un serveur sondé a répondu
+        """
+        with self._lock:
+            now = time.monotonic()
+            targets = [
+                b for b in self.backends
+                if not only_ejected
+                or (b.state != Backend.CLOSED and self._available_locked(b, now))
+            ]
+
+        reachable = False
+        for backend in targets:
+            try:
+                backend.client.with_options(timeout=timeout, max_retries=0).models.list()
+            except Exception as e:
+                with self._lock:
+                    self._record_failure_locked(backend, e)
+                continue
+            reachable = True
+            with self._lock:
+                self._record_success_locked(backend)
+                self.scheduler.dispatch_locked()
+        return reachable
+
+    def start_health_checks(self):
+        """Sonde périodique des serveurs éjectés (seulement s'il y a de quoi basculer)."""
+        interval = self.settings.health_check_interval_s
+        if len(self.backends) < 2 or interval <= 0 or self._health_thread is not None:
+            return
+
+        def loop():
+            while not self._stop.wait(interval):
+                try:
+                    self.probe(timeout=self.settings.connect_timeout_s, only_ejected=True)
+                except Exception as e:
+                    print(f" [LLM] Erreur de sonde : {e}")
+
+        self._health_thread = threading.Thread(target=loop, name="llm-health", daemon=True)
+        self._health_thread.start()
+
+    def load(self) -> dict:
+        """Charge du pool : requêtes en file, serveurs pouvant recevoir une requête."""
+        with self._lock:
+            now = time.monotonic()
+            available = sum(
+                1 for b in self.backends
+                if self._available_locked(b, now) and self.scheduler.capacity_locked(b) > 0
+            )
+            return {"queued": len(self.scheduler._queue), "available": available}
+
+    def close(self):
+        self._stop.set()
+        self.scheduler.close()
+
+    def stats(self) -> List[dict]:
+        with self._lock:
+            return [
+                {**backend.stats(), **self.scheduler.stats_locked(backend)}
+                for backend in self.backends
+            ]
@@ -0,0 +1,418 @@
+"""
+Réponses map-reduce pour les questions larges ("quels sont tous les droits des agents ?").
+
+Une question large demande bien plus de passages qu'un seul prompt n'en contient :
+le chemin normal garde les meilleurs et abandonne le reste sans le dire. En mode
+map-reduce (sur demande, par requête), un ensemble de candidats plus large est
+découpé en groupes sous un budget de tokens ; chaque groupe reçoit sa réponse
+partielle (étape "map", `fan_out` appels LLM simultanés répartis sur les slots du
+pool, voir scheduler.py), puis un dernier appel court fusionne les réponses
+partielles (étape "reduce", prompts/rag_reduce.j2).
+
+Les documents gardent une numérotation globale : les citations [id] des réponses
+partielles restent valables dans la réponse finale et le bloc "Sources". En
+streaming, chaque réponse partielle est envoyée dès qu'elle est prête.
+"""
+import time
+import asyncio
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import TYPE_CHECKING, AsyncIterator, Awaitable, Callable, Iterator, List, Optional, Tuple
+
+from jinja2 import Template
+
+from .llm import is_error_reply
+from .metrics import stage_timer, MAP_REDUCE_PARTIALS
+from .relevance import NO_ANSWER
+from .degraded import EXTRACTIVE
+from .deadline import DeadlineExceeded
+
+if TYPE_CHECKING:
+    from .rag import Rag
+
+# Mode de la réponse (voir degraded.py pour les autres)
+MAP_REDUCE = "map_reduce"
+
+# Statut d'une réponse partielle
+ANSWERED = "answered"
+ABSTAINED = "abstained"
+FAILED = "error"
+
+_FALLBACK_REDUCE_TEMPLATE = (
+    "{% for partial in partials %}Partie {{ partial.group }} :\n{{ partial.text }}\n\n{% endfor %}"
+    "Fusionne ces réponses partielles en une seule, en conservant les citations.\n\n"
+    "QUESTION :\n{{ query }}"
+)
+
+
+def _load_reduce_template() -> Template:
+    candidates = [
+        Path(__file__).resolve().parent.parent.parent / "prompts" / "rag_reduce.j2",
+        Path("/app/prompts/rag_reduce.j2"),
+    ]
+    for path in candidates:
+        if path.exists():
+            return Template(path.read_text(encoding="utf-8"))
+    print(" [MapReduce] prompts/rag_reduce.j2 introuvable, template de secours")
+    return Template(_FALLBACK_REDUCE_TEMPLATE)
+
+
+class MapReduce:
+    """Réponse en deux temps (map en parallèle, puis reduce) pour un Rag donné."""
+
+    def __init__(
+        self,
+        rag: "Rag",
+        candidates: int = 24,
+        fan_out: int = 4,
+        group_tokens: int = 2048,
+        max_groups: int = 6,
+    ):
+        """
+        Args:
+            rag (Rag): Pipeline dont on réutilise retrieval, sélection, template et LLM
+            candidates (int): Chunks candidats récupérés (au lieu de top_k)
+            fan_out (int): Appels "map" simultanés au plus
+            group_tokens (int): Budget de tokens des documents d'un groupe (borné par la
+                fenêtre du modèle, voir Rag.context_budget)
+            max_groups (int): Groupes au plus (donc appels "map" par question)
+        """
+        self.rag = rag
+        self.candidates = candidates
+        self.fan_out = fan_out
+        self.group_tokens = group_tokens
+        self.max_groups = max_groups
+        self.reduce_template = _load_reduce_template()
+
+    @classmethod
+    def from_settings(cls, settings, rag: "Rag") -> "MapReduce":
+        """Construit le mode map-reduce depuis une MapReduceSettings."""
+        return cls(
+            rag,
+            candidates=settings.candidates,
+            fan_out=settings.fan_out,
+            group_tokens=settings.group_tokens,
+            max_groups=settings.max_groups,
+        )
+
+    # --- Préparation ---
+
+    def _group_budget(self, query: str) -> int:
+        return max(1, min(self.group_tokens, self.rag.context_budget(query)))
+
+    def _prepare(self, query: str) -> dict:
+        """Retrieval élargi puis découpage des documents en groupes ("groups")."""
+        group_budget = self._group_budget(query)
+        prepared = self.rag.prepare(
+            query,
+            top_k=self.candidates,
+            budget=group_budget * self.max_groups,
+            # Le budget de la compression vaut pour un prompt, pas pour l'ensemble
+            compress=False,
+            # Tous les candidats assez pertinents : les groupes se partagent le budget
+            select=False,
+        )
+        if prepared["answer"] is None:
+            with stage_timer("group") as span:
+                prepared["groups"] = self._groups(prepared["documents"], group_budget)
+                span.set(
+                    documents=len(prepared["documents"]),
+                    groups=len(prepared["groups"]),
+                    group_budget=group_budget,
+                )
+        return prepared
+
+    def _groups(self, documents: List[dict], budget: int) -> List[List[dict]]:
+        """Remplit les groupes dans l'ordre de pertinence, sans dépasser `budget` par groupe."""
+        builder = self.rag.context_builder
+        max_chars = int(budget * builder.estimator.chars_per_token)
+        groups: List[List[dict]] = []
+        used = 0
+        for doc in documents:
+            cost = builder.document_cost(doc["content"])
+            if cost > budget:
+                # Passage fusionné plus grand qu'un groupe : tronqué, seul dans son groupe
+                doc = {**doc, "content": doc["content"][:max_chars]}
+                cost = budget
+            if not groups or used + cost > budget:
+                groups.append([])
+                used = 0
+            groups[-1].append(doc)
+            used += cost
+        return groups[: self.max_groups]
+
+    def _map_prompt(self, query: str, group: List[dict]) -> str:
+        return self.rag.template.render(documents=group, query=query)
+
+    def _reduce_prompt(self, query: str, partials: List[dict]) -> str:
+        return self.reduce_template.render(partials=partials, query=query)
+
+    # --- Réponses partielles ---
+
+    def _partial(self, index: int, group: List[dict], text: Optional[str], started: float) -> dict:
+        if text is None or is_error_reply(text):
+            status = FAILED
+        elif self.rag.cascade.is_abstention(text):
+            status = ABSTAINED
+        else:
+            status = ANSWERED
+        self.rag.degraded.record(status != FAILED)
+        MAP_REDUCE_PARTIALS.inc(status=status)
+        return {
+            "group": index + 1,
+            "status": status,
+            "text": text or "",
+            "documents": [doc["id"] for doc in group],
+            "duration_s": round(time.perf_counter() - started, 3),
+        }
+
+    def _map_one(self, query: str, index: int, group: List[dict]) -> dict:
+        started = time.perf_counter()
+        try:
+            text = self.rag.llm.infere(self._map_prompt(query, group), **self.rag.llm_kwargs())
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            # File LLM pleine, serveur injoignable : le groupe est perdu, pas la réponse
+            print(f" [MapReduce] Groupe {index + 1} en échec : {e}")
+            text = None
+        return self._partial(index, group, text, started)
+
+    async def _amap_one(self, query: str, index: int, group: List[dict], semaphore: asyncio.Semaphore) -> dict:
+        async with semaphore:
+            started = time.perf_counter()
+            try:
+                text = await self.rag.llm.ainfere(self._map_prompt(query, group), **self.rag.llm_kwargs())
+            except DeadlineExceeded:
+                raise
+            except Exception as e:
+                print(f" [MapReduce] Groupe {index + 1} en échec : {e}")
+                text = None
+            return self._partial(index, group, text, started)
+
+    def _map(self, query: str, groups: List[List[dict]]) -> Iterator[dict]:
+        """Réponses partielles dans l'ordre où elles se terminent (threads)."""
+        with ThreadPoolExecutor(max_workers=max(1, min(self.fan_out, len(groups)))) as pool:
+            # Chaque thread hérite de l'échéance et de la priorité de la requête
+            futures = [
+                pool.submit(contextvars.copy_context().run, self._map_one, query, i, group)
+                for i, group in enumerate(groups)
+            ]
+            try:
+                for future in as_completed(futures):
+                    yield future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+
+    async def _amap(self, query: str, groups: List[List[dict]]) -> AsyncIterator[dict]:
+        """Réponses partielles dans l'ordre où elles se terminent (asyncio)."""
+        semaphore = asyncio.Semaphore(max(1, self.fan_out))
+        tasks = [
+            asyncio.ensure_future(self._amap_one(query, i, group, semaphore))
+            for i, group in enumerate(groups)
+        ]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            # Client parti ou échéance : les générations encore en cours sont annulées
+            for task in tasks:
+                task.cancel()
+
+    @staticmethod
+    def _useful(partials: List[dict]) -> List[dict]:
+        return sorted((p for p in partials if p["status"] == ANSWERED), key=lambda p: p["group"])
+
+    def _conclusion(self, query: str, prepared: dict, partials: Optional[List[dict]]) -> Optional[Tuple[str, str]]:
+        """
+        (texte, mode) quand l'étape reduce est inutile : mode dégradé (`partials` None),
+        aucune réponse partielle exploitable (extractif si les appels ont échoué) ou une
+        seule. None : il faut fusionner.
+        """
+        if partials is None:
+            return self.rag.extractive_text(query, prepared), EXTRACTIVE
+        useful = self._useful(partials)
+        if len(useful) == 1:
+            return useful[0]["text"], MAP_REDUCE
+        if useful:
+            return None
+        if any(p["status"] == FAILED for p in partials):
+            return self.rag.extractive_text(query, prepared), EXTRACTIVE
+        return NO_ANSWER, MAP_REDUCE
+
+    def _merged(self, partials: List[dict], reponse: str) -> str:
+        """Réponse du reduce, ou les réponses partielles bout à bout s'il a échoué."""
+        if not is_error_reply(reponse):
+            return reponse
+        return "\n\n".join(p["text"] for p in self._useful(partials))
+
+    def _final(self, prepared: dict, text: str, mode: str) -> dict:
+        return self.rag.build_result(prepared, text + self.rag.format_sources(prepared["documents"]), mode)
+
+    # --- Réponses complètes ---
+
+    def answer(self, query: str) -> dict:
+        """Comme Rag.answer(), en map-reduce (mode "map_reduce")."""
+        with stage_timer("total") as span:
+            result = self._answer(query)
+            span.set(mode=result["mode"])
+        self.rag.count_mode(result["mode"])
+        return result
+
+    def _answer(self, query: str) -> dict:
+        prepared = self._prepare(query)
+        if prepared["answer"] is not None:
+            return self.rag.build_result(prepared, prepared["answer"], prepared["mode"])
+
+        partials = None
+        if not self.rag.degraded.active():
+            t0 = time.perf_counter()
+            partials = list(self._map(query, prepared["groups"]))
+            prepared["timings"]["map_s"] = time.perf_counter() - t0
+        conclusion = self._conclusion(query, prepared, partials)
+        if conclusion is not None:
+            return self._final(prepared, *conclusion)
+
+        t0 = time.perf_counter()
+        reponse = self.rag.llm.infere(self._reduce_prompt(query, self._useful(partials)), **self.rag.llm_kwargs())
+        prepared["timings"]["reduce_s"] = time.perf_counter() - t0
+        return self._final(prepared, self._merged(partials, reponse), MAP_REDUCE)
+
+    async def aanswer(
+        self,
+        query: str,
+        run_blocking: Optional[Callable[..., Awaitable]] = None,
+    ) -> dict:
+        """Version asynchrone de answer()."""
+        run_blocking = run_blocking or asyncio.to_thread
+        with stage_timer("total") as span:
+            result = await self._aanswer(query, run_blocking)
+            span.set(mode=result["mode"])
+        self.rag.count_mode(result["mode"])
+        return result
+
+    async def _aanswer(self, query: str, run_blocking: Callable[..., Awaitable]) -> dict:
+        prepared = await run_blocking(self._prepare, query)
+        if prepared["answer"] is not None:
+            return self.rag.build_result(prepared, prepared["answer"], prepared["mode"])
+
+        partials = None
+        if not self.rag.degraded.active():
+            t0 = time.perf_counter()
+            partials = [partial async for partial in self._amap(query, prepared["groups"])]
+            prepared["timings"]["map_s"] = time.perf_counter() - t0
+        conclusion = self._conclusion(query, prepared, partials)
+        if conclusion is not None:
+            return self._final(prepared, *conclusion)
+
+        t0 = time.perf_counter()
+        reponse = await self.rag.llm.ainfere(self._reduce_prompt(query, self._useful(partials)), **self.rag.llm_kwargs())
+        prepared["timings"]["reduce_s"] = time.perf_counter() - t0
+        return self._final(prepared, self._merged(partials, reponse), MAP_REDUCE)
+
+    # --- Streaming ---
+
+    def _sources_event(self, prepared: dict) -> dict:
+        return {
+            "event": "sources",
+            "data": [
+                {"id": d["id"], "source_name": d["source_name"], "score": d["score"]}
+                for d in prepared["documents"]
+            ],
+        }
+
+    def stream(self, query: str) -> Iterator[dict]:
+        """
+        Version streaming de answer().
+
+        Yields:
+            dict: Événements de Rag.respond_stream(), plus un "partial" par groupe
+                ({"group", "status", "text", "documents", "duration_s"}) dès qu'il se
+                termine, avant les "token" de la réponse fusionnée.
+        """
+        t_start = time.perf_counter()
+        prepared = self._prepare(query)
+        if prepared["answer"] is not None:
+            self.rag.count_mode(prepared["mode"])
+            yield {"event": "answer", "data": prepared["answer"]}
+            return
+        yield self._sources_event(prepared)
+        timings = prepared["timings"]
+
+        partials = None
+        if not self.rag.degraded.active():
+            t0 = time.perf_counter()
+            partials = []
+            for partial in self._map(query, prepared["groups"]):
+                partials.append(partial)
+                yield {"event": "partial", "data": partial}
+            timings["map_s"] = time.perf_counter() - t0
+
+        conclusion = self._conclusion(query, prepared, partials)
+        if conclusion is not None:
+            text, mode = conclusion
+            yield {"event": "token", "data": text}
+            timings["total_s"] = time.perf_counter() - t_start
+            yield self.rag.done_event(prepared, mode)
+            return
+
+        t0 = time.perf_counter()
+        for token in self.rag.llm.infere_stream(self._reduce_prompt(query, self._useful(partials)), **self.rag.llm_kwargs()):
+            if "ttft_s" not in timings:
+                timings["ttft_s"] = time.perf_counter() - t_start
+            yield {"event": "token", "data": token}
+        timings["reduce_s"] = time.perf_counter() - t0
+        timings["total_s"] = time.perf_counter() - t_start
+        yield self.rag.done_event(prepared, MAP_REDUCE)
+
+    async def astream(
+        self,
+        query: str,
+        run_blocking: Optional[Callable[..., Awaitable]] = None,
+    ) -> AsyncIterator[dict]:
+        """Version asynchrone de stream() (mêmes événements)."""
+        run_blocking = run_blocking or asyncio.to_thread
+        t_start = time.perf_counter()
+        prepared = await run_blocking(self._prepare, query)
+        if prepared["answer"] is not None:
+            self.rag.count_mode(prepared["mode"])
+            yield {"event": "answer", "data": prepared["answer"]}
+            return
+        yield self._sources_event(prepared)
+        timings = prepared["timings"]
+
+        partials = None
+        if not self.rag.degraded.active():
+            t0 = time.perf_counter()
+            partials = []
+            partial_stream = self._amap(query, prepared["groups"])
+            try:
+                async for partial in partial_stream:
+                    partials.append(partial)
+                    yield {"event": "partial", "data": partial}
+            finally:
+                await partial_stream.aclose()
+            timings["map_s"] = time.perf_counter() - t0
+
+        conclusion = self._conclusion(query, prepared, partials)
+        if conclusion is not None:
+            text, mode = conclusion
+            yield {"event": "token", "data": text}
+            timings["total_s"] = time.perf_counter() - t_start
+            yield self.rag.done_event(prepared, mode)
+            return
+
+        t0 = time.perf_counter()
+        tokens = self.rag.llm.ainfere_stream(self._reduce_prompt(query, self._useful(partials)), **self.rag.llm_kwargs())
+        try:
+            async for token in tokens:
+                if "ttft_s" not in timings:
+                    timings["ttft_s"] = time.perf_counter() - t_start
+                yield {"event": "token", "data": token}
+        finally:
+            await tokens.aclose()
+        timings["reduce_s"] = time.perf_counter() - t0
+        timings["total_s"] = time.perf_counter() - t_start
+        yield self.rag.done_event(prepared, MAP_REDUCE)
@@ -0,0 +1,535 @@
+"""
+Métriques au format d'exposition texte Prometheus, sans dépendance externe.
+
+Les métriques sont déclarées une fois (au niveau module) et enregistrées dans REGISTRY ;
+l'API les sert telles quelles sur /metrics.
+"""
+import bisect
+import time
+import threading
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from . import tracing
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    inner = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+    return "{" + inner + "}"
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} attend les labels {self.labelnames}, reçu {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels_dict(self, key: Tuple[str, ...]) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def samples(self) -> List[Tuple[str, Dict[str, str], float]]:
+        """Échantillons (suffixe, labels, valeur) à exposer."""
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labels, value in self.samples():
+            lines.append(
+                f"{self.name}{suffix}{_format_labels(labels)} {_format_value(value)}"
+            )
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    """Compteur monotone."""
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def samples(self):
+        with self._lock:
+            items = list(self._values.items())
+        return [("", self._labels_dict(key), value) for key, value in items]
+
+
+class Gauge(_Metric):
+    """
+    Jauge : valeur positionnée avec set(), ou calculée à chaque lecture par un callback
+    renvoyant une liste de (labels, valeur).
+    """
+
+    type = "gauge"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        labelnames: Sequence[str] = (),
+        callback: Optional[Callable[[], Iterable[Tuple[Dict[str, str], float]]]] = None,
+    ):
+        super().__init__(name, help, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self.callback = callback
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = float(value)
+
+    def set_callback(self, callback):
+        self.callback = callback
+
+    def samples(self):
+        if self.callback is not None:
+            try:
+                return [("", dict(labels), float(value)) for labels, value in self.callback()]
+            except Exception as e:
+                print(f" [Metrics] Erreur de collecte pour {self.name} : {e}")
+                return []
+        with self._lock:
+            items = list(self._values.items())
+        return [("", self._labels_dict(key), value) for key, value in items]
+
+
+class Histogram(_Metric):
+    """
+    Histogramme cumulatif (même sémantique que Prometheus : bornes "le",
+    somme et nombre d'observations). Thread-safe.
+    """
+
+    type = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        help: str,
+        buckets: Sequence[float],
+        labelnames: Sequence[str] = (),
+    ):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # Par jeu de labels : [compte par case (dernière = +Inf), somme, total]
+        self._series: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def snapshot(self, **labels) -> dict:
+        """
+        Returns:
+            dict: {"count", "sum", "buckets": {borne: nombre cumulé d'observations <= borne}}
+        """
+        with self._lock:
+            series = self._series.get(self._key(labels))
+            if series is None:
+                counts, total, count = [0] * (len(self.buckets) + 1), 0.0, 0
+            else:
+                counts, total, count = list(series[0]), series[1], series[2]
+
+        cumulative, running = {}, 0
+        for bound, n in zip(list(self.buckets) + ["+Inf"], counts):
+            running += n
+            cumulative[str(bound)] = running
+        return {"count": count, "sum": total, "buckets": cumulative}
+
+    def samples(self):
+        with self._lock:
+            items = [(key, list(s[0]), s[1], s[2]) for key, s in self._series.items()]
+
+        out = []
+        for key, counts, total, count in items:
+            labels = self._labels_dict(key)
+            running = 0
+            for bound, n in zip(list(self.buckets) + [float("inf")], counts):
+                running += n
+                out.append(("_bucket", {**labels, "le": _format_value(bound)}, running))
+            out.append(("_sum", labels, total))
+            out.append(("_count", labels, count))
+        return out
+
+
+class Registry:
+    """Ensemble des métriques exposées par /metrics."""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric: _Metric) -> _Metric:
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Métrique déjà enregistrée : {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# --- Pipeline de requête ---
+
+STAGE_DURATION = REGISTRY.register(
+    Histogram(
+        "rag_stage_duration_seconds",
+        "Durée de chaque étape du pipeline RAG",
+        buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300),
+        labelnames=("stage",),
+    )
+)
+STAGE_ERRORS = REGISTRY.register(
+    Counter(
+        "rag_stage_errors_total",
+        "Erreurs levées par étape du pipeline RAG",
+        labelnames=("stage",),
+    )
+)
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """
+    Mesure la durée d'une étape (embed, search, rerank, render, llm...) et compte
+    ses erreurs. Les exceptions sont comptées puis propagées telles quelles.
+    L'étape est aussi un span de la trace courante (voir tracing.py), renvoyé par le bloc.
+    """
+    start = time.perf_counter()
+    try:
+        with tracing.span(stage) as current_span:
+            yield current_span
+    except Exception:
+        # GeneratorExit / CancelledError (client parti) ne sont pas des erreurs d'étape
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        STAGE_DURATION.observe(time.perf_counter() - start, stage=stage)
+
+
+LLM_PROMPT_TOKENS = REGISTRY.register(
+    Counter(
+        "rag_llm_prompt_tokens_total",
+        "Tokens de prompt selon llama.cpp : évalués (prefill) ou repris du cache KV",
+        labelnames=("kind",),
+    )
+)
+
+LLM_BACKEND_REQUESTS = REGISTRY.register(
+    Counter(
+        "rag_llm_backend_requests_total",
+        "Requêtes par serveur LLM du pool (ok, error : échec du serveur, aborted : requête abandonnée)",
+        labelnames=("backend", "result"),
+    )
+)
+LLM_BACKEND_LATENCY = REGISTRY.register(
+    Histogram(
+        "rag_llm_backend_latency_seconds",
+        "Durée des requêtes réussies par serveur LLM du pool",
+        buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600),
+        labelnames=("backend",),
+    )
+)
+LLM_BACKENDS = REGISTRY.register(
+    Gauge(
+        "rag_llm_backend",
+        "État des serveurs LLM du pool (healthy : 1 si le disjoncteur est fermé, outstanding, capacity : places autorisées, slots_busy)",
+        labelnames=("backend", "field"),
+    )
+)
+
+LLM_SCHEDULER = REGISTRY.register(
+    Counter(
+        "rag_llm_scheduler_total",
+        "Réservations de slot LLM (immediate, queued : mise en file, shed : rejetée, timeout)",
+        labelnames=("priority", "result"),
+    )
+)
+LLM_QUEUE_WAIT = REGISTRY.register(
+    Histogram(
+        "rag_llm_queue_wait_seconds",
+        "Attente d'un slot LLM libre dans la file du client",
+        labelnames=("priority",),
+        buckets=(0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60),
+    )
+)
+LLM_QUEUE_DEPTH = REGISTRY.register(
+    Gauge(
+        "rag_llm_queue_depth",
+        "Requêtes LLM en attente d'un slot, par priorité",
+        labelnames=("priority",),
+    )
+)
+
+LLM_SINGLE_FLIGHT = REGISTRY.register(
+    Counter(
+        "rag_llm_single_flight_total",
+        "Appels LLM regroupés (leader : appel envoyé au serveur, follower : appel économisé, alone : leader plus pressé, appel séparé)",
+        labelnames=("mode", "role"),
+    )
+)
+
+DEADLINE_EXCEEDED = REGISTRY.register(
+    Counter(
+        "rag_deadline_exceeded_total",
+        "Requêtes abandonnées à l'échéance fixée par l'appelant, par étape",
+        labelnames=("stage",),
+    )
+)
+DEADLINE_ADJUSTMENTS = REGISTRY.register(
+    Counter(
+        "rag_deadline_adjustments_total",
+        "Travail réduit pour tenir l'échéance (top_k : moins de candidats, max_tokens : réponse plus courte)",
+        labelnames=("kind",),
+    )
+)
+
+CLIENT_DISCONNECTS = REGISTRY.register(
+    Counter(
+        "rag_client_disconnects_total",
+        "Clients partis avant la fin de leur requête (travail restant annulé)",
+        labelnames=("endpoint",),
+    )
+)
+LLM_CANCELLED = REGISTRY.register(
+    Counter(
+        "rag_llm_cancelled_total",
+        "Générations LLM interrompues parce que plus personne n'attendait la réponse",
+        labelnames=("mode",),
+    )
+)
+LLM_RECLAIMED_SECONDS = REGISTRY.register(
+    Counter(
+        "rag_llm_reclaimed_seconds_total",
+        "Temps de génération estimé rendu au serveur LLM par ces interruptions",
+        labelnames=("mode",),
+    )
+)
+
+LLM_TIER_REQUESTS = REGISTRY.register(
+    Counter(
+        "rag_llm_tier_requests_total",
+        "Générations par palier de la cascade (answered, abstained, error, escalated : remontée au modèle principal)",
+        labelnames=("tier", "outcome"),
+    )
+)
+LLM_TIER_LATENCY = REGISTRY.register(
+    Histogram(
+        "rag_llm_tier_duration_seconds",
+        "Durée d'une génération par palier de la cascade",
+        labelnames=("tier",),
+        buckets=(0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 80, 160),
+    )
+)
+
+DEGRADED_ACTIVE = REGISTRY.register(
+    Gauge(
+        "rag_degraded_mode",
+        "1 si les réponses sont extractives (LLM saturé ou en panne), 0 sinon",
+    )
+)
+DEGRADED_TRANSITIONS = REGISTRY.register(
+    Counter(
+        "rag_degraded_transitions_total",
+        "Entrées et sorties du mode dégradé, par cause (queue, no_backend, errors)",
+        labelnames=("direction", "reason"),
+    )
+)
+RELEVANCE_DECISIONS = REGISTRY.register(
+    Counter(
+        "rag_relevance_decisions_total",
+        "Sélection des chunks avant le LLM (full : tous gardés, trimmed : coupés, gated : réponse sans LLM)",
+        labelnames=("decision",),
+    )
+)
+CONTEXT_CHUNKS = REGISTRY.register(
+    Histogram(
+        "rag_context_chunks",
+        "Chunks gardés par question après la sélection adaptative",
+        buckets=(0, 1, 2, 3, 4, 5, 8, 13, 20),
+    )
+)
+COMPRESSION_RATIO = REGISTRY.register(
+    Histogram(
+        "rag_context_compression_ratio",
+        "Tokens du contexte après / avant la compression extractive",
+        buckets=(0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0),
+    )
+)
+MAP_REDUCE_PARTIALS = REGISTRY.register(
+    Counter(
+        "rag_map_reduce_partials_total",
+        "Réponses partielles du mode map-reduce (answered, abstained, error)",
+        labelnames=("status",),
+    )
+)
+
+RESPONSE_MODE = REGISTRY.register(
+    Counter(
+        "rag_responses_total",
+        "Réponses par mode (generative, cached, extractive, gated, map_reduce)",
+        labelnames=("mode",),
+    )
+)
+
+QUERY_BATCH_SIZE = REGISTRY.register(
+    Histogram(
+        "rag_query_batch_size",
+        "Nombre de requêtes encodées par appel au modèle d'embedding",
+        buckets=(1, 2, 4, 8, 16, 32, 64),
+    )
+)
+QUERY_BATCH_WAIT = REGISTRY.register(
+    Histogram(
+        "rag_query_batch_wait_seconds",
+        "Attente d'une requête avant l'encodage de son lot",
+        buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1),
+    )
+)
+
+# --- Caches ---
+
+CACHE_REQUESTS = REGISTRY.register(
+    Counter(
+        "rag_cache_requests_total",
+        "Consultations de cache par résultat (hit/miss)",
+        labelnames=("cache", "result"),
+    )
+)
+
+
+def _cache_hit_ratios():
+    caches = {labels["cache"] for _, labels, _ in CACHE_REQUESTS.samples()}
+    for cache in sorted(caches):
+        hits = CACHE_REQUESTS.value(cache=cache, result="hit")
+        misses = CACHE_REQUESTS.value(cache=cache, result="miss")
+        if hits + misses:
+            yield {"cache": cache}, hits / (hits + misses)
+
+
+CACHE_HIT_RATIO = REGISTRY.register(
+    Gauge(
+        "rag_cache_hit_ratio",
+        "Taux de hit de chaque cache depuis le démarrage",
+        labelnames=("cache",),
+        callback=_cache_hit_ratios,
+    )
+)
+
+# --- Modèles et collections (callbacks branchés par l'API) ---
+
+EMBEDDING_MODELS_LOADED = REGISTRY.register(
+    Gauge(
+        "rag_embedding_models_loaded",
+        "Modèles d'embedding chargés en mémoire",
+        labelnames=("model",),
+    )
+)
+COLLECTION_DOCUMENTS = REGISTRY.register(
+    Gauge(
+        "rag_collection_documents",
+        "Nombre de chunks par collection ChromaDB",
+        labelnames=("collection",),
+    )
+)
+
+COLLECTION_ENGINE_MEMORY = REGISTRY.register(
+    Gauge(
+        "rag_collection_engine_memory_bytes",
+        "Mémoire estimée de l'index de chaque collection chaude (chunks x dimension x 4 octets)",
+        labelnames=("collection",),
+    )
+)
+COLLECTION_ENGINE_EVICTIONS = REGISTRY.register(
+    Counter(
+        "rag_collection_engine_evictions_total",
+        "Moteurs de collection libérés (idle : inutilisé trop longtemps, budget : mémoire)",
+        labelnames=("reason",),
+    )
+)
+
+# --- Ingestion ---
+
+INGEST_FILES = REGISTRY.register(
+    Counter("rag_ingest_files_total", "Fichiers extraits pendant les ingestions")
+)
+INGEST_CHUNKS = REGISTRY.register(
+    Counter(
+        "rag_ingest_chunks_total",
+        "Chunks traités pendant les ingestions",
+        labelnames=("step",),
+    )
+)
+INGEST_OCR_PAGES = REGISTRY.register(
+    Counter("rag_ingest_ocr_pages_total", "Pages passées à l'OCR Tesseract")
+)
+INGEST_SECONDS = REGISTRY.register(
+    Counter(
+        "rag_ingest_seconds_total",
+        "Temps passé par étape d'ingestion (rapporter aux compteurs pour un débit)",
+        labelnames=("stage",),
+    )
+)
+INGEST_THROUGHPUT = REGISTRY.register(
+    Gauge(
+        "rag_ingest_throughput",
+        "Débit du job d'ingestion en cours ou du dernier (par seconde)",
+        labelnames=("unit",),
+    )
+)
+
+# --- Pool de requêtes de l'API (callback branché par l'API) ---
+
+QUERY_POOL = REGISTRY.register(
+    Gauge(
+        "rag_query_pool",
+        "État du pool de requêtes (in_flight, queue_depth, rejets cumulés...)",
+        labelnames=("field",),
+    )
+)
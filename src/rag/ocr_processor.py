@@ -9,6 +9,8 @@ import re
 from typing import List, Optional
 from pathlib import Path
 
+from .metrics import INGEST_OCR_PAGES
+
 
 class PDFOCRProcessor:
     """Processeur OCR optimisé pour les PDFs scannés avec post-traitement ultra-agressif"""
@@ -340,6 +342,7 @@ class PDFOCRProcessor:
         for i, image in enumerate(images, 1):
             print(f"Traitement de la page {i}/{total_pages}...")
             page_text = self.ocr_image(image, preprocess=preprocess)
+            INGEST_OCR_PAGES.inc()
             if post_process:
                 # Note: La méthode post_process_text est maintenant appelée ici
                 page_text = self.post_process_text(page_text)
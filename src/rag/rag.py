@@ -1,6 +1,23 @@
+import math
+import time
+import asyncio
+import hashlib
 import numpy as np
-from .llm import LLM
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Iterator, List, Optional
+from .llm import LLM, is_error_reply
 from .retrieval import Retrieval
+from .answer_cache import AnswerCache
+from .context_builder import ContextBuilder
+from .metrics import stage_timer, DEADLINE_ADJUSTMENTS, RESPONSE_MODE
+from . import deadline
+from .deadline import DeadlineExceeded
+from .scheduler import LLMQueueFullError
+from .degraded import DegradedMode, GENERATIVE, EXTRACTIVE, CACHED
+from .cascade import Cascade
+from .relevance import RelevanceGate, NO_ANSWER, GATED
+from .compression import ContextCompressor
+from .map_reduce import MapReduce
 from pathlib import Path
 from jinja2 import Template
 
@@ -12,15 +29,30 @@ class Rag:
         model="Meta-Llama-3.1-8B-Instruct-Q4_K_M.gguf", 
         base_url="http://127.0.0.1:8080/v1", 
         api_key="pas_de_clef",
+        base_urls=None,
         # Valeurs par défaut locales
         path_doc="data/raw",
         chroma_persist_dir="./chroma_db_local",
-        processed_texts_dir="data/processed_texts"
+        processed_texts_dir="data/processed_texts",
+        # Composants partagés entre plusieurs Rag (un par collection, voir engine.py)
+        llm: Optional[LLM] = None,
+        model_cache: Optional[dict] = None,
+        llm_settings=None,
+        answer_cache: Optional[AnswerCache] = None,
+        context_settings=None,
+        relevance_settings=None,
+        compression_settings=None,
+        map_reduce_settings=None,
+        degraded: Optional[DegradedMode] = None,
+        degraded_settings=None,
+        cascade: Optional[Cascade] = None,
+        cascade_settings=None,
     ):
         # Initialisation des composants LLM et Retrieval avec paramètres personnalisés
         self.model = model
         self.base_url = base_url
         self.api_key = api_key
+        self.base_urls = base_urls
 
         self.path_doc = Path(path_doc)
         self.chroma_persist_dir = Path(chroma_persist_dir)
@@ -40,74 +72,735 @@ class Rag:
                  raise FileNotFoundError(f"Template introuvable à : {project_root / 'prompts'}")
 
             with open(prompt_path, "r", encoding="utf-8") as f:
-                self.template = Template(f.read())
+                template_source = f.read()
             print(f"✓ Template Jinja2 chargé depuis : {prompt_path}")
             
         except Exception as e:
             print(f" ERREUR CRITIQUE : Impossible de charger le template Jinja2 ({e})")
             # Fallback de secours (très basique) pour éviter le crash
-            self.template = Template("CONTEXTE:\n{% for d in documents %}{{ d.content }}\n{% endfor %}\nQUESTION:\n{{ query }}")
+            template_source = "CONTEXTE:\n{% for d in documents %}{{ d.content }}\n{% endfor %}\nQUESTION:\n{{ query }}"
+            prompt_path = None
 
-        self.llm = LLM(model=self.model, base_url=self.base_url, api_key=self.api_key)
+        # Consignes fixes (texte brut, sans variable), placées dans le message système
+        instructions = ""
+        if prompt_path is not None:
+            instructions_path = prompt_path.with_name("rag_instructions.txt")
+            if instructions_path.exists():
+                with open(instructions_path, "r", encoding="utf-8") as f:
+                    instructions = f.read().strip()
+
+        self.template = Template(template_source)
+        self.instructions = instructions
+        # Empreinte template + consignes : fait partie de la clé du cache de réponses
+        self.template_hash = hashlib.sha256(
+            (instructions + "\x1f" + template_source).encode("utf-8")
+        ).hexdigest()[:16]
+
+        # Cache de réponses (optionnel, voir answer_cache.py)
+        self.answer_cache = answer_cache
+
+        if llm is not None:
+            self.llm = llm
+        else:
+            self.llm = LLM(
+                model=self.model,
+                base_url=self.base_url,
+                api_key=self.api_key,
+                settings=llm_settings,
+                base_urls=self.base_urls,
+            )
+
+        # Mode dégradé (voir degraded.py) : partagé entre collections s'il est fourni
+        if degraded is not None:
+            self.degraded = degraded
+        elif degraded_settings is not None:
+            self.degraded = DegradedMode.from_settings(degraded_settings, self.llm.pool)
+        else:
+            self.degraded = DegradedMode(self.llm.pool)
+
+        # Cascade de modèles (voir cascade.py) : sans palier, tout va à self.llm
+        if cascade is not None:
+            self.cascade = cascade
+        elif cascade_settings is not None:
+            self.cascade = Cascade.from_settings(cascade_settings, self.llm, self.api_key, llm_settings)
+        else:
+            self.cascade = Cascade(self.llm)
+
+        # Contexte sous budget de tokens (voir context_builder.py)
+        if context_settings is not None:
+            self.top_k = context_settings.top_k
+            self.context_builder = ContextBuilder(
+                max_context_tokens=context_settings.max_context_tokens,
+                estimator=self.llm.token_estimator,
+                merge_adjacent=context_settings.merge_adjacent,
+            )
+        else:
+            self.top_k = 5
+            self.context_builder = ContextBuilder(estimator=self.llm.token_estimator)
+
+        # Sélection adaptative des chunks et réponse sans LLM (voir relevance.py)
+        if relevance_settings is not None:
+            self.relevance = RelevanceGate.from_settings(relevance_settings)
+        else:
+            self.relevance = RelevanceGate()
+
+        # Préfixe statique (message système + consignes) : construit une fois, identique
+        # octet pour octet d'une requête à l'autre et placé avant le contexte variable,
+        # pour que le serveur llama.cpp réutilise son cache KV au lieu de le recalculer
+        self.static_prefix = self.llm.build_system_prompt(self.instructions)
 
         self.retrieval = Retrieval(
             path_doc=self.path_doc,
             chroma_persist_dir=self.chroma_persist_dir,
             processed_texts_dir=self.processed_texts_dir,
+            model_cache=model_cache,
         )
 
+        # Compression extractive du contexte (optionnelle, voir compression.py)
+        self.compressor: Optional[ContextCompressor] = None
+        if compression_settings is not None and compression_settings.enabled:
+            self.compressor = ContextCompressor.from_settings(
+                compression_settings,
+                # Modèle de la collection active (il change avec switch_to_model_for_collection)
+                encode=lambda passages: self.retrieval.vectorizor.encode_passages(passages),
+                estimator=self.llm.token_estimator,
+            )
+
+        # Mode map-reduce, sur demande (voir map_reduce.py)
+        if map_reduce_settings is not None:
+            self.map_reduce = MapReduce.from_settings(map_reduce_settings, self)
+        else:
+            self.map_reduce = MapReduce(self)
+
         return
 
-    def respond(self, query: str) -> str:
-        top_k = 5 
+    @classmethod
+    def from_config(
+        cls,
+        config,
+        collection_name: Optional[str] = None,
+        llm: Optional[LLM] = None,
+        model_cache: Optional[dict] = None,
+        answer_cache: Optional[AnswerCache] = None,
+        degraded: Optional[DegradedMode] = None,
+        cascade: Optional[Cascade] = None,
+    ) -> "Rag":
+        """
+        Construit un Rag à partir d'une GlobalConfig et active une collection.
+
+        Args:
+            config (GlobalConfig): Configuration validée (voir settings.py)
+            collection_name (str, optional): Collection à servir (défaut : celle de la config)
+            llm (LLM, optional): Client LLM partagé (sinon un nouveau client est créé)
+            model_cache (dict, optional): Cache de modèles d'embedding partagé
+            answer_cache (AnswerCache, optional): Cache de réponses partagé
+            degraded (DegradedMode, optional): Mode dégradé partagé
+            cascade (Cascade, optional): Cascade de modèles partagée
+
+        Returns:
+            Rag: Instance prête à répondre, modèle de la collection déjà chargé
+        """
+        rag = cls(
+            model=config.rag.model,
+            base_url=config.rag.base_url,
+            api_key=config.rag.api_key,
+            base_urls=config.rag.base_urls,
+            path_doc=config.rag.paths.docs,
+            chroma_persist_dir=config.rag.paths.chroma_dir,
+            processed_texts_dir=config.rag.paths.cache,
+            llm=llm,
+            model_cache=model_cache,
+            llm_settings=config.rag.llm,
+            answer_cache=answer_cache,
+            context_settings=config.rag.context,
+            relevance_settings=config.rag.relevance,
+            compression_settings=config.rag.compression,
+            map_reduce_settings=config.rag.map_reduce,
+            degraded=degraded,
+            degraded_settings=config.rag.degraded,
+            cascade=cascade,
+            cascade_settings=config.rag.cascade,
+        )
+        storage = rag.retrieval.chroma_storage
+        storage.switch_collection(
+            collection_name or config.rag.retrieval.collection_name
+        )
+        # Chargé ici plutôt qu'à la première requête
+        rag.retrieval.vectorizor.switch_to_model_for_collection(
+            storage.collection.metadata or {}
+        )
+        if config.rag.retrieval.query_batch_max_size > 1:
+            rag.retrieval.enable_query_batching(
+                window_ms=config.rag.retrieval.query_batch_window_ms,
+                max_batch_size=config.rag.retrieval.query_batch_max_size,
+            )
+        return rag
+
+    def close(self):
+        """Libère les threads de fond (appelé quand le moteur est remplacé)."""
+        self.retrieval.disable_query_batching()
+
+    def context_budget(self, query: str, deadline_aware: bool = True) -> int:
+        """
+        Tokens disponibles pour les documents : fenêtre du modèle moins la réponse
+        réservée (max_tokens), le message système, le template et la question,
+        plafonnés par max_context_tokens. Sous échéance, plafonnés aussi par ce que le
+        serveur peut évaluer dans le temps restant (en gardant de quoi répondre).
+        """
+        estimator = self.llm.token_estimator
+        overhead = estimator.count(self.template.render(documents=[], query=query))
+        overhead += estimator.count("x" * self.llm.prompt_overhead_chars(self.static_prefix))
+        settings = self.llm.settings
+        available = settings.context_window_tokens - settings.max_tokens - overhead
+        remaining = deadline.remaining() if deadline_aware else None
+        if remaining is not None:
+            affordable = self.llm.rates.affordable_prompt_tokens(
+                remaining * self.llm.DEADLINE_MARGIN,
+                min(settings.min_answer_tokens, settings.max_tokens),
+            )
+            available = min(available, affordable - overhead)
+        return max(0, min(self.context_builder.max_context_tokens, available))
+
+    def _deadline_top_k(self, query: str, top_k: int) -> int:
+        """
+        Sous échéance, moins de candidats au retrieval : autant que le budget de contexte
+        réduit peut en accueillir.
+
+        Raises:
+            DeadlineExceeded: s'il ne reste pas le temps d'un contexte et d'une réponse.
+        """
+        if deadline.current() is None:
+            return top_k
+        full = self.context_budget(query, deadline_aware=False)
+        budget = self.context_budget(query)
+        if budget >= full:
+            return top_k
+        if budget <= 0:
+            raise deadline.exceeded("retrieval")
+        DEADLINE_ADJUSTMENTS.inc(kind="top_k")
+        return max(1, math.ceil(top_k * budget / max(full, 1)))
+
+    def prepare(
+        self,
+        query: str,
+        top_k: Optional[int] = None,
+        budget: Optional[int] = None,
+        compress: bool = True,
+        select: bool = True,
+    ) -> dict:
+        """
+        Étapes communes à respond() et respond_stream() : garde-fou, retrieval,
+        ViewModel et rendu du prompt.
+
+        Args:
+            query (str): Question
+            top_k (int, optional): Candidats du retrieval (défaut : self.top_k)
+            budget (int, optional): Budget de tokens des documents (défaut : context_budget())
+            compress (bool): Applique la compression du contexte si elle est activée
+            select (bool): Sélection adaptative des chunks pour un seul prompt ; False :
+                seul le score minimal s'applique et top_k n'est pas réduit par
+                l'échéance (l'appelant répartit lui-même les candidats, ex: map-reduce)
+
+        Returns:
+            dict: {
+                "answer": réponse immédiate (erreur / question vide) ou None,
+                "documents": documents passés au template,
+                "prompt": prompt rendu (None si "answer" est renseigné),
+                "timings": durées des étapes en secondes,
+                "chunk_ids": ids des chunks effectivement passés au LLM,
+                "query_embedding": embedding de la question,
+                "context_tokens": tokens estimés des documents du prompt,
+                "compression_ratio": tokens après / avant compression (None sans compression),
+                "retrieval_score": meilleure similarité (score_retrieval) des chunks retenus,
+                "mode": mode d'une réponse immédiate ("gated" : rien d'assez pertinent),
+                "generation": rapport de la génération (voir LLM.infere(), argument report),
+            }
+
+        Raises:
+            DeadlineExceeded: si l'échéance de la requête est atteinte.
+        """
+        top_k = top_k or self.top_k
+        prepared = {
+            "answer": None,
+            "documents": [],
+            "prompt": None,
+            "timings": {},
+            "chunk_ids": [],
+            "query_embedding": None,
+            "context_tokens": 0,
+            "compression_ratio": None,
+            "retrieval_score": 0.0,
+            "mode": None,
+            "generation": {},
+        }
 
         # 1) Garde-fou minimal
         if not query or not isinstance(query, str) or not query.strip():
-            return "Merci de préciser votre question."
+            prepared["answer"] = "Merci de préciser votre question."
+            return prepared
 
-        # 2) Appel au retriever
+        # 2) Appel au retriever (moins de candidats si l'échéance approche)
+        if select:
+            top_k = self._deadline_top_k(query, top_k)
+        t0 = time.perf_counter()
         try:
-            contextes, sources, scores = self.retrieval.query(query, n=top_k)
+            with stage_timer("retrieval") as span:
+                span.set(
+                    collection=self.retrieval.chroma_storage.collection_name,
+                    top_k=top_k,
+                )
+                hits, prepared["query_embedding"] = self.retrieval.query_hits(query, n=top_k)
+                span.set(kept=len(hits))
+        except DeadlineExceeded:
+            raise
         except FileNotFoundError:
-            return "La base documentaire n'est pas prête."
+            prepared["answer"] = "La base documentaire n'est pas prête."
+            return prepared
         except Exception as e:
-            return f"Une erreur est survenue pendant la recherche du contexte : {e}"
-
-        # 3) PRÉPARATION DES DONNÉES (ViewModel pour Jinja2)
-        # C'EST ICI QUE CA CHANGE : On ne concatène plus de texte manuellement.
-        documents_context = []
-        
-        # On itère sur les résultats du retriever
-        for i, (ctx, src, sc) in enumerate(zip(contextes, sources, scores), start=1):
-            documents_context.append({
-                "id": i,
-                "source_name": Path(src).name, # Juste le nom du fichier (plus propre)
-                "score": float(sc) if sc is not None else 0.0,
-                "content": ctx.strip()
-            })
-
-        # 4) RENDU DU PROMPT VIA JINJA
+            prepared["answer"] = f"Une erreur est survenue pendant la recherche du contexte : {e}"
+            return prepared
+        prepared["timings"]["retrieval_s"] = time.perf_counter() - t0
+        deadline.check("retrieval")
+
+        # 3) Sélection adaptative : moins de chunks quand le meilleur se détache, et
+        # "Je ne sais pas" sans appel au LLM quand aucun n'est assez pertinent
+        with stage_timer("select") as span:
+            candidates = len(hits)
+            hits, decision = self.relevance.select(hits, trim=select)
+            span.set(candidates=candidates, kept=len(hits), decision=decision)
+        prepared["retrieval_score"] = max(
+            (float(hit.get("score_retrieval", 0.0)) for hit in hits), default=0.0
+        )
+        if decision == GATED:
+            prepared["answer"] = NO_ANSWER
+            prepared["mode"] = GATED
+            return prepared
+
+        # 4) PRÉPARATION DES DONNÉES (ViewModel pour Jinja2)
+        # Doublons écartés, chunks consécutifs d'un même fichier fusionnés (sans répéter
+        # leur chevauchement), remplissage jusqu'au budget de tokens
+        t0 = time.perf_counter()
+        with stage_timer("pack") as span:
+            if budget is None:
+                budget = self.context_budget(query)
+            packed = self.context_builder.build(hits, budget=budget)
+            span.set(budget_tokens=budget, context_tokens=packed["tokens"], **packed["stats"])
+        prepared["timings"]["pack_s"] = time.perf_counter() - t0
+        prepared["chunk_ids"] = packed["chunk_ids"]
+        prepared["context_tokens"] = packed["tokens"]
+        documents_context = packed["documents"]
+
+        # 4 bis) Compression : seules les phrases proches de la question restent
+        if self.compressor is not None and compress:
+            t0 = time.perf_counter()
+            with stage_timer("compress") as span:
+                compressed = self.compressor.compress(
+                    query, documents_context, prepared["query_embedding"]
+                )
+                span.set(**compressed["stats"])
+            prepared["timings"]["compress_s"] = time.perf_counter() - t0
+            prepared["compression_ratio"] = compressed["stats"]["ratio"]
+            prepared["context_tokens"] = compressed["tokens"]
+            documents_context = compressed["documents"]
+
+        # 5) RENDU DU PROMPT VIA JINJA
         # On passe la liste d'objets au template
-        prompt = self.template.render(
-            documents=documents_context,
-            query=query
+        t0 = time.perf_counter()
+        with stage_timer("render") as span:
+            prepared["prompt"] = self.template.render(
+                documents=documents_context,
+                query=query
+            )
+            span.set(documents=len(documents_context), prompt_chars=len(prepared["prompt"]))
+        prepared["timings"]["render_s"] = time.perf_counter() - t0
+        prepared["documents"] = documents_context
+        return prepared
+
+    def llm_kwargs(self) -> dict:
+        """Préfixe statique passé à chaque appel du LLM."""
+        return {"system": self.static_prefix}
+
+    def _cache_context(self, prepared: dict, model: str) -> str:
+        return AnswerCache.context_key(
+            self.retrieval.chroma_storage.collection_name,
+            prepared["chunk_ids"],
+            self.template_hash,
+            model,
         )
 
-        # 5) Appel du LLM
-        try:
-            reponse = self.llm.infere(prompt)
-        except Exception as e:
-            return f"Une erreur est survenue pendant l'inférence du LLM : {e}"
+    def _cached_answer(self, query: str, prepared: dict) -> Optional[str]:
+        """Réponse du cache pour cette question, ces chunks et ce palier (voir _route()), ou None."""
+        if self.answer_cache is None:
+            return None
+        model = prepared["route"].chosen.llm.model_name
+        with stage_timer("answer_cache") as span:
+            answer = self.answer_cache.get(
+                query, self._cache_context(prepared, model), prepared["query_embedding"]
+            )
+            span.set(hit=answer is not None)
+        return answer
 
-        # 6) Affichage des sources en bas de réponse
+    def _store_answer(self, query: str, prepared: dict, answer: str):
+        # Les messages d'erreur du LLM ne sont jamais mis en cache
+        if self.answer_cache is None or not answer or is_error_reply(answer):
+            return
+        # Ni une réponse peut-être coupée (max_tokens réduit par l'échéance, ou atteint) :
+        # elle serait resservie telle quelle à des requêtes sans contrainte de temps.
+        # Sans rapport (génération partagée), c'est l'appel qui l'a menée qui la stocke.
+        if prepared["generation"].get("truncated", True):
+            return
+        # Sous le modèle qui a répondu ; après une remontée, aussi sous le palier choisi :
+        # la même question y sera de nouveau routée, et servie sans repasser par l'abstention
+        route = prepared["route"]
+        for model in {route.tier.llm.model_name, route.chosen.llm.model_name}:
+            self.answer_cache.put(
+                query, self._cache_context(prepared, model), answer, prepared["query_embedding"]
+            )
+
+    @staticmethod
+    def format_sources(documents_context: list) -> str:
+        """Bloc "Sources" affiché en bas de réponse (vide s'il n'y a aucun document)."""
         sources_lines = []
         for doc in documents_context:
             sources_lines.append(f"[{doc['id']}] {doc['source_name']} (score: {doc['score']:.3f})")
             
-        if sources_lines:
-            reponse = f"{reponse}\n\nSources (Top-{len(sources_lines)}):\n" + "\n".join(sources_lines)
+        if not sources_lines:
+            return ""
+        return f"\n\nSources (Top-{len(sources_lines)}):\n" + "\n".join(sources_lines)
+
+    def respond(self, query: str) -> str:
+        return self.answer(query)["response"]
+
+    def answer(self, query: str) -> dict:
+        """
+        Comme respond(), en précisant quel mode a produit la réponse.
+
+        Returns:
+            dict: {
+                "response": texte de la réponse (sources comprises),
+                "mode": "generative" (LLM), "cached" (cache de réponses),
+                        "extractive" (mode dégradé, sans LLM), "gated" (aucun document
+                        assez pertinent, sans LLM) ou None (garde-fou, erreur),
+                "chunks": chunks passés au LLM,
+                "context_tokens": tokens estimés de ces chunks dans le prompt,
+                "compression_ratio": tokens après / avant compression (None sans compression),
+            }
+        """
+        with stage_timer("total") as span:
+            result = self._answer(query)
+            span.set(mode=result["mode"])
+        self.count_mode(result["mode"])
+        return result
+
+    def _answer(self, query: str) -> dict:
+        prepared = self.prepare(query)
+        if prepared["answer"] is not None:
+            return self.build_result(prepared, prepared["answer"], prepared["mode"])
+
+        # 6) Réponse déjà générée pour cette question, ces chunks et ce palier ?
+        route = self._route(query, prepared)
+        cached = self._cached_answer(query, prepared)
+        if cached is not None:
+            return self.build_result(prepared, cached + self.format_sources(prepared["documents"]), CACHED)
 
-        return reponse
+        # 7) LLM saturé ou en panne : réponse extractive sans génération
+        if self.degraded.active():
+            return self._extractive(query, prepared)
+
+        # 8) Appel du LLM
+        try:
+            reponse = self.cascade.infere(
+                route, prepared["prompt"], report=prepared["generation"], **self.llm_kwargs()
+            )
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return self._conclude(query, prepared, error=e)
+
+        # 9) Affichage des sources en bas de réponse
+        return self._conclude(query, prepared, reponse)
+
+    def _route(self, query: str, prepared: dict):
+        # Avant le cache : la réponse dépend du palier qui la génère
+        route = self.cascade.route(query, prepared)
+        # Palier final connu à la fin de la génération (remontée possible)
+        prepared["route"] = route
+        return route
+
+    @staticmethod
+    def build_result(prepared: dict, response: str, mode: Optional[str]) -> dict:
+        return {
+            "response": response,
+            "mode": mode,
+            "chunks": len(prepared["chunk_ids"]),
+            "context_tokens": prepared["context_tokens"],
+            "compression_ratio": prepared["compression_ratio"],
+        }
+
+    def _generation_ok(self, reponse: Optional[str], error: Optional[Exception] = None) -> bool:
+        """Enregistre le résultat d'une génération pour le mode dégradé."""
+        ok = error is None and not is_error_reply(reponse)
+        self.degraded.record(ok)
+        return ok
+
+    @staticmethod
+    def _error_text(error: Optional[Exception]) -> Optional[str]:
+        """Message d'erreur renvoyé au client ; None si une réponse extractive le remplace."""
+        if error is None or isinstance(error, LLMQueueFullError):
+            return None
+        return f"Une erreur est survenue pendant l'inférence du LLM : {error}"
+
+    def _conclude(
+        self, query: str, prepared: dict, reponse: Optional[str] = None, error: Optional[Exception] = None
+    ) -> dict:
+        """Fin commune à answer() et aanswer() : mode dégradé, cache et bloc sources."""
+        if not self._generation_ok(reponse, error):
+            # File LLM pleine ou serveur injoignable : passages extraits plutôt que le message d'erreur
+            error_text = self._error_text(error)
+            if error_text is not None:
+                return self.build_result(prepared, error_text, None)
+            return self._extractive(query, prepared)
+        self._store_answer(query, prepared, reponse)
+        return self.build_result(prepared, reponse + self.format_sources(prepared["documents"]), GENERATIVE)
+
+    def extractive_text(self, query: str, prepared: dict) -> str:
+        with stage_timer("extractive") as span:
+            text = self.degraded.answer(query, prepared["documents"])
+            span.set(reason=self.degraded.active_reason or "llm_error")
+        return text
+
+    def _extractive(self, query: str, prepared: dict) -> dict:
+        # Jamais mise en cache : la vraie réponse du LLM la remplacera une fois la charge retombée
+        text = self.extractive_text(query, prepared)
+        return self.build_result(prepared, text + self.format_sources(prepared["documents"]), EXTRACTIVE)
+
+    @staticmethod
+    def count_mode(mode: Optional[str]):
+        if mode is not None:
+            RESPONSE_MODE.inc(mode=mode)
+
+    def respond_stream(self, query: str) -> Iterator[dict]:
+        """
+        Version streaming de respond().
+
+        Yields:
+            dict: Événements {"event": ..., "data": ...} dans l'ordre :
+                - "sources" : documents retenus (envoyés avant tout appel au LLM)
+                - "token"   : fragment de réponse, au fil de la génération
+                - "done"    : durées des étapes (dont time-to-first-token), bloc sources,
+                              "mode" de la réponse, "cached" (réponse servie par le
+                              cache, en un seul "token" ; de même en mode extractif) et
+                              "tier" (palier de la cascade ayant généré la réponse),
+                              "context_tokens" et "compression_ratio" (taille du contexte)
+              ou un unique "answer" si aucune génération n'est nécessaire (erreur, question vide).
+        """
+        t_start = time.perf_counter()
+        prepared = self.prepare(query)
+        if prepared["answer"] is not None:
+            self.count_mode(prepared["mode"])
+            yield {"event": "answer", "data": prepared["answer"]}
+            return
+
+        yield {
+            "event": "sources",
+            "data": [
+                {"id": d["id"], "source_name": d["source_name"], "score": d["score"]}
+                for d in prepared["documents"]
+            ],
+        }
+
+        timings = prepared["timings"]
+        route = self._route(query, prepared)
+        cached = self._cached_answer(query, prepared)
+        if cached is not None:
+            yield {"event": "token", "data": cached}
+            timings["total_s"] = time.perf_counter() - t_start
+            yield self.done_event(prepared, CACHED)
+            return
+
+        if self.degraded.active():
+            yield self._extractive_event(query, prepared)
+            timings["total_s"] = time.perf_counter() - t_start
+            yield self.done_event(prepared, EXTRACTIVE)
+            return
+
+        t_llm = time.perf_counter()
+        parts, error = [], None
+        try:
+            for token in self.cascade.infere_stream(
+                route, prepared["prompt"], report=prepared["generation"], **self.llm_kwargs()
+            ):
+                parts.append(token)
+                if len(parts) == 1 and is_error_reply(token):
+                    # Échec avant tout texte : rien n'est envoyé, _stream_end() décide
+                    break
+                if "ttft_s" not in timings:
+                    timings["ttft_s"] = time.perf_counter() - t_start
+                yield {"event": "token", "data": token}
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            error = e
+        timings["llm_s"] = time.perf_counter() - t_llm
+        yield from self._stream_end(query, prepared, parts, error, t_start)
+
+    def _stream_end(
+        self, query: str, prepared: dict, parts: List[str], error: Optional[Exception], t_start: float
+    ) -> Iterator[dict]:
+        """
+        Fin commune à respond_stream() et arespond_stream(), comme _conclude() :
+        mode dégradé, réponse de repli, cache et événement "done".
+        """
+        # Message d'erreur en cours de flux compris : un seul relevé par génération
+        failed = error is not None or any(map(is_error_reply, parts))
+        self.degraded.record(not failed)
+        sent = bool(parts) and not is_error_reply(parts[0])
+        error_text = self._error_text(error)
+        mode = GENERATIVE
+        if failed and not sent and error_text is None:
+            # Échec avant tout texte : passages extraits plutôt que le message d'erreur
+            mode = EXTRACTIVE
+            yield self._extractive_event(query, prepared)
+        elif error_text is not None:
+            # Comme answer() : sans texte généré, l'erreur n'est comptée dans aucun mode
+            mode = mode if sent else None
+            yield {"event": "token", "data": error_text}
+
+        if not failed:
+            self._store_answer(query, prepared, "".join(parts))
+        prepared["timings"]["total_s"] = time.perf_counter() - t_start
+        yield self.done_event(prepared, mode)
+
+    def _extractive_event(self, query: str, prepared: dict) -> dict:
+        return {"event": "token", "data": self.extractive_text(query, prepared)}
+
+    def done_event(self, prepared: dict, mode: Optional[str]) -> dict:
+        self.count_mode(mode)
+        route = prepared.get("route") if mode == GENERATIVE else None
+        return {
+            "event": "done",
+            "data": {
+                "timings": prepared["timings"],
+                "sources_text": self.format_sources(prepared["documents"]),
+                "mode": mode,
+                "cached": mode == CACHED,
+                "tier": route.tier.name if route is not None else None,
+                "context_tokens": prepared["context_tokens"],
+                "compression_ratio": prepared["compression_ratio"],
+            },
+        }
+
+    async def arespond(
+        self,
+        query: str,
+        run_blocking: Optional[Callable[..., Awaitable]] = None,
+    ) -> str:
+        """
+        Version asynchrone de respond() : le retrieval (bloquant) passe par
+        `run_blocking`, la génération attend le LLM sans occuper de thread.
+
+        Args:
+            query (str): Question
+            run_blocking (Callable, optional): Exécuteur des étapes bloquantes
+                (ex: QueryExecutor.run) ; asyncio.to_thread par défaut
+        """
+        return (await self.aanswer(query, run_blocking))["response"]
+
+    async def aanswer(
+        self,
+        query: str,
+        run_blocking: Optional[Callable[..., Awaitable]] = None,
+    ) -> dict:
+        """Version asynchrone de answer() (mêmes champs)."""
+        run_blocking = run_blocking or asyncio.to_thread
+        with stage_timer("total") as span:
+            result = await self._aanswer(query, run_blocking)
+            span.set(mode=result["mode"])
+        self.count_mode(result["mode"])
+        return result
+
+    async def _aanswer(self, query: str, run_blocking: Callable[..., Awaitable]) -> dict:
+        prepared = await run_blocking(self.prepare, query)
+        if prepared["answer"] is not None:
+            return self.build_result(prepared, prepared["answer"], prepared["mode"])
+
+        route = self._route(query, prepared)
+        cached = self._cached_answer(query, prepared)
+        if cached is not None:
+            return self.build_result(prepared, cached + self.format_sources(prepared["documents"]), CACHED)
+
+        if self.degraded.active():
+            return self._extractive(query, prepared)
+
+        try:
+            reponse = await self.cascade.ainfere(
+                route, prepared["prompt"], report=prepared["generation"], **self.llm_kwargs()
+            )
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            return self._conclude(query, prepared, error=e)
+        return self._conclude(query, prepared, reponse)
+
+    async def arespond_stream(
+        self,
+        query: str,
+        run_blocking: Optional[Callable[..., Awaitable]] = None,
+    ) -> AsyncIterator[dict]:
+        """Version asynchrone de respond_stream() (mêmes événements)."""
+        run_blocking = run_blocking or asyncio.to_thread
+        t_start = time.perf_counter()
+        prepared = await run_blocking(self.prepare, query)
+        if prepared["answer"] is not None:
+            self.count_mode(prepared["mode"])
+            yield {"event": "answer", "data": prepared["answer"]}
+            return
+
+        yield {
+            "event": "sources",
+            "data": [
+                {"id": d["id"], "source_name": d["source_name"], "score": d["score"]}
+                for d in prepared["documents"]
+            ],
+        }
+
+        timings = prepared["timings"]
+        route = self._route(query, prepared)
+        cached = self._cached_answer(query, prepared)
+        if cached is not None:
+            yield {"event": "token", "data": cached}
+            timings["total_s"] = time.perf_counter() - t_start
+            yield self.done_event(prepared, CACHED)
+            return
+
+        if self.degraded.active():
+            yield self._extractive_event(query, prepared)
+            timings["total_s"] = time.perf_counter() - t_start
+            yield self.done_event(prepared, EXTRACTIVE)
+            return
+
+        t_llm = time.perf_counter()
+        parts, error = [], None
+        try:
+            # aclosing : si le client part, le flux LLM est fermé tout de suite (pas au GC)
+            stream = self.cascade.ainfere_stream(
+                route, prepared["prompt"], report=prepared["generation"], **self.llm_kwargs()
+            )
+            async with aclosing(stream) as tokens:
+                async for token in tokens:
+                    parts.append(token)
+                    if len(parts) == 1 and is_error_reply(token):
+                        break
+                    if "ttft_s" not in timings:
+                        timings["ttft_s"] = time.perf_counter() - t_start
+                    yield {"event": "token", "data": token}
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            error = e
+        timings["llm_s"] = time.perf_counter() - t_llm
+        for event in self._stream_end(query, prepared, parts, error, t_start):
+            yield event
 
     def update(self):
         return
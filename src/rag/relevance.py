@@ -0,0 +1,148 @@
+"""
+Sélection adaptative des chunks et filtre de pertinence avant l'appel au LLM.
+
+Le retrieval renvoie top_k candidats triés par score ; tous ne méritent pas une place
+dans le prompt. Quand le premier document devance nettement les autres, les suivants
+n'apportent que du prefill : on coupe à la première rupture de score (écart absolu),
+sous un score relatif au meilleur, ou une fois l'essentiel de la "masse" de score
+couverte. Quand aucun document n'atteint le score minimal, la réponse "Je ne sais
+pas d'après les documents fournis." (consigne 2 de prompts/rag_instructions.txt) est
+donnée sans appeler le LLM.
+
+Les seuils portent sur score_retrieval (similarité cosinus de l'embedding) et non sur
+score_final : celui-ci change d'échelle selon que le reranking s'applique (moyenne avec
+le score lexical, voir rerank.py) ou non (un seul candidat, reranking désactivé). Les
+chunks gardés restent dans l'ordre du reranking. Les seuils dépendent du modèle d'embedding, à
+régler avec scripts/benchmark_collection.py.
+"""
+from typing import List, Sequence, Tuple
+
+from .metrics import RELEVANCE_DECISIONS, CONTEXT_CHUNKS
+
+# Réponse imposée par les consignes quand les documents ne contiennent pas la réponse
+NO_ANSWER = "Je ne sais pas d'après les documents fournis."
+
+# Mode de la réponse (voir degraded.py pour les autres) : aucun document assez pertinent
+GATED = "gated"
+
+# Décisions de la sélection
+FULL = "full"
+TRIMMED = "trimmed"
+
+
+def _score(hit: dict) -> float:
+    return float(hit.get("score_retrieval", hit.get("score_final", 0.0)))
+
+
+class RelevanceGate:
+    """Choisit combien des meilleurs chunks passent au LLM (zéro : pas d'appel)."""
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        min_score: float = 0.2,
+        min_relative_score: float = 0.6,
+        max_gap: float = 0.15,
+        mass_fraction: float = 0.9,
+    ):
+        """
+        Args:
+            enabled (bool): Désactivé : tous les candidats passent, le LLM est toujours appelé
+            min_score (float): Score minimal d'un chunk ; aucun au-dessus : réponse sans LLM
+            min_relative_score (float): Score minimal relatif au meilleur chunk (0 : ignoré)
+            max_gap (float): Écart de score entre deux chunks consécutifs au-delà duquel on coupe
+            mass_fraction (float): Part de la masse de score (au-dessus de min_score) à couvrir
+        """
+        self.enabled = enabled
+        self.min_score = min_score
+        self.min_relative_score = min_relative_score
+        self.max_gap = max_gap
+        self.mass_fraction = mass_fraction
+
+    @classmethod
+    def from_settings(cls, settings) -> "RelevanceGate":
+        """Construit le filtre depuis une RelevanceSettings."""
+        return cls(
+            enabled=settings.enabled,
+            min_score=settings.min_score,
+            min_relative_score=settings.min_relative_score,
+            max_gap=settings.max_gap,
+            mass_fraction=settings.mass_fraction,
+        )
+
+    def cutoff(self, scores: Sequence[float], trim: bool = True) -> int:
+        """Nombre de chunks gardés parmi `scores` (voir keep())."""
+        return len(self.keep(scores, trim))
+
+    def keep(self, scores: Sequence[float], trim: bool = True) -> List[int]:
+        """
+        Indices des chunks à garder, dans l'ordre des candidats (celui du reranking :
+        les scores n'y sont pas forcément décroissants). Écart et masse se calculent
+        sur les scores triés, puis chaque chunk est gardé ou non selon son propre score.
+
+        Args:
+            scores (Sequence[float]): Scores des candidats
+            trim (bool): Coupe adaptative ; False : seul min_score s'applique
+
+        Returns:
+            List[int]: Vide si aucun score n'atteint min_score
+        """
+        if not self.enabled:
+            return list(range(len(scores)))
+        order = sorted(range(len(scores)), key=lambda i: scores[i], reverse=True)
+        ranked = [scores[i] for i in order]
+        if not ranked or ranked[0] < self.min_score:
+            return []
+        if not trim:
+            kept = sum(1 for s in ranked if s >= self.min_score)
+            return sorted(order[:kept])
+
+        floor = max(self.min_score, ranked[0] * self.min_relative_score)
+        eligible = 1
+        while (
+            eligible < len(ranked)
+            and ranked[eligible] >= floor
+            and ranked[eligible - 1] - ranked[eligible] <= self.max_gap
+        ):
+            eligible += 1
+
+        # Masse de score au-dessus du minimum : un chunk qui le dépasse à peine ne pèse rien
+        weights = [s - self.min_score for s in ranked[:eligible]]
+        total = sum(weights)
+        kept, mass = 1, weights[0]
+        while kept < eligible and mass < self.mass_fraction * total:
+            mass += weights[kept]
+            kept += 1
+        return sorted(order[:kept])
+
+    def select(self, hits: List[dict], trim: bool = True) -> Tuple[List[dict], str]:
+        """
+        Chunks à passer au LLM parmi les hits du retrieval, dans leur ordre.
+
+        Args:
+            hits (List[dict]): Candidats du retrieval
+            trim (bool): Coupe adaptative (un seul prompt) ; False : seul min_score
+                s'applique (ex: map-reduce, qui répartit les candidats en groupes)
+
+        Returns:
+            Tuple[List[dict], str]: chunks gardés et décision (GATED, TRIMMED ou FULL)
+        """
+        kept = [hits[i] for i in self.keep([_score(hit) for hit in hits], trim)]
+        if not kept:
+            decision = GATED
+        elif len(kept) < len(hits):
+            decision = TRIMMED
+        else:
+            decision = FULL
+        RELEVANCE_DECISIONS.inc(decision=decision)
+        CONTEXT_CHUNKS.observe(len(kept))
+        return kept, decision
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "min_score": self.min_score,
+            "min_relative_score": self.min_relative_score,
+            "max_gap": self.max_gap,
+            "mass_fraction": self.mass_fraction,
+        }
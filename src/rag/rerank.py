@@ -2,6 +2,8 @@ import re
 import numpy as np
 from typing import List, Dict, Any
 
+from . import tracing
+
 
 class Reranker:
     """
@@ -113,6 +115,9 @@ class Reranker:
                 - "score_final"
             triés par score_final décroissant.
         """
+        tracing.set_attributes(
+            candidates=len(candidates), method=self.method, alpha=self.alpha
+        )
 
         if not self.enabled or len(candidates) <= 1:
             out = []
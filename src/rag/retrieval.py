@@ -1,7 +1,9 @@
+import time
+import threading
 import numpy as np
 import pandas as pd
 from .vectorizor import Vectorizor
-from typing import Tuple, List, Optional
+from typing import Callable, Tuple, List, Optional
 from pathlib import Path
 from .rerank import Reranker
 from .chroma_storage import ChromaStorage
@@ -9,7 +11,9 @@ import json
 from datetime import datetime
 import getpass
 from langchain_text_splitters import RecursiveCharacterTextSplitter
-from .document_processor import DocumentProcessor
+from .document_processor import DocumentProcessor, IngestionCancelled
+from .batching import QueryBatcher
+from .metrics import stage_timer, INGEST_CHUNKS, INGEST_SECONDS
 
 
 class Retrieval:
@@ -18,23 +22,63 @@ class Retrieval:
         path_doc=Path("data/raw"),
         chroma_persist_dir: str = "./chroma_db_local",
         processed_texts_dir: str = "data/processed_texts",
+        model_cache: Optional[dict] = None,
     ):
-        self.vectorizor = Vectorizor()
+        # model_cache : cache de modèles partagé entre plusieurs Retrieval (voir engine.py)
+        self.vectorizor = Vectorizor(model_cache=model_cache)
         self.reranker = Reranker(enabled=True, alpha=0.5)  # moyenne pondérée 50/50
 
         self.chroma_storage = ChromaStorage(persist_directory=str(chroma_persist_dir))
         self.path_doc = Path(path_doc)
+        self.processed_texts_dir = Path(processed_texts_dir)
 
-        self.document_processor = DocumentProcessor(
-            path_doc=self.path_doc, processed_texts_dir=Path(processed_texts_dir)
-        )
+        # Créé à la demande : inutile (et coûteux, sonde Tesseract) pour les requêtes
+        self._document_processor = None
+
+        # Micro-batching des embeddings de requêtes (désactivé par défaut)
+        self.query_batcher: Optional[QueryBatcher] = None
         return
 
+    def enable_query_batching(self, window_ms: float = 5.0, max_batch_size: int = 16):
+        """
+        Regroupe les encodages de requêtes concurrentes en lots (voir batching.py).
+
+        Args:
+            window_ms (float): Attente maximale pour compléter un lot
+            max_batch_size (int): Taille maximale d'un lot
+        """
+        self.disable_query_batching()
+        self.query_batcher = QueryBatcher(
+            self.vectorizor, window_ms=window_ms, max_batch_size=max_batch_size
+        )
+
+    def disable_query_batching(self):
+        if self.query_batcher is not None:
+            self.query_batcher.stop()
+            self.query_batcher = None
+
+    def encode_query(self, query: str) -> np.ndarray:
+        """Embedding d'une requête, via le micro-batching s'il est activé."""
+        if self.query_batcher is not None:
+            return self.query_batcher.encode_query(query)
+        return self.vectorizor.encode_query(query)
+
+    @property
+    def document_processor(self) -> DocumentProcessor:
+        """Processeur de documents, instancié au premier besoin (ingestion)."""
+        if self._document_processor is None:
+            self._document_processor = DocumentProcessor(
+                path_doc=self.path_doc, processed_texts_dir=self.processed_texts_dir
+            )
+        return self._document_processor
+
     def _vectorize_from_scratch(
         self,
         chunk_size: int = 1000,  # ⚠️ Anciennement 200 MOTS, maintenant 1000 CARACTÈRES
         overlap: int = 200,  # ⚠️ Anciennement 0.15 (15%), maintenant 200 CARACTÈRES
         source_folder: str = None,
+        progress_callback: Optional[Callable[..., None]] = None,
+        cancel_event: Optional[threading.Event] = None,
     ):
         """
         Vectorise les documents depuis un dossier source.
@@ -43,6 +87,8 @@ class Retrieval:
             chunk_size (int, optionnel): Taille des chunks en mots (défaut: 200)
             overlap (float, optionnel): Chevauchement entre chunks (défaut: 0.15)
             source_folder (str, optionnel): Dossier source des documents (défaut: self.path_doc)
+            progress_callback (Callable, optionnel): Reçoit l'avancement (fichiers, chunks)
+            cancel_event (threading.Event, optionnel): Interrompt la vectorisation si positionné
 
         Returns:
             bool: True si succès
@@ -52,9 +98,13 @@ class Retrieval:
         if source_folder is None:
             source_folder = str(self.path_doc)
 
+        t0 = time.perf_counter()
         textes, chemins = self.document_processor.process_documents(
-            source=source_folder
+            source=source_folder,
+            progress_callback=progress_callback,
+            cancel_event=cancel_event,
         )
+        INGEST_SECONDS.inc(time.perf_counter() - t0, stage="extraction")
 
         if not textes:
             print(f" Aucun document trouvé dans {source_folder}")
@@ -66,21 +116,43 @@ class Retrieval:
         print(
             f" Vectorisation de {len(df)} chunks (taille={chunk_size} caractères, overlap={overlap} caractères)"
         )
+        if progress_callback:
+            progress_callback(
+                stage="vectorisation",
+                chunks_total=len(df),
+                chunks_embedded=0,
+                chunks_written=0,
+            )
 
         batch_size = 200
+        chunks_embedded, chunks_written = 0, 0
 
         for i in range(0, len(df), batch_size):
+            if cancel_event is not None and cancel_event.is_set():
+                raise IngestionCancelled(
+                    f"Vectorisation annulée après {chunks_written} chunks écrits"
+                )
+
             batch_df = df.iloc[i : i + batch_size].copy()
 
+            t0 = time.perf_counter()
             embeddings = self.vectorizor.encode(batch_df["batch"])
-
-            for idx, (_, row) in enumerate(batch_df.iterrows()):
-                self.chroma_storage.add_document(
-                    document=row["batch"],
-                    chemin=row["chemin"],
-                    embedding=embeddings.iloc[idx],
-                    position_debut=row["position_debut"],
-                )
+            chunks_embedded += len(batch_df)
+            INGEST_CHUNKS.inc(len(batch_df), step="embedded")
+            if progress_callback:
+                progress_callback(chunks_embedded=chunks_embedded)
+
+            written = self.chroma_storage.add_documents(
+                documents=batch_df["batch"].tolist(),
+                chemins=batch_df["chemin"].tolist(),
+                embeddings=embeddings.tolist(),
+                positions_debut=batch_df["position_debut"].tolist(),
+            )
+            chunks_written += written
+            INGEST_CHUNKS.inc(written, step="written")
+            INGEST_SECONDS.inc(time.perf_counter() - t0, stage="vectorisation")
+            if progress_callback:
+                progress_callback(chunks_written=chunks_written)
 
             print(
                 f" Batch {i // batch_size + 1}: {len(batch_df)} embeddings ajoutés à ChromaDB"
@@ -95,6 +167,9 @@ class Retrieval:
         collection_name: str,
         source_folder: str = "code/base_test/DATA_Test",
         model_name: str = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2",
+        on_conflict: str = "ask",
+        progress_callback: Optional[Callable[..., None]] = None,
+        cancel_event: Optional[threading.Event] = None,
     ) -> bool:
         """
         Vectorise les documents avec une configuration spécifique et les stocke
@@ -105,6 +180,11 @@ class Retrieval:
             overlap (float): Chevauchement entre chunks (0-1)
             collection_name (str): Nom de la collection ChromaDB à créer/utiliser
             source_folder (str): Dossier source des documents
+            on_conflict (str): Conduite si la collection existe avec d'autres paramètres :
+                "ask" (question interactive), "overwrite" ou "keep" (sans input(),
+                pour les usages non interactifs comme l'API)
+            progress_callback (Callable, optionnel): Reçoit l'avancement de l'ingestion
+            cancel_event (threading.Event, optionnel): Interrompt l'ingestion si positionné
 
         Returns:
             bool: True si succès
@@ -182,11 +262,16 @@ class Retrieval:
                 print(f"   Créée le : {existing_metadata.get('created_at')}")
                 print(f"   Créée par : {existing_metadata.get('created_by')}")
 
-                choix = (
-                    input("\n Voulez-vous ÉCRASER la collection ? (o/n) : ")
-                    .strip()
-                    .lower()
-                )
+                if on_conflict == "overwrite":
+                    choix = "o"
+                elif on_conflict == "keep":
+                    choix = "n"
+                else:
+                    choix = (
+                        input("\n Voulez-vous ÉCRASER la collection ? (o/n) : ")
+                        .strip()
+                        .lower()
+                    )
 
                 if choix != "o":
                     print(" Opération annulée, collection existante conservée")
@@ -209,7 +294,11 @@ class Retrieval:
         #  VECTORISER (si collection vide OU si on a écrasé)
         print("\n Début de la vectorisation...")
         return self._vectorize_from_scratch(
-            chunk_size=chunk_size, overlap=overlap, source_folder=source_folder
+            chunk_size=chunk_size,
+            overlap=overlap,
+            source_folder=source_folder,
+            progress_callback=progress_callback,
+            cancel_event=cancel_event,
         )
 
     def clone_collection(self, source_collection: str, new_collection_name: str):
@@ -258,44 +347,105 @@ class Retrieval:
             )
 
         try:
-            # Adapter le modèle à la collection active
-            collection_metadata = self.chroma_storage.collection.metadata
-            self.vectorizor.switch_to_model_for_collection(collection_metadata)
+            hits, _ = self.query_hits(query, n)
 
-            # 1. Génération de l'embedding de la requête
-            query_embeddings = self.vectorizor.encode_query(query)
+            # Retour des résultats (avec ou sans reranking)
+            contexts = [c["batch"] for c in hits]
+            sources = [c["chemin"] for c in hits]
+            scores = [c["score_final"] for c in hits]
+            return contexts, sources, scores
 
-            # 2. Recherche dans ChromaDB
-            contexts, sources, scores = self.chroma_storage.query_similar(
-                query_embeddings, n_results=n
+        except Exception as e:
+            print(f" Erreur de requête : {e}")
+            return [], [], []
+
+    def query_hits(self, query: str, n: int) -> Tuple[List[dict], np.ndarray]:
+        """
+        Comme query(), mais renvoie les chunks complets (avec leur id) et l'embedding
+        de la requête. Les erreurs sont propagées.
+
+        Returns:
+            Tuple[List[dict], np.ndarray]: chunks triés par score_final (mêmes champs que
+                query_batch()) et embedding de la requête
+        """
+        if self.chroma_storage.collection is None:
+            raise RuntimeError(
+                "Aucune collection active. "
+                "Utilisez manage_collections.py pour charger une collection "
+                "ou lancez d'abord la vectorisation."
             )
 
-            # 3. Si reranking activé ET plusieurs résultats, l'appliquer
-            if self.reranker.enabled and len(contexts) > 1:
-                candidates = []
-                for i, (ctx, src, score) in enumerate(zip(contexts, sources, scores)):
-                    candidates.append(
-                        {
-                            "batch": ctx,
-                            "chemin": src,
-                            "score_retrieval": score,
-                        }
-                    )
+        # Adapter le modèle à la collection active
+        collection_metadata = self.chroma_storage.collection.metadata
+        self.vectorizor.switch_to_model_for_collection(collection_metadata)
 
-                # Appel du reranker
-                ranked = self.reranker.rescore(query, candidates)
+        # 1. Génération de l'embedding de la requête
+        with stage_timer("embed") as span:
+            span.set(
+                model=self.vectorizor.model_name,
+                batched=self.query_batcher is not None,
+            )
+            query_embedding = self.encode_query(query)
 
-                # Extraction des résultats rerankés
-                contexts = [c["batch"] for c in ranked]
-                sources = [c["chemin"] for c in ranked]
-                scores = [c["score_final"] for c in ranked]
+        # 2. Recherche dans ChromaDB (ids inclus)
+        with stage_timer("search"):
+            hits = self.chroma_storage.query_similar_batch(
+                np.asarray([query_embedding]), n_results=n
+            )[0]
 
-            # 4. Retour des résultats (avec ou sans reranking)
-            return contexts, sources, scores
+        # 3. Reranking (sans effet si désactivé ou s'il n'y a qu'un résultat)
+        if self.reranker.enabled and len(hits) > 1:
+            with stage_timer("rerank"):
+                hits = self.reranker.rescore(query, hits)
+        else:
+            hits = self.reranker.rescore(query, hits)
 
-        except Exception as e:
-            print(f" Erreur de requête : {e}")
-            return [], [], []
+        return hits, query_embedding
+
+    def query_batch(self, queries: List[str], n: int = 5) -> List[List[dict]]:
+        """
+        Retrieval seul (sans LLM) pour plusieurs requêtes : un seul encodage par lot,
+        un seul appel ChromaDB, puis reranking de chaque liste de candidats.
+
+        Args:
+            queries (List[str]): Requêtes à traiter
+            n (int): Nombre de chunks par requête
+
+        Returns:
+            List[List[dict]]: Pour chaque requête, les chunks triés par score_final, avec
+                "id", "batch", "chemin", "position_debut", "taille_texte",
+                "score_retrieval", "score_local", "score_final"
+        """
+        if self.chroma_storage.collection is None:
+            raise RuntimeError(
+                "Aucune collection active. "
+                "Utilisez manage_collections.py pour charger une collection "
+                "ou lancez d'abord la vectorisation."
+            )
+        if not queries:
+            return []
+
+        # Adapter le modèle à la collection active
+        collection_metadata = self.chroma_storage.collection.metadata
+        self.vectorizor.switch_to_model_for_collection(collection_metadata)
+
+        # 1. Embeddings de toutes les requêtes en une passe
+        with stage_timer("embed_batch") as span:
+            span.set(model=self.vectorizor.model_name, queries=len(queries))
+            query_embeddings = self.vectorizor.encode_queries(list(queries))
+
+        # 2. Une seule recherche ChromaDB multi-requêtes
+        with stage_timer("search_batch"):
+            all_hits = self.chroma_storage.query_similar_batch(
+                query_embeddings, n_results=n
+            )
+
+        # 3. Reranking par requête (rescore() renseigne score_local et score_final)
+        with stage_timer("rerank"):
+            return [
+                self.reranker.rescore(query, hits)
+                for query, hits in zip(queries, all_hits)
+            ]
 
     def add_documents(
         self, collection_name: str, source_path: str, overwrite_duplicates: bool = False
@@ -0,0 +1,383 @@
+"""
+Ordonnancement des appels LLM selon les slots libres des serveurs llama.cpp.
+
+Sans ordonnanceur, chaque requête part tout de suite vers le serveur et, si tous ses
+slots (--parallel) sont occupés, attend dans sa file interne : invisible, sans
+priorité, impossible à délester. Ici, au plus `max_outstanding_per_backend` requêtes
+sont envoyées à un serveur (moins si /slots montre des slots pris par d'autres
+clients, aucune pendant le chargement du modèle) ; les autres attendent dans notre
+file, par priorité : une question interactive passe devant le trafic batch
+(benchmarks, tests de charge). File pleine : la requête la moins prioritaire est
+rejetée (503 côté API).
+"""
+import time
+import bisect
+import asyncio
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import TYPE_CHECKING, Dict, List, Optional, Sequence
+
+import httpx
+
+from .admission import SaturatedError
+from .settings import LLMSettings
+from .metrics import LLM_SCHEDULER, LLM_QUEUE_WAIT
+from . import deadline
+
+if TYPE_CHECKING:
+    from .llm_pool import Backend, LLMPool
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+# Rang dans la file : plus petit = servi en premier
+PRIORITIES = {INTERACTIVE: 0, BATCH: 1}
+
+# Délai suggéré au client (Retry-After) quand la file LLM le rejette
+RETRY_AFTER_S = 5
+
+_priority: ContextVar[str] = ContextVar("rag_llm_priority", default=INTERACTIVE)
+
+
+def current_priority() -> str:
+    return _priority.get()
+
+
+@contextmanager
+def priority(name: Optional[str]):
+    """Priorité des appels LLM du bloc ("interactive" ou "batch" ; None : inchangée)."""
+    if name is None:
+        yield current_priority()
+        return
+    if name not in PRIORITIES:
+        raise ValueError(f"Priorité inconnue : {name} (attendu : {', '.join(PRIORITIES)})")
+    token = _priority.set(name)
+    try:
+        yield name
+    finally:
+        try:
+            _priority.reset(token)
+        except ValueError:
+            # Générateur repris dans un autre contexte : rien à restaurer
+            pass
+
+
+class LLMQueueFullError(SaturatedError):
+    """Requête LLM rejetée : file pleine ou attente trop longue d'un slot libre."""
+
+
+def server_root(base_url: str) -> str:
+    """http://hote:8080/v1 -> http://hote:8080 (où llama.cpp sert /health et /slots)."""
+    root = base_url.rstrip("/")
+    return root[: -len("/v1")] if root.endswith("/v1") else root
+
+
+class _Waiter:
+    """Requête en attente d'un serveur libre."""
+
+    WAITING = "waiting"
+    GRANTED = "granted"
+    FAILED = "failed"
+    ABANDONED = "abandoned"
+
+    __slots__ = ("rank", "seq", "priority", "exclude", "state", "backend", "error", "event", "loop", "future")
+
+    def __init__(self, priority: str, seq: int, exclude: Sequence["Backend"]):
+        self.rank = PRIORITIES[priority]
+        self.seq = seq
+        self.priority = priority
+        self.exclude = exclude
+        self.state = self.WAITING
+        self.backend: Optional["Backend"] = None
+        self.error: Optional[BaseException] = None
+        self.event: Optional[threading.Event] = None
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.future: Optional[asyncio.Future] = None
+
+    def __lt__(self, other: "_Waiter") -> bool:
+        return (self.rank, self.seq) < (other.rank, other.seq)
+
+    def notify(self):
+        if self.future is not None:
+            try:
+                self.loop.call_soon_threadsafe(self._resolve)
+            except RuntimeError:
+                # Boucle fermée : plus personne n'attend
+                pass
+        else:
+            self.event.set()
+
+    def _resolve(self):
+        if not self.future.done():
+            self.future.set_result(None)
+
+
+class SlotState:
+    """Occupation d'un serveur vue par /health et /slots (dernier relevé)."""
+
+    def __init__(self):
+        self.ready = True
+        self.slots_supported = True
+        self.total: Optional[int] = None
+        self.busy: Optional[int] = None
+        # Slots occupés par d'autres clients que ce processus
+        self.external = 0
+        self.polled_at: Optional[float] = None
+
+
+class SlotScheduler:
+    """
+    File de priorité devant les serveurs d'un LLMPool.
+
+    Partage le verrou du pool : réservation d'un serveur (pool._try_reserve_locked),
+    libération et relevés des slots déclenchent la distribution des places libres
+    aux requêtes en attente, dans l'ordre des priorités puis d'arrivée.
+    """
+
+    def __init__(self, pool: "LLMPool", settings: LLMSettings):
+        self.pool = pool
+        self.settings = settings
+        self.slots: Dict[str, SlotState] = {b.base_url: SlotState() for b in pool.backends}
+        self._queue: List[_Waiter] = []
+        self._seq = 0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def _lock(self) -> threading.Lock:
+        return self.pool._lock
+
+    # --- Capacité ---
+
+    def capacity_locked(self, backend: "Backend") -> int:
+        """Requêtes que l'on peut avoir en cours sur ce serveur."""
+        state = self.slots[backend.base_url]
+        if not state.ready:
+            return 0
+        limit = self.settings.max_outstanding_per_backend
+        if state.total:
+            limit = min(limit, max(0, state.total - state.external))
+        return limit
+
+    # --- Réservation ---
+
+    def _enqueue_locked(self, priority: str, exclude: Sequence["Backend"]) -> _Waiter:
+        self._seq += 1
+        waiter = _Waiter(priority, self._seq, exclude)
+        if len(self._queue) >= self.settings.max_queue:
+            worst = self._queue[-1] if self._queue else None
+            if worst is not None and waiter.rank < worst.rank:
+                # Place faite à plus prioritaire : la dernière requête batch arrivée est délestée
+                self._finish_locked(worst, error=LLMQueueFullError("File LLM pleine (délestage)", RETRY_AFTER_S))
+                LLM_SCHEDULER.inc(priority=worst.priority, result="shed")
+            else:
+                LLM_SCHEDULER.inc(priority=priority, result="shed")
+                raise LLMQueueFullError("File LLM pleine", RETRY_AFTER_S)
+        bisect.insort(self._queue, waiter)
+        LLM_SCHEDULER.inc(priority=priority, result="queued")
+        return waiter
+
+    def _reserve_now_locked(self, priority: str, exclude: Sequence["Backend"]) -> Optional["Backend"]:
+        # Pas de dépassement : seules les requêtes en attente moins prioritaires sont doublées
+        rank = PRIORITIES[priority]
+        if any(w.rank <= rank for w in self._queue):
+            return None
+        backend = self.pool._try_reserve_locked(exclude)
+        if backend is not None:
+            LLM_SCHEDULER.inc(priority=priority, result="immediate")
+        return backend
+
+    def _finish_locked(self, waiter: _Waiter, backend: Optional["Backend"] = None, error: Optional[BaseException] = None):
+        self._queue.remove(waiter)
+        waiter.backend = backend
+        waiter.error = error
+        waiter.state = _Waiter.GRANTED if backend is not None else _Waiter.FAILED
+        waiter.notify()
+
+    def dispatch_locked(self):
+        """Attribue les places libres aux requêtes en attente (à appeler sous le verrou du pool)."""
+        for waiter in list(self._queue):
+            try:
+                backend = self.pool._try_reserve_locked(waiter.exclude)
+            except httpx.ConnectError as e:  # NoBackendAvailableError
+                # Plus aucun serveur disponible pour elle : inutile d'attendre
+                self._finish_locked(waiter, error=e)
+                continue
+            if backend is not None:
+                self._finish_locked(waiter, backend=backend)
+
+    def _wait_timeout(self) -> float:
+        timeout = self.settings.queue_timeout_s
+        remaining = deadline.remaining()
+        return timeout if remaining is None else min(timeout, remaining)
+
+    def _abandon_locked(self, waiter: _Waiter) -> Optional["Backend"]:
+        """Fin d'attente côté demandeur ; renvoie le serveur s'il a été attribué entre-temps."""
+        if waiter.state == _Waiter.WAITING:
+            self._queue.remove(waiter)
+            waiter.state = _Waiter.ABANDONED
+            return None
+        return waiter.backend
+
+    def _outcome(self, waiter: _Waiter, start: float) -> "Backend":
+        LLM_QUEUE_WAIT.observe(time.perf_counter() - start, priority=waiter.priority)
+        if waiter.error is not None:
+            raise waiter.error
+        if waiter.backend is not None:
+            return waiter.backend
+        LLM_SCHEDULER.inc(priority=waiter.priority, result="timeout")
+        if deadline.expired():
+            raise deadline.exceeded("llm_queue")
+        raise LLMQueueFullError(
+            f"Aucun slot LLM libre après {self.settings.queue_timeout_s:.0f} s", RETRY_AFTER_S
+        )
+
+    def acquire(self, exclude: Sequence["Backend"] = (), priority: Optional[str] = None) -> "Backend":
+        """
+        Réserve un serveur, en attendant dans la file si tous sont pleins.
+
+        Raises:
+            NoBackendAvailableError: si aucun serveur n'est disponible (tous éjectés).
+            LLMQueueFullError: file pleine, requête délestée ou attente trop longue.
+            DeadlineExceeded: si l'échéance de la requête tombe pendant l'attente.
+        """
+        priority = priority or current_priority()
+        with self._lock:
+            backend = self._reserve_now_locked(priority, exclude)
+            if backend is not None:
+                return backend
+            waiter = self._enqueue_locked(priority, exclude)
+            waiter.event = threading.Event()
+            # Une place a pu se libérer entre-temps pour une requête déjà en file
+            self.dispatch_locked()
+
+        start = time.perf_counter()
+        waiter.event.wait(self._wait_timeout())
+        with self._lock:
+            self._abandon_locked(waiter)
+        return self._outcome(waiter, start)
+
+    async def aacquire(self, exclude: Sequence["Backend"] = (), priority: Optional[str] = None) -> "Backend":
+        """Version asynchrone de acquire() : l'attente n'occupe pas la boucle."""
+        priority = priority or current_priority()
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            backend = self._reserve_now_locked(priority, exclude)
+            if backend is not None:
+                return backend
+            waiter = self._enqueue_locked(priority, exclude)
+            waiter.loop = loop
+            waiter.future = loop.create_future()
+            self.dispatch_locked()
+
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter.future, timeout=self._wait_timeout())
+        except asyncio.TimeoutError:
+            pass
+        except BaseException:
+            # Demandeur annulé (client parti) : la place éventuellement reçue est rendue
+            with self._lock:
+                backend = self._abandon_locked(waiter)
+                if backend is not None:
+                    self.pool._unreserve_locked(backend)
+            raise
+        with self._lock:
+            self._abandon_locked(waiter)
+        return self._outcome(waiter, start)
+
+    # --- Relevé des slots ---
+
+    def poll(self, client: httpx.Client):
+        """Relève /health et /slots de chaque serveur, puis redistribue les places."""
+        for backend in self.pool.backends:
+            state = self.slots[backend.base_url]
+            root = server_root(backend.base_url)
+            try:
+                health = client.get(f"{root}/health")
+                slots = client.get(f"{root}/slots") if state.slots_supported else None
+            except httpx.HTTPError:
+                # Serveur injoignable : c'est au disjoncteur du pool d'en décider
+                continue
+
+            # 503 : modèle en cours de chargement (ou aucun slot libre, anciennes versions)
+            ready = health.status_code != 503
+            total = busy = None
+            if slots is not None:
+                if slots.status_code == 200:
+                    try:
+                        total, busy = self._count_slots(slots.json())
+                    except ValueError:
+                        pass
+                elif slots.status_code in (404, 501):
+                    # Endpoint désactivé (llama-server sans --slots) : limite configurée seule
+                    state.slots_supported = False
+                    print(f" [LLM] /slots indisponible sur {root}, limite fixe de {self.settings.max_outstanding_per_backend} requêtes")
+
+            with self._lock:
+                if ready != state.ready:
+                    print(f" [LLM] Serveur {'prêt' if ready else 'en chargement'} : {backend.base_url}")
+                state.ready = ready
+                if total is not None:
+                    state.total = total
+                    state.busy = busy
+                    state.external = max(0, busy - backend.outstanding)
+                state.polled_at = time.monotonic()
+
+        with self._lock:
+            self.dispatch_locked()
+
+    @staticmethod
+    def _count_slots(slots) -> tuple:
+        """(slots, slots occupés) depuis la réponse de /slots (formats récents et anciens)."""
+        if not isinstance(slots, list):
+            raise ValueError("Réponse /slots inattendue")
+        busy = 0
+        for slot in slots:
+            if "is_processing" in slot:
+                busy += bool(slot["is_processing"])
+            else:
+                # Anciennes versions : state 0 = libre
+                busy += slot.get("state", 0) != 0
+        return len(slots), busy
+
+    def start(self):
+        """Relevé périodique des slots (slot_poll_interval_s > 0)."""
+        interval = self.settings.slot_poll_interval_s
+        if interval <= 0 or self._thread is not None:
+            return
+
+        def loop():
+            with httpx.Client(timeout=self.settings.connect_timeout_s) as client:
+                while True:
+                    try:
+                        self.poll(client)
+                    except Exception as e:
+                        print(f" [LLM] Erreur de relevé des slots : {e}")
+                    if self._stop.wait(interval):
+                        return
+
+        self._thread = threading.Thread(target=loop, name="llm-slots", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stop.set()
+
+    # --- Statistiques ---
+
+    def queue_depth(self) -> Dict[str, int]:
+        with self._lock:
+            depth = {name: 0 for name in PRIORITIES}
+            for waiter in self._queue:
+                depth[waiter.priority] += 1
+            return depth
+
+    def stats_locked(self, backend: "Backend") -> dict:
+        state = self.slots[backend.base_url]
+        return {
+            "capacity": self.capacity_locked(backend),
+            "ready": state.ready,
+            "slots_total": state.total,
+            "slots_busy": state.busy,
+            "slots_external": state.external,
+        }
@@ -1,7 +1,7 @@
 import os
 import json
 from pathlib import Path
-from typing import Optional
+from typing import List, Literal, Optional
 from pydantic import BaseModel, Field
 
 # --- DÉFINITION DES STRUCTURES DE DONNÉES ---
@@ -27,6 +27,120 @@ class RetrievalSettings(BaseModel):
         default="sentence-transformers/paraphrase-multilingual-mpnet-base-v2",
         description="Nom du modèle d'embedding (HuggingFace)"
     )
+    query_batch_window_ms: float = Field(default=5.0, ge=0, description="Fenêtre de regroupement des requêtes à encoder")
+    query_batch_max_size: int = Field(default=16, ge=1, description="Taille max d'un lot de requêtes (1 = pas de batching)")
+
+class LLMSettings(BaseModel):
+    """
+    Client HTTP du serveur LLM (partagé par tout le processus).
+    """
+    connect_timeout_s: float = Field(default=5.0, gt=0, description="Établissement de la connexion")
+    read_timeout_s: float = Field(default=300.0, gt=0, description="Attente max entre deux octets reçus")
+    total_timeout_s: float = Field(default=600.0, gt=0, description="Durée max d'une génération complète")
+    pool_timeout_s: float = Field(default=10.0, gt=0, description="Attente max d'une connexion libre du pool")
+    max_connections: int = Field(default=32, ge=1, description="Connexions simultanées vers le serveur LLM")
+    max_keepalive_connections: int = Field(default=16, ge=0, description="Connexions gardées ouvertes (keep-alive)")
+    keepalive_expiry_s: float = Field(default=60.0, ge=0, description="Durée de vie d'une connexion inactive")
+    max_retries: int = Field(default=2, ge=0, description="Nouvelles tentatives sur erreur de connexion")
+    context_window_tokens: int = Field(default=8192, ge=512, description="Fenêtre de contexte du modèle servi")
+    max_tokens: int = Field(default=4096, ge=1, description="Longueur max d'une réponse (réservée dans la fenêtre)")
+    chars_per_token: float = Field(default=3.5, gt=0, description="Ratio initial caractères/token, recalé sur les comptes du serveur")
+    cache_prompt: bool = Field(default=True, description="llama.cpp : réutilise le cache KV du préfixe commun")
+    prefill_tokens_per_s: float = Field(default=100.0, gt=0, description="Débit initial d'évaluation du prompt, recalé sur les timings du serveur")
+    decode_tokens_per_s: float = Field(default=10.0, gt=0, description="Débit initial de génération, recalé sur les timings du serveur")
+    min_answer_tokens: int = Field(default=64, ge=1, description="Sous ce nombre de tokens générables avant l'échéance, la requête est abandonnée")
+    coalesce_requests: bool = Field(default=True, description="Regroupe les appels identiques en cours (un seul envoi au serveur)")
+    breaker_failures: int = Field(default=3, ge=1, description="Échecs consécutifs avant d'éjecter un serveur du pool")
+    breaker_cooldown_s: float = Field(default=30.0, gt=0, description="Durée d'éjection avant une requête d'essai")
+    health_check_interval_s: float = Field(default=10.0, ge=0, description="Sonde des serveurs éjectés (0 = désactivée)")
+    max_outstanding_per_backend: int = Field(default=4, ge=1, description="Requêtes envoyées à la fois à un serveur (au plus ses slots libres) ; les autres attendent dans la file du client")
+    slot_poll_interval_s: float = Field(default=1.0, ge=0, description="Relevé de /health et /slots des serveurs llama.cpp (0 = désactivé, limite fixe)")
+    max_queue: int = Field(default=64, ge=0, description="Requêtes LLM en attente d'un slot ; au-delà, les moins prioritaires sont rejetées")
+    queue_timeout_s: float = Field(default=60.0, gt=0, description="Attente max d'un slot libre avant rejet")
+
+class ContextSettings(BaseModel):
+    """
+    Construction du contexte passé au LLM (voir context_builder.py).
+    """
+    top_k: int = Field(default=5, ge=1, description="Chunks candidats récupérés par question (maximum passé au LLM, voir rag.relevance)")
+    max_context_tokens: int = Field(default=3072, ge=64, description="Budget de tokens des documents dans le prompt")
+    merge_adjacent: bool = Field(default=True, description="Fusionne les chunks consécutifs d'un même fichier")
+
+class RelevanceSettings(BaseModel):
+    """
+    Sélection adaptative des chunks et réponse sans LLM quand rien n'est pertinent (voir relevance.py).
+    Les seuils portent sur score_retrieval (similarité cosinus, hors reranking) ; ils
+    dépendent du modèle d'embedding (scripts/benchmark_collection.py affiche la sélection).
+    """
+    enabled: bool = Field(default=True, description="Désactivé : les top_k chunks passent toujours au LLM")
+    min_score: float = Field(default=0.2, ge=0, le=1, description="Aucun chunk au-dessus : \"Je ne sais pas\" sans appel au LLM")
+    min_relative_score: float = Field(default=0.6, ge=0, le=1, description="Score minimal relatif au meilleur chunk")
+    max_gap: float = Field(default=0.15, gt=0, description="Écart de score entre deux chunks consécutifs au-delà duquel on coupe")
+    mass_fraction: float = Field(default=0.9, gt=0, le=1, description="Part de la masse de score à couvrir (1 : pas de coupe sur ce critère)")
+
+class CompressionSettings(BaseModel):
+    """
+    Compression extractive du contexte : seules les phrases proches de la question vont au LLM (voir compression.py).
+    """
+    enabled: bool = Field(default=False, description="Découpe les documents retenus en phrases et garde les meilleures")
+    max_tokens: int = Field(default=768, ge=32, description="Budget de tokens des documents compressés")
+    semantic_weight: float = Field(default=0.7, ge=0, le=1, description="Poids de la similarité d'embedding (le reste : recouvrement de termes)")
+    min_sentence_chars: int = Field(default=20, ge=0, description="Fragments plus courts rattachés à la phrase précédente")
+
+class MapReduceSettings(BaseModel):
+    """
+    Mode map-reduce, demandé par requête pour les questions larges (voir map_reduce.py).
+    """
+    candidates: int = Field(default=24, ge=1, description="Chunks candidats récupérés (au lieu de context.top_k)")
+    fan_out: int = Field(default=4, ge=1, description="Appels LLM \"map\" simultanés au plus")
+    group_tokens: int = Field(default=2048, ge=64, description="Budget de tokens des documents d'un groupe (borné par la fenêtre du modèle)")
+    max_groups: int = Field(default=6, ge=1, description="Groupes au plus, donc appels \"map\" par question")
+
+class AnswerCacheSettings(BaseModel):
+    """
+    Cache des réponses du LLM (clé : collection, question normalisée, chunks retrouvés, template).
+    """
+    enabled: bool = Field(default=True)
+    max_entries: int = Field(default=1024, ge=1, description="Nombre max de réponses gardées")
+    max_mb: float = Field(default=64.0, gt=0, description="Mémoire max du cache")
+    ttl_s: float = Field(default=3600.0, gt=0, description="Durée de vie d'une réponse")
+    semantic: bool = Field(default=False, description="Réutilise la réponse d'une question quasi identique (mêmes chunks)")
+    semantic_threshold: float = Field(default=0.95, ge=0, le=1, description="Similarité cosinus minimale en mode sémantique")
+
+class ModelTierSettings(BaseModel):
+    """
+    Palier de la cascade : un modèle plus petit pour les questions faciles (voir cascade.py).
+    Un seuil à None n'est pas vérifié.
+    """
+    name: str = Field(description="Nom du palier (labels des métriques)")
+    model: str = Field(description="Modèle servi par ce palier")
+    base_url: str = Field(default="http://127.0.0.1:8081/v1")
+    base_urls: List[str] = Field(default=[], description="Plusieurs serveurs pour ce palier (remplace base_url si non vide)")
+    max_query_chars: Optional[int] = Field(default=200, ge=1, description="Questions plus longues : palier suivant")
+    max_context_tokens: Optional[int] = Field(default=1536, ge=1, description="Contexte plus gros : palier suivant")
+    min_top_score: Optional[float] = Field(default=0.5, ge=0, le=1, description="Similarité cosinus (score_retrieval, hors reranking) du meilleur document en dessous : palier suivant")
+
+class CascadeSettings(BaseModel):
+    """
+    Cascade de modèles : paliers essayés avant le modèle principal (rag.model).
+    """
+    tiers: List[ModelTierSettings] = Field(default=[], description="Du plus petit au plus grand (vide : modèle principal seul)")
+    escalate_on_abstain: bool = Field(default=True, description="Remonte au modèle principal quand un palier répond \"Je ne sais pas\"")
+    abstain_probe_chars: int = Field(default=120, ge=16, description="Début de réponse examiné (retenu en streaming) pour détecter l'abstention")
+
+class DegradedSettings(BaseModel):
+    """
+    Mode dégradé : réponses extractives (sans LLM) quand le serveur LLM est saturé (voir degraded.py).
+    """
+    enabled: bool = Field(default=True)
+    queue_depth_enter: int = Field(default=16, ge=1, description="Requêtes LLM en file déclenchant le mode extractif")
+    queue_depth_exit: int = Field(default=2, ge=0, description="File maximale pour revenir au mode génératif")
+    error_rate_enter: float = Field(default=0.5, gt=0, le=1, description="Taux d'échec des générations déclenchant le mode extractif")
+    error_window_s: float = Field(default=30.0, gt=0, description="Fenêtre du taux d'échec")
+    min_samples: int = Field(default=4, ge=1, description="Générations minimales dans la fenêtre pour juger du taux d'échec")
+    recovery_s: float = Field(default=10.0, ge=0, description="Durée de charge basse avant le retour au mode génératif")
+    max_sentences: int = Field(default=4, ge=1, description="Phrases reprises dans une réponse extractive")
+    max_chunks: int = Field(default=3, ge=1, description="Meilleurs documents parcourus pour une réponse extractive")
 
 class RagSettings(BaseModel):
     """
@@ -34,17 +148,46 @@ class RagSettings(BaseModel):
     """
     model: str = Field(default="Meta-Llama-3.1-8B-Instruct-Q4_K_M.gguf")
     base_url: str = Field(default="http://127.0.0.1:8080/v1") # Localhost par défaut pour tes tests locaux
+    base_urls: List[str] = Field(default=[], description="Plusieurs serveurs LLM (remplace base_url si non vide)")
     api_key: str = Field(default="pas_de_clef")
     
     # On imbrique les sous-sections
     paths: PathsSettings = Field(default_factory=PathsSettings)
     retrieval: RetrievalSettings = Field(default_factory=RetrievalSettings)
+    llm: LLMSettings = Field(default_factory=LLMSettings)
+    context: ContextSettings = Field(default_factory=ContextSettings)
+    relevance: RelevanceSettings = Field(default_factory=RelevanceSettings)
+    compression: CompressionSettings = Field(default_factory=CompressionSettings)
+    map_reduce: MapReduceSettings = Field(default_factory=MapReduceSettings)
+    answer_cache: AnswerCacheSettings = Field(default_factory=AnswerCacheSettings)
+    degraded: DegradedSettings = Field(default_factory=DegradedSettings)
+    cascade: CascadeSettings = Field(default_factory=CascadeSettings)
+
+class ServerSettings(BaseModel):
+    """
+    Paramètres de l'API (pool d'exécution et contrôle d'admission).
+    """
+    max_workers: int = Field(default=4, ge=1, description="Threads exécutant la partie bloquante du pipeline (embedding, recherche)")
+    max_in_flight: int = Field(default=4, ge=1, description="Requêtes traitées simultanément (la génération LLM, asynchrone, n'occupe pas de thread)")
+    max_queue: int = Field(default=16, ge=0, description="Requêtes en attente au-delà de max_in_flight")
+    max_queue_wait_s: float = Field(default=10.0, gt=0, description="Attente max en file avant rejet")
+    retry_after_s: int = Field(default=5, ge=1, description="Valeur de l'en-tête Retry-After")
+    request_timeout_s: Optional[float] = Field(default=None, gt=0, description="Échéance par défaut d'une requête /query (None : aucune, sauf timeout_s de l'appelant)")
+    disconnect_poll_s: float = Field(default=0.5, gt=0, description="Intervalle de vérification de la connexion du client pendant /query (client parti : génération annulée)")
+    collections_memory_budget_mb: int = Field(default=4096, ge=1, description="Mémoire max des moteurs de collection chauds (modèles + index)")
+    collection_idle_ttl_s: float = Field(default=1800.0, gt=0, description="Une collection inutilisée depuis ce délai est libérée")
+    warmup_batch_sizes: List[int] = Field(default=[1, 4, 16], description="Tailles de lot des encodages de chauffe au démarrage")
+    warmup_probe_query: str = Field(default="test", description="Requête de sonde passée au retrieval pendant la chauffe")
+    ready_requires_llm: bool = Field(default=True, description="/readyz exige un serveur LLM joignable")
+    trace_exporter: Literal["none", "console", "jsonl"] = Field(default="none", description="Destination des traces de requêtes (jsonl : fichier sans rotation, à activer ponctuellement)")
+    trace_path: Path = Field(default=Path("logs/traces.jsonl"), description="Fichier des traces (exporteur jsonl)")
 
 class GlobalConfig(BaseModel):
     """
     La classe racine qui contient tout.
     """
     rag: RagSettings = Field(default_factory=RagSettings)
+    server: ServerSettings = Field(default_factory=ServerSettings)
 
     @classmethod
     def load_config(cls, json_path: str = "config.json"):
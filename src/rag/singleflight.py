@@ -0,0 +1,278 @@
+"""
+Regroupement des appels identiques en cours ("single flight").
+
+Quand plusieurs requêtes envoient au même moment exactement le même prompt, une seule
+génération part vers le serveur LLM ; les autres attendent son résultat et le
+partagent. En streaming, chaque abonné reçoit tous les fragments depuis le début,
+puis la suite au fil de la génération. Seuls les appels EN COURS sont regroupés : une
+fois terminés, c'est le cache de réponses (answer_cache.py) qui prend le relais.
+
+La génération partagée s'exécute dans le contexte du leader (échéance comprise) : un
+appel ne rejoint donc que celui d'un leader qui dispose d'au moins autant de temps
+que lui (`expires_at`, horloge monotone, None : sans échéance). Sinon il part seul.
+"""
+import asyncio
+import threading
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional
+
+from .metrics import LLM_SINGLE_FLIGHT
+
+_PULL = object()
+
+
+class _Call:
+    __slots__ = ("done", "result", "error", "expires_at")
+
+    def __init__(self, expires_at: Optional[float] = None):
+        self.expires_at = expires_at
+        self.done = threading.Event()
+        self.result = None
+        self.error: Optional[BaseException] = None
+
+
+class _Broadcast:
+    """Flux partagé (threads) : l'abonné qui manque de fragments tire le suivant."""
+
+    def __init__(self, iterator: Iterator, expires_at: Optional[float] = None):
+        self.iterator = iterator
+        self.expires_at = expires_at
+        self.items: List = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.driving = False
+        self.subscribers = 0
+        self.cond = threading.Condition()
+
+
+class _AsyncBroadcast:
+    """Flux partagé (asyncio) : une tâche pompe le flux amont pour tous les abonnés."""
+
+    def __init__(self, expires_at: Optional[float] = None):
+        self.expires_at = expires_at
+        self.items: List = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self.changed = asyncio.Event()
+
+    def notify(self):
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+
+class SingleFlight:
+    """
+    Un appel amont par clé à un instant donné, pour les appels synchrones, asynchrones
+    et les flux. Une génération abandonnée par tous ses demandeurs est annulée.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls: Dict[str, _Call] = {}
+        self._streams: Dict[str, _Broadcast] = {}
+        # Côté asyncio : une seule boucle accède à ces tables, pas de verrou nécessaire
+        self._acalls: Dict[tuple, list] = {}
+        self._astreams: Dict[tuple, _AsyncBroadcast] = {}
+
+    @staticmethod
+    def _can_join(leader_expires_at: Optional[float], expires_at: Optional[float]) -> bool:
+        """Le leader doit avoir au moins autant de temps que l'appel qui le rejoint."""
+        if leader_expires_at is None:
+            return True
+        return expires_at is not None and expires_at <= leader_expires_at
+
+    def in_flight(self) -> int:
+        with self._lock:
+            return len(self._calls) + len(self._streams) + len(self._acalls) + len(self._astreams)
+
+    # --- Appels simples ---
+
+    def do(self, key: str, fn: Callable, expires_at: Optional[float] = None):
+        """Exécute fn() ou, si le même appel est déjà en cours, attend son résultat."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call(expires_at)
+            elif not self._can_join(call.expires_at, expires_at):
+                call = None
+        if call is None:
+            # Leader plus pressé : son résultat pourrait être tronqué ou arriver trop tard
+            LLM_SINGLE_FLIGHT.inc(mode="call", role="alone")
+            return fn()
+        LLM_SINGLE_FLIGHT.inc(mode="call", role="leader" if leader else "follower")
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    async def ado(self, key: str, coro_fn: Callable[[], Awaitable], expires_at: Optional[float] = None):
+        """Version asynchrone de do() ; l'appel amont est annulé si tous les demandeurs partent."""
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        entry = self._acalls.get(flight_key)
+        if entry is not None and not self._can_join(entry[2], expires_at):
+            LLM_SINGLE_FLIGHT.inc(mode="call", role="alone")
+            return await coro_fn()
+        leader = entry is None
+        if leader:
+            entry = [loop.create_task(coro_fn()), 0, expires_at]
+            self._acalls[flight_key] = entry
+
+            def forget(_task, entry=entry):
+                if self._acalls.get(flight_key) is entry:
+                    del self._acalls[flight_key]
+
+            entry[0].add_done_callback(forget)
+        LLM_SINGLE_FLIGHT.inc(mode="call", role="leader" if leader else "follower")
+
+        task = entry[0]
+        entry[1] += 1
+        try:
+            # shield : l'annulation d'un demandeur n'annule pas l'appel des autres
+            return await asyncio.shield(task)
+        finally:
+            entry[1] -= 1
+            if entry[1] == 0 and not task.done():
+                task.cancel()
+
+    # --- Flux ---
+
+    def stream(self, key: str, gen_fn: Callable[[], Iterator], expires_at: Optional[float] = None) -> Iterator:
+        """Itère sur gen_fn() ou rejoint le même flux déjà en cours (depuis son début)."""
+        with self._lock:
+            broadcast = self._streams.get(key)
+            alone = broadcast is not None and not self._can_join(broadcast.expires_at, expires_at)
+            leader = broadcast is None
+            if leader:
+                broadcast = self._streams[key] = _Broadcast(gen_fn(), expires_at)
+            if not alone:
+                broadcast.subscribers += 1
+        if alone:
+            LLM_SINGLE_FLIGHT.inc(mode="stream", role="alone")
+            yield from gen_fn()
+            return
+        LLM_SINGLE_FLIGHT.inc(mode="stream", role="leader" if leader else "follower")
+
+        index = 0
+        try:
+            while True:
+                with broadcast.cond:
+                    while index >= len(broadcast.items) and not broadcast.done and broadcast.driving:
+                        broadcast.cond.wait()
+                    if index < len(broadcast.items):
+                        item = broadcast.items[index]
+                        index += 1
+                    elif broadcast.done:
+                        if broadcast.error is not None:
+                            raise broadcast.error
+                        return
+                    else:
+                        broadcast.driving = True
+                        item = _PULL
+
+                if item is _PULL:
+                    self._pull(key, broadcast)
+                    continue
+                yield item
+        finally:
+            with self._lock:
+                broadcast.subscribers -= 1
+                abandoned = broadcast.subscribers == 0 and not broadcast.done
+                if broadcast.subscribers == 0 and self._streams.get(key) is broadcast:
+                    del self._streams[key]
+            if abandoned:
+                # Plus personne n'écoute : on arrête la génération amont
+                with broadcast.cond:
+                    broadcast.done = True
+                broadcast.iterator.close()
+
+    def _pull(self, key: str, broadcast: _Broadcast):
+        end, error, item = False, None, None
+        try:
+            item = next(broadcast.iterator)
+        except StopIteration:
+            end = True
+        except BaseException as e:
+            error = e
+        with broadcast.cond:
+            broadcast.driving = False
+            if end or error is not None:
+                broadcast.done = True
+                broadcast.error = error
+            else:
+                broadcast.items.append(item)
+            broadcast.cond.notify_all()
+        if end or error is not None:
+            with self._lock:
+                if self._streams.get(key) is broadcast:
+                    del self._streams[key]
+
+    async def astream(self, key: str, agen_fn: Callable[[], AsyncIterator], expires_at: Optional[float] = None) -> AsyncIterator:
+        """Version asynchrone de stream()."""
+        loop = asyncio.get_running_loop()
+        flight_key = (id(loop), key)
+        broadcast = self._astreams.get(flight_key)
+        if broadcast is not None and not self._can_join(broadcast.expires_at, expires_at):
+            LLM_SINGLE_FLIGHT.inc(mode="stream", role="alone")
+            agen = agen_fn()
+            try:
+                async for item in agen:
+                    yield item
+            finally:
+                await agen.aclose()
+            return
+        leader = broadcast is None
+        if leader:
+            broadcast = self._astreams[flight_key] = _AsyncBroadcast(expires_at)
+            broadcast.task = loop.create_task(self._pump(flight_key, broadcast, agen_fn))
+        broadcast.subscribers += 1
+        LLM_SINGLE_FLIGHT.inc(mode="stream", role="leader" if leader else "follower")
+
+        index = 0
+        try:
+            while True:
+                if index < len(broadcast.items):
+                    index += 1
+                    yield broadcast.items[index - 1]
+                    continue
+                if broadcast.done:
+                    if broadcast.error is not None:
+                        raise broadcast.error
+                    return
+                await broadcast.changed.wait()
+        finally:
+            broadcast.subscribers -= 1
+            if broadcast.subscribers == 0 and not broadcast.done:
+                broadcast.task.cancel()
+
+    async def _pump(self, flight_key: tuple, broadcast: _AsyncBroadcast, agen_fn: Callable[[], AsyncIterator]):
+        agen = agen_fn()
+        try:
+            async for item in agen:
+                broadcast.items.append(item)
+                broadcast.notify()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            broadcast.error = e
+        finally:
+            broadcast.done = True
+            broadcast.notify()
+            if self._astreams.get(flight_key) is broadcast:
+                del self._astreams[flight_key]
+            await agen.aclose()
@@ -0,0 +1,25 @@
+"""
+Découpage en phrases et mots significatifs, partagés par les réponses extractives
+(degraded.py) et la compression du contexte (compression.py).
+"""
+import re
+import unicodedata
+
+STOPWORDS = {
+    "les", "des", "une", "est", "sont", "pour", "dans", "par", "sur", "avec", "que",
+    "qui", "quoi", "quel", "quelle", "quels", "quelles", "comment", "combien", "pourquoi",
+    "aux", "ces", "cette", "son", "ses", "leur", "leurs", "elle", "ils", "elles", "nous",
+    "vous", "pas", "plus", "peut", "faut", "etre", "avoir", "fait", "the", "and",
+}
+SENTENCE_SPLIT = re.compile(r"(?<=[.!?;])\s+|\n+")
+
+
+def terms(text: str) -> set:
+    """Mots significatifs, sans accents ni casse, pluriels ramenés au singulier."""
+    text = unicodedata.normalize("NFKD", text.lower())
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return {
+        w[:-1] if len(w) > 3 and w[-1] in "sx" else w
+        for w in re.findall(r"\w+", text)
+        if len(w) > 2 and w not in STOPWORDS
+    }
@@ -0,0 +1,268 @@
+"""
+Traces légères par requête (spans imbriqués), sans dépendance externe.
+
+Une trace est ouverte par requête HTTP (voir main.py) ; chaque étape du pipeline
+(metrics.stage_timer : embed, search, rerank, render, llm...) y ajoute un span avec
+ses attributs (taille du prompt, nombre de candidats, modèles...). La trace terminée
+part vers l'exporteur configuré (fichier JSONL ou console) et se résume en en-tête
+Server-Timing.
+
+Hors trace (scripts, launchers, threads de fond), les spans ne coûtent presque rien.
+"""
+import json
+import time
+import uuid
+import queue
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional
+
+
+class Span:
+    __slots__ = ("name", "span_id", "parent_id", "start", "end_time", "attributes", "error")
+
+    def __init__(self, name: str, parent_id: Optional[str], attributes: dict):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end_time: Optional[float] = None
+        self.attributes = dict(attributes)
+        self.error: Optional[str] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    @property
+    def duration_s(self) -> float:
+        end = self.end_time if self.end_time is not None else time.perf_counter()
+        return end - self.start
+
+
+class _NoSpan:
+    """Span factice renvoyé hors trace : les attributs sont ignorés."""
+
+    def set(self, **attributes):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class Trace:
+    """Ensemble des spans d'une requête."""
+
+    def __init__(self, name: str, **attributes):
+        self.trace_id = uuid.uuid4().hex
+        self.name = name
+        self.attributes = dict(attributes)
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.end_time: Optional[float] = None
+        self.spans: List[Span] = []
+        # Réponse en streaming : la trace se termine avec le flux, pas avec la réponse HTTP
+        self.detached = False
+        self._finished = False
+        self._lock = threading.Lock()
+
+    def add(self, span: Span):
+        with self._lock:
+            self.spans.append(span)
+
+    def stage_durations(self) -> Dict[str, float]:
+        """Durée cumulée par nom de span (en secondes), dans l'ordre d'apparition."""
+        durations: Dict[str, float] = {}
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        for span in spans:
+            durations[span.name] = durations.get(span.name, 0.0) + span.duration_s
+        return durations
+
+    def server_timing(self) -> str:
+        """Valeur de l'en-tête Server-Timing (durées en millisecondes)."""
+        parts = [
+            f"{name};dur={duration * 1000:.1f}"
+            for name, duration in self.stage_durations().items()
+        ]
+        end = self.end_time if self.end_time is not None else time.perf_counter()
+        parts.append(f"app;dur={(end - self.start) * 1000:.1f}")
+        return ", ".join(parts)
+
+    def finish(self):
+        """Termine la trace et l'exporte (une seule fois)."""
+        with self._lock:
+            if self._finished:
+                return
+            self._finished = True
+            self.end_time = time.perf_counter()
+        if _exporter is not None:
+            try:
+                _exporter.export(self)
+            except Exception as e:
+                print(f" [Tracing] Erreur d'export : {e}")
+
+    def to_dict(self) -> dict:
+        end = self.end_time if self.end_time is not None else time.perf_counter()
+        with self._lock:
+            spans = sorted(self.spans, key=lambda s: s.start)
+        return {
+            "trace_id": self.trace_id,
+            "name": self.name,
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(),
+            "duration_ms": round((end - self.start) * 1000, 3),
+            "attributes": self.attributes,
+            "spans": [
+                {
+                    "name": span.name,
+                    "span_id": span.span_id,
+                    "parent_id": span.parent_id,
+                    "offset_ms": round((span.start - self.start) * 1000, 3),
+                    "duration_ms": round(span.duration_s * 1000, 3),
+                    "attributes": span.attributes,
+                    "error": span.error,
+                }
+                for span in spans
+            ],
+        }
+
+
+_current_trace: ContextVar[Optional[Trace]] = ContextVar("rag_trace", default=None)
+_current_span: ContextVar[Optional[Span]] = ContextVar("rag_span", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current_trace.get()
+
+
+@contextmanager
+def start_trace(name: str, **attributes):
+    """
+    Ouvre une trace pour la durée du bloc (une requête HTTP).
+    Elle est exportée en sortie de bloc, sauf si elle a été détachée (streaming).
+    """
+    trace = Trace(name, **attributes)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+        if not trace.detached:
+            trace.finish()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """
+    Span enfant du span courant. Les exceptions sont notées sur le span puis propagées.
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        yield _NO_SPAN
+        return
+
+    parent = _current_span.get()
+    current = Span(name, parent.span_id if parent is not None else None, attributes)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except Exception as e:
+        current.error = repr(e)[:200]
+        raise
+    finally:
+        current.end_time = time.perf_counter()
+        trace.add(current)
+        try:
+            _current_span.reset(token)
+        except ValueError:
+            # Générateur repris dans un autre contexte : rien à restaurer
+            pass
+
+
+def set_attributes(**attributes):
+    """Ajoute des attributs au span courant (sans effet hors trace)."""
+    current = _current_span.get()
+    if current is not None:
+        current.set(**attributes)
+
+
+# --- Exporteurs ---
+
+class ConsoleExporter:
+    """Une ligne de résumé par trace sur la sortie standard."""
+
+    def export(self, trace: Trace):
+        print(f" [Trace] {trace.name} {trace.trace_id[:8]} {trace.server_timing()}")
+
+
+class JsonlExporter:
+    """
+    Une trace complète (JSON) par ligne, ajoutée au fichier par un thread de fond :
+    la fin de requête (boucle asyncio) ne bloque jamais sur le disque.
+    """
+
+    def __init__(self, path, max_pending: int = 10000):
+        """
+        Args:
+            path: Fichier de sortie
+            max_pending (int): Traces en attente d'écriture au-delà desquelles on les abandonne
+        """
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.dropped = 0
+        self._queue: "queue.Queue" = queue.Queue(maxsize=max_pending)
+        self._thread = threading.Thread(target=self._loop, name="trace-writer", daemon=True)
+        self._thread.start()
+
+    def export(self, trace: Trace):
+        try:
+            self._queue.put_nowait(trace.to_dict())
+        except queue.Full:
+            # Disque trop lent : on perd des traces plutôt que de ralentir les requêtes
+            self.dropped += 1
+
+    def stop(self):
+        """Écrit les traces en attente puis arrête le thread."""
+        self._queue.put(None)
+        self._thread.join(timeout=5)
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            # Tout ce qui attend part dans la même ouverture du fichier
+            while batch[-1] is not None and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            stop = batch[-1] is None
+            lines = [json.dumps(t, ensure_ascii=False, default=str) for t in batch if t is not None]
+            if lines:
+                try:
+                    with open(self.path, "a", encoding="utf-8") as f:
+                        f.write("\n".join(lines) + "\n")
+                except OSError as e:
+                    print(f" [Tracing] Erreur d'écriture : {e}")
+            if stop:
+                return
+
+
+_exporter = None
+
+
+def configure(exporter: str = "none", path=None):
+    """
+    Choisit l'exporteur des traces terminées.
+
+    Args:
+        exporter (str): "none", "console" ou "jsonl"
+        path: Fichier de sortie pour "jsonl"
+    """
+    global _exporter
+    if isinstance(_exporter, JsonlExporter):
+        _exporter.stop()
+    if exporter == "jsonl":
+        _exporter = JsonlExporter(path or "logs/traces.jsonl")
+    elif exporter == "console":
+        _exporter = ConsoleExporter()
+    else:
+        _exporter = None
@@ -3,21 +3,31 @@ import pandas as pd
 from tqdm import tqdm
 from sentence_transformers import SentenceTransformer
 import torch
+import threading
+from typing import List, Optional
+
+# Sérialise les chargements quand plusieurs Vectorizor partagent un même cache
+_MODEL_LOAD_LOCK = threading.RLock()
+
 
 class Vectorizor:
     def __init__(
         self,
         model_name: str = "sentence-transformers/paraphrase-multilingual-mpnet-base-v2",
+        model_cache: Optional[dict] = None,
     ):
         """
         Initialise le vectorizor avec un modèle par défaut.
 
         Args:
             model_name (str): Nom du modèle HuggingFace à charger
+            model_cache (dict, optional): Cache {nom: modèle} partagé entre plusieurs
+                Vectorizor (un modèle n'est alors chargé qu'une fois par processus)
         """
         self.model_name = model_name
         self.model = None
-        self._model_cache = {}  # Cache des modèles chargés
+        # Cache des modèles chargés (propre à l'instance sauf si un cache est fourni)
+        self._model_cache = model_cache if model_cache is not None else {}
 
         if torch.cuda.is_available():
             self.device = "cuda"
@@ -36,7 +46,11 @@ class Vectorizor:
         Args:
             model_name (str): Nom du modèle HuggingFace
         """
+        # Deux moteurs demandant le même modèle ne le chargent pas deux fois
+        with _MODEL_LOAD_LOCK:
+            self._load_model_locked(model_name)
 
+    def _load_model_locked(self, model_name: str):
         # Vérifier le cache d'abord
         if model_name in self._model_cache:
             print(f"⚡ Modèle récupéré du cache : {model_name}")
@@ -153,6 +167,16 @@ class Vectorizor:
         # Recharger (avec gestion d'erreurs intégrée)
         self._load_model(required_model)
 
+    @staticmethod
+    def model_memory_bytes(model) -> int:
+        """
+        Mémoire occupée par les poids d'un modèle (paramètres + buffers), en octets.
+        """
+        total = 0
+        for tensor in list(model.parameters()) + list(model.buffers()):
+            total += tensor.numel() * tensor.element_size()
+        return total
+
     def get_model_dimension(self) -> int:
         """
         Retourne la dimension du modèle actuel.
@@ -196,11 +220,47 @@ class Vectorizor:
             query_embeddings = self.model.encode(query, prompt_name="query").astype(
                 float
             )
-        except (TypeError, AttributeError):
+        except (TypeError, AttributeError, KeyError, ValueError):
+            # ValueError : modèle sans prompt "query" configuré (ex: MPNet)
             query_embeddings = self.model.encode(query).astype(float)
 
         return query_embeddings
 
+    def encode_queries(self, queries: List[str]) -> np.ndarray:
+        """
+        Encode plusieurs requêtes en un seul appel au modèle (une seule passe par lot).
+
+        Args:
+            queries (List[str]): Requêtes à encoder
+
+        Returns:
+            np.ndarray: Matrice (len(queries), dimension), une ligne par requête
+        """
+        batch_size = max(1, len(queries))
+        try:
+            query_embeddings = self.model.encode(
+                queries, prompt_name="query", batch_size=batch_size
+            ).astype(float)
+        except (TypeError, AttributeError, KeyError, ValueError):
+            query_embeddings = self.model.encode(
+                queries, batch_size=batch_size
+            ).astype(float)
+
+        return query_embeddings
+
+    def encode_passages(self, passages: List[str]) -> np.ndarray:
+        """
+        Encode des passages courts (ex: phrases d'un chunk) en un seul appel, comme les
+        chunks de la collection (sans prompt "query").
+
+        Args:
+            passages (List[str]): Textes à encoder
+
+        Returns:
+            np.ndarray: Matrice (len(passages), dimension)
+        """
+        return self.model.encode(passages, batch_size=max(1, min(len(passages), 64))).astype(float)
+
     def similarity(self, target_embeddings, db_embeddings):
         """
         Calcule la similarité entre embeddings.
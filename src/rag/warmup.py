@@ -0,0 +1,186 @@
+import time
+import threading
+import traceback
+from datetime import datetime
+from typing import Callable, List, Optional
+
+
+class Warmup:
+    """
+    Phase de chauffe au démarrage et état de disponibilité du service.
+
+    Sans chauffe, la première vraie requête paie le chargement du modèle, la mise en
+    place des graphes torch à la première inférence, le chargement de l'index HNSW
+    depuis le disque et le rendu du template. Ici, tout cela est fait une fois au
+    démarrage, et /readyz ne répond 200 qu'une fois le moteur chaud.
+    """
+
+    STARTING = "starting"
+    WARMING = "warming"
+    READY = "ready"
+    FAILED = "failed"
+
+    def __init__(
+        self,
+        batch_sizes: Optional[List[int]] = None,
+        probe_query: str = "test",
+        require_llm: bool = True,
+        llm_recheck_s: float = 5.0,
+    ):
+        """
+        Args:
+            batch_sizes (List[int]): Tailles de lot des encodages de chauffe
+            probe_query (str): Requête de sonde passée au retrieval
+            require_llm (bool): Le service n'est prêt que si le serveur LLM répond
+            llm_recheck_s (float): Intervalle minimal entre deux sondes du LLM
+        """
+        self.batch_sizes = batch_sizes or [1, 4, 16]
+        self.probe_query = probe_query
+        self.require_llm = require_llm
+        self.llm_recheck_s = llm_recheck_s
+
+        self.status = self.STARTING
+        self.steps: List[dict] = []
+        self.started_at = time.time()
+        self.finished_at: Optional[float] = None
+
+        self._engine = None
+        self._llm_ok = False
+        self._llm_checked_at = 0.0
+        self._llm_lock = threading.Lock()
+
+    @classmethod
+    def from_settings(cls, settings) -> "Warmup":
+        """Construit la chauffe depuis une ServerSettings."""
+        return cls(
+            batch_sizes=settings.warmup_batch_sizes,
+            probe_query=settings.warmup_probe_query,
+            require_llm=settings.ready_requires_llm,
+        )
+
+    def _step(self, name: str, fn: Callable[[], Optional[dict]]) -> bool:
+        t0 = time.perf_counter()
+        step = {"step": name, "ok": False, "duration_s": None, "error": None}
+        self.steps.append(step)
+        try:
+            details = fn()
+            if details:
+                step.update(details)
+            step["ok"] = True
+        except Exception as e:
+            traceback.print_exc()
+            step["error"] = str(e)
+        step["duration_s"] = round(time.perf_counter() - t0, 3)
+        print(f" [Warmup] {name} : {'OK' if step['ok'] else 'ÉCHEC'} ({step['duration_s']} s)")
+        return step["ok"]
+
+    def run(self, engine) -> bool:
+        """
+        Chauffe le moteur : modèle et collection configurés, encodages factices,
+        requête de sonde, rendu du template, joignabilité du LLM.
+
+        Args:
+            engine (RagEngine): Moteur partagé à chauffer
+
+        Returns:
+            bool: True si le service est prêt à répondre
+        """
+        self._engine = engine
+        self.status = self.WARMING
+        self.steps = []
+        print(" [Warmup] Début de la chauffe...")
+
+        state = {}
+
+        def build_engine():
+            # Charge le modèle de la collection configurée et ouvre la collection
+            state["rag"] = engine.get()
+            retrieval = state["rag"].retrieval
+            return {
+                "model": retrieval.vectorizor.model_name,
+                "collection": retrieval.chroma_storage.collection_name,
+                "documents": retrieval.chroma_storage.collection.count(),
+            }
+
+        def encode_batches():
+            vectorizor = state["rag"].retrieval.vectorizor
+            for size in self.batch_sizes:
+                vectorizor.encode_queries([self.probe_query] * size)
+            # Passe aussi par le micro-batching (thread de lot démarré et chaud)
+            state["rag"].retrieval.encode_query(self.probe_query)
+            return {"batch_sizes": self.batch_sizes}
+
+        def probe_query():
+            # Premier accès à l'index HNSW (chargé depuis le disque) + reranking
+            hits = state["rag"].retrieval.query_batch([self.probe_query], n=1)
+            return {"hits": len(hits[0]) if hits else 0}
+
+        def render_template():
+            state["rag"].template.render(
+                documents=[{"id": 1, "source_name": "warmup", "score": 1.0, "content": "warmup"}],
+                query=self.probe_query,
+            )
+
+        def check_llm():
+            if not self.llm_reachable(force=True):
+                raise ConnectionError(f"Serveur LLM injoignable ({', '.join(state['rag'].llm.base_urls)})")
+
+        ok = self._step("engine", build_engine)
+        if ok:
+            ok = self._step("encode", encode_batches) and ok
+            ok = self._step("probe_query", probe_query) and ok
+            ok = self._step("template", render_template) and ok
+            llm_ok = self._step("llm", check_llm)
+            if self.require_llm:
+                ok = ok and llm_ok
+
+        self.status = self.READY if ok else self.FAILED
+        self.finished_at = time.time()
+        print(f" [Warmup] Chauffe terminée : {self.status}")
+        return ok
+
+    def llm_reachable(self, force: bool = False) -> bool:
+        """État du serveur LLM, sondé au plus toutes les `llm_recheck_s` secondes."""
+        rag = self._engine.current if self._engine is not None else None
+        if rag is None:
+            return False
+        with self._llm_lock:
+            if force or time.monotonic() - self._llm_checked_at >= self.llm_recheck_s:
+                self._llm_ok = rag.llm.is_reachable()
+                self._llm_checked_at = time.monotonic()
+            return self._llm_ok
+
+    def recheck_llm(self) -> bool:
+        """
+        Sonde le LLM (au plus toutes les `llm_recheck_s` secondes). Si la chauffe n'a
+        échoué que sur le LLM, le service passe prêt dès qu'il répond.
+        """
+        reachable = self.llm_reachable()
+        if reachable and self.status == self.FAILED and self._failed_steps() <= {"llm"}:
+            self.status = self.READY
+        return reachable
+
+    def _failed_steps(self) -> set:
+        return {step["step"] for step in self.steps if not step["ok"]}
+
+    def is_ready(self) -> bool:
+        """
+        Prêt = chauffe réussie et collection par défaut chaude (et LLM joignable si requis,
+        d'après la dernière sonde : voir recheck_llm()).
+        """
+        if self.status != self.READY:
+            return False
+        if self._engine is None or self._engine.current is None:
+            return False
+        return not (self.require_llm and not self._llm_ok)
+
+    def report(self) -> dict:
+        """État détaillé de la chauffe (corps de /readyz)."""
+        end = self.finished_at or time.time()
+        return {
+            "status": self.status,
+            "started_at": datetime.fromtimestamp(self.started_at).isoformat(),
+            "warmup_s": round(end - self.started_at, 3),
+            "llm_reachable": self._llm_ok,
+            "steps": list(self.steps),
+        }
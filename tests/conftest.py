@@ -0,0 +1,68 @@
+"""
+Fixtures communes : faux serveur LLM (scripts/mock_llm_server.py) et ports libres.
+
+Lancement depuis la racine du projet :
+    python -m pytest -q tests
+"""
+import sys
+import time
+import socket
+import subprocess
+import urllib.request
+from pathlib import Path
+
+import pytest
+
+ROOT_DIR = Path(__file__).resolve().parent.parent
+MOCK_SERVER = ROOT_DIR / "scripts" / "mock_llm_server.py"
+
+
+def free_port() -> int:
+    """Port TCP libre sur la boucle locale (rien n'y écoute au retour)."""
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def _wait_until_up(base_url: str, process: subprocess.Popen, timeout: float = 20.0):
+    stop_at = time.monotonic() + timeout
+    while time.monotonic() < stop_at:
+        if process.poll() is not None:
+            raise RuntimeError(f"Le faux serveur LLM s'est arrêté (code {process.returncode})")
+        try:
+            with urllib.request.urlopen(f"{base_url}/models", timeout=1):
+                return
+        except OSError:
+            time.sleep(0.1)
+    raise RuntimeError(f"Le faux serveur LLM ne répond pas sur {base_url}")
+
+
+@pytest.fixture
+def dead_url() -> str:
+    """URL d'un serveur LLM éteint (connexion refusée)."""
+    return f"http://127.0.0.1:{free_port()}/v1"
+
+
+@pytest.fixture(scope="session")
+def mock_llm_url():
+    """Faux serveur llama.cpp rapide (réponses courtes, sans gigue), le temps de la session."""
+    port = free_port()
+    process = subprocess.Popen(
+        [
+            sys.executable, str(MOCK_SERVER),
+            "--port", str(port),
+            "--prefill-ms-per-token", "0",
+            "--tokens-per-s", "1000",
+            "--completion-tokens", "8",
+            "--jitter", "0",
+        ],
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}/v1"
+    try:
+        _wait_until_up(base_url, process)
+        yield base_url
+    finally:
+        process.terminate()
+        process.wait(timeout=10)
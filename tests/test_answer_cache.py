@@ -0,0 +1,102 @@
+"""AnswerCache : clés, éviction LRU, durée de vie et borne mémoire."""
+import time
+
+import numpy as np
+
+from src.rag.answer_cache import AnswerCache, normalize_query
+
+CONTEXT = AnswerCache.context_key("collection", ["c1", "c2"], "template", "modele")
+
+
+def test_reworded_punctuation_and_case_share_an_entry():
+    cache = AnswerCache()
+    cache.put("Quelle est la durée du contrat ?", CONTEXT, "Trois ans.")
+
+    assert cache.get("quelle est  la durée du contrat", CONTEXT) == "Trois ans."
+    assert normalize_query("  Bonjour ?! ") == "bonjour"
+
+
+def test_other_chunks_or_model_miss():
+    cache = AnswerCache()
+    cache.put("Durée du contrat ?", CONTEXT, "Trois ans.")
+
+    other_chunks = AnswerCache.context_key("collection", ["c1", "c3"], "template", "modele")
+    other_model = AnswerCache.context_key("collection", ["c1", "c2"], "template", "petit-modele")
+    assert cache.get("Durée du contrat ?", other_chunks) is None
+    assert cache.get("Durée du contrat ?", other_model) is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = AnswerCache(max_entries=2)
+    cache.put("q1", CONTEXT, "r1")
+    cache.put("q2", CONTEXT, "r2")
+    # q1 relue : q2 devient la plus ancienne
+    assert cache.get("q1", CONTEXT) == "r1"
+
+    cache.put("q3", CONTEXT, "r3")
+
+    assert cache.get("q2", CONTEXT) is None
+    assert cache.get("q1", CONTEXT) == "r1"
+    assert cache.get("q3", CONTEXT) == "r3"
+    assert cache.evictions == 1
+    assert cache.stats()["entries"] == 2
+
+
+def test_rewriting_an_entry_does_not_evict():
+    cache = AnswerCache(max_entries=2)
+    cache.put("q1", CONTEXT, "r1")
+    cache.put("q2", CONTEXT, "r2")
+    cache.put("q1", CONTEXT, "r1 bis")
+
+    assert cache.evictions == 0
+    assert cache.get("q1", CONTEXT) == "r1 bis"
+
+
+def test_memory_bound_evicts_oldest_entries():
+    answer = "x" * 4000
+    cache = AnswerCache(max_mb=10_000 / 1024 / 1024)
+    for i in range(5):
+        cache.put(f"q{i}", CONTEXT, answer)
+
+    assert cache.stats()["entries"] == 2
+    assert cache.get("q4", CONTEXT) == answer
+    assert cache.get("q0", CONTEXT) is None
+    assert cache.evictions == 3
+
+
+def test_answer_larger_than_the_cache_is_not_stored():
+    cache = AnswerCache(max_mb=1000 / 1024 / 1024)
+    cache.put("q", CONTEXT, "x" * 5000)
+
+    assert cache.get("q", CONTEXT) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_expired_entry_is_dropped():
+    cache = AnswerCache(ttl_s=0.05)
+    cache.put("q", CONTEXT, "r")
+    time.sleep(0.1)
+
+    assert cache.get("q", CONTEXT) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_semantic_mode_reuses_a_close_question_with_the_same_chunks():
+    cache = AnswerCache(semantic=True, semantic_threshold=0.95)
+    cache.put("Durée du contrat ?", CONTEXT, "Trois ans.", np.array([1.0, 0.0, 0.0]))
+
+    close = np.array([0.99, 0.05, 0.0])
+    far = np.array([0.0, 1.0, 0.0])
+    other_chunks = AnswerCache.context_key("collection", ["c9"], "template", "modele")
+    assert cache.get("Combien de temps dure le contrat ?", CONTEXT, close) == "Trois ans."
+    assert cache.get("Qui signe le contrat ?", CONTEXT, far) is None
+    assert cache.get("Combien de temps dure le contrat ?", other_chunks, close) is None
+
+
+def test_clear_empties_the_cache():
+    cache = AnswerCache()
+    cache.put("q", CONTEXT, "r")
+    cache.clear()
+
+    assert cache.get("q", CONTEXT) is None
+    assert cache.stats()["size_mb"] == 0
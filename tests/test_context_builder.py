@@ -0,0 +1,150 @@
+"""ContextBuilder.build : fusion des chunks consécutifs, doublons et budget de tokens."""
+from src.rag.context_builder import ContextBuilder, TokenEstimator
+
+
+def _hit(chunk_id: str, text: str, start: int, chemin: str = "/docs/guide.pdf", score: float = 0.8) -> dict:
+    return {
+        "id": chunk_id,
+        "batch": text,
+        "chemin": chemin,
+        "position_debut": start,
+        "taille_texte": len(text),
+        "score_final": score,
+    }
+
+
+def _builder(**kwargs) -> ContextBuilder:
+    # 1 caractère = 1 token : budgets faciles à lire
+    return ContextBuilder(estimator=TokenEstimator(chars_per_token=1.0), **kwargs)
+
+
+def test_consecutive_chunks_are_merged_without_repeating_the_overlap():
+    first = "Le contrat est signé pour trois ans."
+    second = "trois ans. Il est renouvelable une fois."
+    hits = [
+        _hit("c1", first, 0),
+        _hit("c2", second, len(first)),
+    ]
+
+    result = _builder().build(hits)
+
+    assert len(result["documents"]) == 1
+    assert result["documents"][0]["content"] == "Le contrat est signé pour trois ans. Il est renouvelable une fois."
+    assert result["chunk_ids"] == ["c1", "c2"]
+    assert result["stats"]["merged"] == 1
+
+
+def test_chunk_preceding_a_kept_passage_is_merged_in_front():
+    hits = [
+        _hit("c2", "Deuxième partie.", len("Première partie.")),
+        _hit("c1", "Première partie.", 0, score=0.5),
+    ]
+
+    result = _builder().build(hits)
+
+    assert len(result["documents"]) == 1
+    assert result["documents"][0]["content"].startswith("Première partie.")
+    assert result["documents"][0]["score"] == 0.8
+
+
+def test_chunks_of_other_files_are_not_merged():
+    hits = [
+        _hit("a", "Texte du premier fichier.", 0, chemin="/docs/a.pdf"),
+        _hit("b", "Texte du second fichier.", 25, chemin="/docs/b.pdf", score=0.7),
+    ]
+
+    result = _builder().build(hits)
+
+    assert [d["source_name"] for d in result["documents"]] == ["a.pdf", "b.pdf"]
+    assert result["stats"]["merged"] == 0
+
+
+def test_duplicate_chunk_is_skipped():
+    text = "Les congés sont posés avant le 31 mai."
+    hits = [
+        _hit("c1", text, 0),
+        _hit("c1-bis", text, 500, chemin="/docs/copie.pdf"),
+    ]
+
+    result = _builder().build(hits)
+
+    assert len(result["documents"]) == 1
+    assert result["chunk_ids"] == ["c1"]
+    assert result["stats"]["duplicates"] == 1
+
+
+def test_budget_drops_chunks_that_do_not_fit():
+    builder = _builder(merge_adjacent=False)
+    hits = [
+        _hit("c1", "x" * 100, 0, chemin="/docs/a.pdf"),
+        _hit("c2", "y" * 100, 0, chemin="/docs/b.pdf", score=0.7),
+        _hit("c3", "z" * 100, 0, chemin="/docs/c.pdf", score=0.6),
+    ]
+    budget = 2 * builder.document_cost("x" * 100) + 50
+
+    result = builder.build(hits, budget=budget)
+
+    assert result["chunk_ids"] == ["c1", "c2"]
+    assert result["stats"]["dropped_budget"] == 1
+    assert result["tokens"] <= budget
+
+
+def test_best_chunk_is_truncated_when_it_alone_exceeds_the_budget():
+    builder = _builder()
+    budget = builder.document_cost("") + 40
+
+    result = builder.build([_hit("c1", "m" * 500, 0)], budget=budget)
+
+    assert len(result["documents"]) == 1
+    assert 0 < len(result["documents"][0]["content"]) < 500
+    assert result["tokens"] <= budget
+
+
+def test_merge_is_refused_when_it_exceeds_the_budget():
+    builder = _builder()
+    first = "a" * 100
+    budget = builder.document_cost(first) + 10
+    hits = [_hit("c1", first, 0), _hit("c2", "b" * 100, 100, score=0.7)]
+
+    result = builder.build(hits, budget=budget)
+
+    assert result["chunk_ids"] == ["c1"]
+    assert result["tokens"] <= budget
+
+
+def test_chunk_filling_a_gap_bridges_two_passages_within_the_budget():
+    builder = _builder()
+    first, middle, last = "a" * 100, "b" * 100, "c" * 100
+    hits = [
+        _hit("c1", first, 0),
+        _hit("c3", last, 200, score=0.7),
+        _hit("c2", middle, 100, score=0.6),
+    ]
+    # Juste assez pour les trois chunks, dont deux passages séparés avant le pont
+    budget = builder.document_cost(first) + builder.document_cost(last) + builder._cost(middle)
+
+    result = builder.build(hits, budget=budget)
+
+    assert len(result["documents"]) == 1
+    assert result["documents"][0]["content"] == first + "\n" + middle + "\n" + last
+    # Un seul document : l'en-tête du second n'est plus compté
+    assert result["tokens"] < budget
+
+
+def test_documents_are_numbered_by_score():
+    hits = [
+        _hit("low", "Passage moins pertinent.", 0, chemin="/docs/a.pdf", score=0.4),
+        _hit("high", "Passage le plus pertinent.", 0, chemin="/docs/b.pdf", score=0.9),
+    ]
+
+    result = _builder().build(hits)
+
+    assert [d["id"] for d in result["documents"]] == [1, 2]
+    assert [d["score"] for d in result["documents"]] == [0.9, 0.4]
+
+
+def test_empty_chunks_are_ignored():
+    result = _builder().build([_hit("vide", "   ", 0)])
+
+    assert result["documents"] == []
+    assert result["tokens"] == 0
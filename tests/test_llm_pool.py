@@ -0,0 +1,165 @@
+"""LLMPool : répartition, bascule et disjoncteur, contre le faux serveur llama.cpp."""
+import time
+import asyncio
+
+import httpx
+import pytest
+
+from src.rag.llm import LLM, is_error_reply
+from src.rag.llm_pool import Backend, LLMPool, NoBackendAvailableError
+from src.rag.settings import LLMSettings
+
+
+def _settings(**overrides) -> LLMSettings:
+    # Ni sonde périodique ni relevé des slots : les tests pilotent l'état du pool
+    values = dict(
+        max_retries=0,
+        connect_timeout_s=1.0,
+        health_check_interval_s=0,
+        slot_poll_interval_s=0,
+        coalesce_requests=False,
+    )
+    values.update(overrides)
+    return LLMSettings(**values)
+
+
+def test_failover_to_healthy_backend(dead_url, mock_llm_url):
+    llm = LLM(base_urls=[dead_url, mock_llm_url], settings=_settings(breaker_failures=1))
+    dead, live = llm.pool.backends
+
+    reply = llm.infere("Quelle est la capitale de la France ?")
+
+    assert reply and not is_error_reply(reply)
+    assert dead.state == Backend.OPEN
+    assert dead.errors == 1
+    assert live.requests == 1 and live.errors == 0
+    assert dead.outstanding == live.outstanding == 0
+
+
+def test_async_failover_to_healthy_backend(dead_url, mock_llm_url):
+    llm = LLM(base_urls=[dead_url, mock_llm_url], settings=_settings(breaker_failures=1))
+
+    reply = asyncio.run(llm.ainfere("Quelle est la capitale de la France ?"))
+
+    assert reply and not is_error_reply(reply)
+    assert llm.pool.backends[0].state == Backend.OPEN
+
+
+def test_ejected_backend_receives_no_traffic(dead_url, mock_llm_url):
+    llm = LLM(base_urls=[dead_url, mock_llm_url], settings=_settings(breaker_failures=1))
+    dead, live = llm.pool.backends
+
+    for _ in range(3):
+        assert not is_error_reply(llm.infere("Bonjour"))
+
+    assert dead.requests == 1
+    assert live.requests == 3
+
+
+def test_all_backends_down_returns_an_error_reply(dead_url):
+    llm = LLM(base_urls=[dead_url], settings=_settings(breaker_failures=1))
+
+    assert is_error_reply(llm.infere("Bonjour"))
+
+
+def test_breaker_opens_after_consecutive_failures(dead_url):
+    pool = LLMPool([dead_url], "pas_de_clef", _settings(breaker_failures=2))
+    backend = pool.backends[0]
+
+    pool.release(pool.acquire(), 0.0, httpx.ConnectError("refusée"))
+    assert backend.state == Backend.CLOSED
+
+    pool.release(pool.acquire(), 0.0, httpx.ConnectError("refusée"))
+    assert backend.state == Backend.OPEN
+    with pytest.raises(NoBackendAvailableError):
+        pool.acquire()
+
+
+def test_success_resets_consecutive_failures(dead_url):
+    pool = LLMPool([dead_url], "pas_de_clef", _settings(breaker_failures=2))
+    backend = pool.backends[0]
+
+    pool.release(pool.acquire(), 0.0, httpx.ConnectError("refusée"))
+    pool.release(pool.acquire(), 0.01)
+    pool.release(pool.acquire(), 0.0, httpx.ConnectError("refusée"))
+
+    assert backend.state == Backend.CLOSED
+    assert backend.consecutive_failures == 1
+
+
+def test_request_errors_do_not_trip_the_breaker(dead_url):
+    pool = LLMPool([dead_url], "pas_de_clef", _settings(breaker_failures=1))
+
+    # Erreur de la requête elle-même (ex : prompt invalide), pas du serveur
+    pool.release(pool.acquire(), 0.0, ValueError("requête invalide"))
+
+    assert pool.backends[0].state == Backend.CLOSED
+
+
+def test_half_open_allows_a_single_trial_request(dead_url):
+    pool = LLMPool([dead_url], "pas_de_clef", _settings(breaker_failures=1, breaker_cooldown_s=0.05))
+    backend = pool.backends[0]
+    pool.release(pool.acquire(), 0.0, httpx.ConnectError("refusée"))
+
+    time.sleep(0.1)
+    trial = pool.acquire()
+    assert backend.state == Backend.HALF_OPEN
+    with pytest.raises(NoBackendAvailableError):
+        pool.acquire()
+
+    pool.release(trial, 0.01)
+    assert backend.state == Backend.CLOSED
+
+
+def test_failed_trial_reopens_the_breaker(dead_url):
+    pool = LLMPool([dead_url], "pas_de_clef", _settings(breaker_failures=3, breaker_cooldown_s=0.05))
+    backend = pool.backends[0]
+    for _ in range(3):
+        pool.release(pool.acquire(), 0.0, httpx.ConnectError("refusée"))
+
+    time.sleep(0.1)
+    # Un seul échec suffit pendant l'essai
+    pool.release(pool.acquire(), 0.0, httpx.ConnectError("refusée"))
+
+    assert backend.state == Backend.OPEN
+
+
+def test_probe_reintegrates_recovered_backend(mock_llm_url):
+    pool = LLMPool([mock_llm_url], "pas_de_clef", _settings(breaker_failures=1, breaker_cooldown_s=0.05))
+    backend = pool.backends[0]
+    pool.release(pool.acquire(), 0.0, httpx.ConnectError("coupure passagère"))
+    assert backend.state == Backend.OPEN
+
+    time.sleep(0.1)
+    assert pool.probe(timeout=2.0, only_ejected=True)
+    assert backend.state == Backend.CLOSED
+
+
+def test_least_outstanding_backend_is_chosen():
+    # Réservations seules : aucun appel réseau
+    pool = LLMPool(["http://127.0.0.1:9/v1", "http://127.0.0.1:19/v1"], "pas_de_clef", _settings())
+    first = pool.acquire()
+    second = pool.acquire()
+
+    assert first is not second
+    pool.release(first, 0.01)
+    pool.release(second, 0.01)
+
+
+def test_readiness_check_leaves_breakers_alone(dead_url, mock_llm_url):
+    pool = LLMPool([dead_url, mock_llm_url], "pas_de_clef", _settings(breaker_failures=1))
+    dead, live = pool.backends
+    pool.release(pool.acquire(), 0.0, httpx.ConnectError("refusée"))
+    live_failures = live.consecutive_failures
+
+    assert pool.reachable(timeout=2.0)
+    assert dead.state == Backend.OPEN
+    assert live.state == Backend.CLOSED and live.consecutive_failures == live_failures
+
+
+def test_unreachable_servers_are_not_ejected_by_readiness_checks(dead_url):
+    pool = LLMPool([dead_url], "pas_de_clef", _settings(breaker_failures=1))
+
+    assert not pool.reachable(timeout=1.0)
+    assert pool.backends[0].state == Backend.CLOSED
+    assert pool.backends[0].errors == 0
@@ -0,0 +1,92 @@
+"""RelevanceGate.cutoff / select : nombre de chunks passés au LLM selon leurs scores."""
+from src.rag.relevance import FULL, GATED, TRIMMED, RelevanceGate
+
+
+def _gate(**kwargs) -> RelevanceGate:
+    values = dict(min_score=0.2, min_relative_score=0.6, max_gap=0.15, mass_fraction=1.0)
+    values.update(kwargs)
+    return RelevanceGate(**values)
+
+
+def test_no_score_above_minimum_gates_the_question():
+    assert _gate().cutoff([0.19, 0.1, 0.05]) == 0
+
+
+def test_no_candidate_gates_the_question():
+    assert _gate().cutoff([]) == 0
+
+
+def test_disabled_gate_keeps_every_candidate():
+    assert _gate(enabled=False).cutoff([0.05, 0.01]) == 2
+
+
+def test_cut_at_the_first_large_gap():
+    assert _gate().cutoff([0.9, 0.85, 0.6, 0.55]) == 2
+
+
+def test_cut_below_the_relative_score():
+    # 0.9 * 0.6 = 0.54 : les chunks sous ce plancher sont écartés, même sans rupture
+    assert _gate(max_gap=1.0).cutoff([0.9, 0.8, 0.7, 0.6, 0.5]) == 4
+
+
+def test_cut_below_the_absolute_minimum():
+    assert _gate(min_relative_score=0.0, max_gap=1.0).cutoff([0.5, 0.3, 0.21, 0.19]) == 3
+
+
+def test_close_scores_are_all_kept():
+    assert _gate().cutoff([0.7, 0.68, 0.66, 0.65]) == 4
+
+
+def test_mass_fraction_drops_chunks_that_barely_add_anything():
+    # Masses au-dessus de 0.2 : 0.6, 0.5, 0.4, 0.1 (total 1.6) ; 90 % atteints au 3e
+    gate = _gate(min_relative_score=0.0, max_gap=1.0, mass_fraction=0.9)
+
+    assert gate.cutoff([0.8, 0.7, 0.6, 0.3]) == 3
+
+
+def test_top_chunk_is_always_kept_when_it_passes_the_minimum():
+    assert _gate(mass_fraction=0.01).cutoff([0.25, 0.24]) == 1
+
+
+def test_select_reports_its_decision():
+    gate = _gate()
+    hits = [{"id": str(i), "score_retrieval": s} for i, s in enumerate([0.9, 0.85, 0.3])]
+
+    assert gate.select(hits) == (hits[:2], TRIMMED)
+    assert gate.select(hits[:2]) == (hits[:2], FULL)
+    assert gate.select([{"id": "x", "score_retrieval": 0.1}]) == ([], GATED)
+
+
+def test_select_compares_retrieval_scores_not_reranked_ones():
+    # Reranking : score_final = moitié embedding + moitié lexical, autre échelle
+    hits = [
+        {"id": "a", "score_retrieval": 0.7, "score_final": 0.35},
+        {"id": "b", "score_retrieval": 0.68, "score_final": 0.34},
+    ]
+
+    assert _gate(min_score=0.5).select(hits) == (hits, FULL)
+
+
+def test_scores_out_of_order_after_reranking():
+    # Le premier chunk du reranking n'a pas la meilleure similarité
+    assert _gate().keep([0.15, 0.6]) == [1]
+    assert _gate().keep([0.1, 0.15]) == []
+    assert _gate().keep([0.1, 0.05, 0.5]) == [2]
+    assert _gate().keep([0.1, 0.05, 0.5], trim=False) == [2]
+
+
+def test_select_keeps_the_rerank_order_among_relevant_chunks():
+    scores = [0.1, 0.62, 0.05, 0.7]
+    hits = [{"id": str(i), "score_retrieval": s} for i, s in enumerate(scores)]
+
+    assert _gate().select(hits) == ([hits[1], hits[3]], TRIMMED)
+    assert _gate().select(hits, trim=False) == ([hits[1], hits[3]], TRIMMED)
+
+
+def test_gate_only_keeps_every_candidate_above_the_minimum():
+    gate = _gate(mass_fraction=0.5)
+    scores = [0.9, 0.5, 0.3, 0.19]
+
+    assert gate.cutoff(scores) == 1
+    assert gate.cutoff(scores, trim=False) == 3
+    assert gate.cutoff([0.1], trim=False) == 0
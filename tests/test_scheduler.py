@@ -0,0 +1,196 @@
+"""SlotScheduler : file par priorité, délestage et attente bornée d'un slot libre."""
+import time
+import asyncio
+import threading
+from typing import Optional
+
+import pytest
+
+from src.rag.llm_pool import LLMPool
+from src.rag.scheduler import BATCH, INTERACTIVE, LLMQueueFullError, priority
+from src.rag.settings import LLMSettings
+
+# Aucun appel réseau : le pool ne sert qu'à compter les places
+BASE_URL = "http://127.0.0.1:9/v1"
+
+
+def _pool(**overrides) -> LLMPool:
+    values = dict(
+        max_outstanding_per_backend=1,
+        max_queue=4,
+        queue_timeout_s=5.0,
+        health_check_interval_s=0,
+        slot_poll_interval_s=0,
+    )
+    values.update(overrides)
+    return LLMPool([BASE_URL], "pas_de_clef", LLMSettings(**values))
+
+
+def _wait_for_queue(pool: LLMPool, **depth):
+    stop_at = time.monotonic() + 5
+    while time.monotonic() < stop_at:
+        current = pool.scheduler.queue_depth()
+        if all(current[name] == n for name, n in depth.items()):
+            return
+        time.sleep(0.005)
+    raise AssertionError(f"File attendue {depth}, obtenue {pool.scheduler.queue_depth()}")
+
+
+class _Requester(threading.Thread):
+    """Demande une place au pool, note son nom dans `order` puis rend la place aussitôt."""
+
+    def __init__(self, pool: LLMPool, priority_name: str, order: list, label: Optional[str] = None):
+        super().__init__(daemon=True)
+        self.pool = pool
+        self.priority_name = priority_name
+        self.label = label or priority_name
+        self.order = order
+        self.error = None
+
+    def run(self):
+        try:
+            backend = self.pool.acquire(priority=self.priority_name)
+        except Exception as e:
+            self.error = e
+            return
+        self.order.append(self.label)
+        self.pool.release(backend, 0.0)
+
+
+def test_immediate_reservation_when_a_slot_is_free():
+    pool = _pool()
+    backend = pool.acquire()
+
+    assert backend.outstanding == 1
+    assert pool.scheduler.queue_depth() == {INTERACTIVE: 0, BATCH: 0}
+    pool.release(backend, 0.0)
+
+
+def test_interactive_request_overtakes_queued_batch():
+    pool = _pool()
+    held = pool.acquire()
+    order = []
+    batch = _Requester(pool, BATCH, order)
+    batch.start()
+    _wait_for_queue(pool, batch=1)
+    interactive = _Requester(pool, INTERACTIVE, order)
+    interactive.start()
+    _wait_for_queue(pool, interactive=1)
+
+    pool.release(held, 0.0)
+    batch.join(5)
+    interactive.join(5)
+
+    assert order == [INTERACTIVE, BATCH]
+
+
+def test_same_priority_is_served_in_arrival_order():
+    pool = _pool()
+    held = pool.acquire()
+    order = []
+    requesters = []
+    for i in range(3):
+        requester = _Requester(pool, BATCH, order, label=f"batch-{i}")
+        requester.start()
+        _wait_for_queue(pool, batch=i + 1)
+        requesters.append(requester)
+
+    pool.release(held, 0.0)
+    for requester in requesters:
+        requester.join(5)
+
+    assert order == ["batch-0", "batch-1", "batch-2"]
+
+
+def test_full_queue_sheds_the_last_batch_request_for_interactive():
+    pool = _pool(max_queue=1)
+    held = pool.acquire()
+    order = []
+    batch = _Requester(pool, BATCH, order)
+    batch.start()
+    _wait_for_queue(pool, batch=1)
+    interactive = _Requester(pool, INTERACTIVE, order)
+    interactive.start()
+
+    batch.join(5)
+    assert isinstance(batch.error, LLMQueueFullError)
+    _wait_for_queue(pool, interactive=1, batch=0)
+
+    pool.release(held, 0.0)
+    interactive.join(5)
+    assert order == [INTERACTIVE]
+
+
+def test_full_queue_rejects_request_of_equal_or_lower_priority():
+    pool = _pool(max_queue=1)
+    held = pool.acquire()
+    order = []
+    waiting = _Requester(pool, INTERACTIVE, order)
+    waiting.start()
+    _wait_for_queue(pool, interactive=1)
+
+    with pytest.raises(LLMQueueFullError):
+        pool.acquire(priority=BATCH)
+    with pytest.raises(LLMQueueFullError):
+        pool.acquire(priority=INTERACTIVE)
+
+    pool.release(held, 0.0)
+    waiting.join(5)
+    assert order == [INTERACTIVE]
+
+
+def test_queue_timeout_raises_queue_full():
+    pool = _pool(queue_timeout_s=0.05)
+    held = pool.acquire()
+
+    with pytest.raises(LLMQueueFullError):
+        pool.acquire()
+
+    assert pool.scheduler.queue_depth()[INTERACTIVE] == 0
+    pool.release(held, 0.0)
+
+
+def test_priority_context_applies_to_acquire():
+    pool = _pool()
+    held = pool.acquire()
+    errors = []
+
+    def request():
+        with priority(BATCH):
+            try:
+                pool.release(pool.acquire(), 0.0)
+            except Exception as e:
+                errors.append(e)
+
+    thread = threading.Thread(target=request, daemon=True)
+    thread.start()
+    _wait_for_queue(pool, batch=1)
+    pool.release(held, 0.0)
+    thread.join(5)
+
+    assert not errors
+
+
+def test_unknown_priority_is_rejected():
+    with pytest.raises(ValueError):
+        with priority("urgent"):
+            pass
+
+
+def test_cancelled_async_waiter_leaves_no_reservation():
+    pool = _pool()
+
+    async def scenario():
+        held = pool.acquire()
+        waiter = asyncio.ensure_future(pool.aacquire())
+        await asyncio.sleep(0.01)
+        assert pool.scheduler.queue_depth()[INTERACTIVE] == 1
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        pool.release(held, 0.0)
+
+    asyncio.run(scenario())
+
+    assert pool.scheduler.queue_depth()[INTERACTIVE] == 0
+    assert pool.backends[0].outstanding == 0
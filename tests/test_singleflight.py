@@ -0,0 +1,280 @@
+"""SingleFlight : un appel amont par clé, partagé entre leader et followers, annulable."""
+import time
+import asyncio
+import threading
+
+import pytest
+
+from src.rag.singleflight import SingleFlight
+
+
+def _wait_until(condition, timeout: float = 5.0):
+    stop_at = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > stop_at:
+            raise AssertionError("Condition jamais remplie")
+        time.sleep(0.005)
+
+
+class _Upstream:
+    """Appel amont bloqué jusqu'à release(), qui compte ses exécutions."""
+
+    def __init__(self, result="réponse"):
+        self.result = result
+        self.calls = 0
+        self.started = threading.Event()
+        self.released = threading.Event()
+
+    def __call__(self):
+        self.calls += 1
+        self.started.set()
+        self.released.wait(5)
+        return self.result
+
+
+def _run_in_thread(fn, results: list):
+    def target():
+        try:
+            results.append(fn())
+        except Exception as e:
+            results.append(e)
+
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    return thread
+
+
+# --- Appels synchrones ---
+
+def test_followers_share_the_leader_call():
+    flight = SingleFlight()
+    upstream = _Upstream()
+    results = []
+
+    leader = _run_in_thread(lambda: flight.do("k", upstream), results)
+    upstream.started.wait(5)
+    followers = [_run_in_thread(lambda: flight.do("k", upstream), results) for _ in range(3)]
+    time.sleep(0.05)
+    upstream.released.set()
+    for thread in [leader, *followers]:
+        thread.join(5)
+
+    assert upstream.calls == 1
+    assert results == ["réponse"] * 4
+    assert flight.in_flight() == 0
+
+
+def test_different_keys_are_not_shared():
+    flight = SingleFlight()
+
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("b", lambda: 2) == 2
+
+
+def test_finished_call_is_not_reused():
+    flight = SingleFlight()
+    upstream = _Upstream()
+    upstream.released.set()
+
+    flight.do("k", upstream)
+    flight.do("k", upstream)
+
+    assert upstream.calls == 2
+
+
+def test_leader_error_reaches_followers():
+    flight = SingleFlight()
+    started, release = threading.Event(), threading.Event()
+    results = []
+
+    def failing():
+        started.set()
+        release.wait(5)
+        raise RuntimeError("serveur en panne")
+
+    leader = _run_in_thread(lambda: flight.do("k", failing), results)
+    started.wait(5)
+    follower = _run_in_thread(lambda: flight.do("k", failing), results)
+    time.sleep(0.05)
+    release.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert len(results) == 2
+    assert all(isinstance(r, RuntimeError) for r in results)
+
+
+def test_caller_with_later_deadline_runs_alone():
+    flight = SingleFlight()
+    upstream = _Upstream()
+    results = []
+    now = time.monotonic()
+
+    leader = _run_in_thread(lambda: flight.do("k", upstream, expires_at=now + 1), results)
+    upstream.started.wait(5)
+    # Plus de temps que le leader (ou aucune échéance) : n'hérite pas de son échéance
+    later = _run_in_thread(lambda: flight.do("k", upstream, expires_at=now + 10), results)
+    unbounded = _run_in_thread(lambda: flight.do("k", upstream), results)
+    _wait_until(lambda: upstream.calls == 3)
+    upstream.released.set()
+    for thread in (leader, later, unbounded):
+        thread.join(5)
+
+    assert results == ["réponse"] * 3
+
+
+def test_caller_with_earlier_deadline_joins():
+    flight = SingleFlight()
+    upstream = _Upstream()
+    results = []
+    now = time.monotonic()
+
+    leader = _run_in_thread(lambda: flight.do("k", upstream, expires_at=now + 10), results)
+    upstream.started.wait(5)
+    follower = _run_in_thread(lambda: flight.do("k", upstream, expires_at=now + 1), results)
+    time.sleep(0.05)
+    upstream.released.set()
+    leader.join(5)
+    follower.join(5)
+
+    assert upstream.calls == 1
+    assert results == ["réponse", "réponse"]
+
+
+# --- Flux synchrones ---
+
+def test_stream_followers_receive_every_token_from_the_start():
+    flight = SingleFlight()
+    produced = []
+
+    def tokens():
+        for token in ["a", "b", "c"]:
+            produced.append(token)
+            yield token
+
+    leader = flight.stream("k", tokens)
+    assert next(leader) == "a"
+    follower = flight.stream("k", tokens)
+
+    assert list(follower) == ["a", "b", "c"]
+    assert list(leader) == ["b", "c"]
+    assert produced == ["a", "b", "c"]
+
+
+def test_abandoned_stream_closes_upstream():
+    flight = SingleFlight()
+    closed = []
+
+    def tokens():
+        try:
+            yield from ["a", "b", "c"]
+        finally:
+            closed.append(True)
+
+    stream = flight.stream("k", tokens)
+    assert next(stream) == "a"
+    stream.close()
+
+    assert closed == [True]
+    assert flight.in_flight() == 0
+
+
+# --- Asyncio ---
+
+def test_async_followers_share_the_leader_call():
+    flight = SingleFlight()
+    calls = []
+
+    async def upstream():
+        calls.append(1)
+        await asyncio.sleep(0.05)
+        return "réponse"
+
+    async def scenario():
+        return await asyncio.gather(*(flight.ado("k", upstream) for _ in range(4)))
+
+    assert asyncio.run(scenario()) == ["réponse"] * 4
+    assert len(calls) == 1
+
+
+def test_cancelling_one_requester_keeps_the_call_for_the_others():
+    flight = SingleFlight()
+    cancelled = []
+
+    async def upstream():
+        try:
+            await asyncio.sleep(0.1)
+            return "réponse"
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def scenario():
+        first = asyncio.ensure_future(flight.ado("k", upstream))
+        second = asyncio.ensure_future(flight.ado("k", upstream))
+        await asyncio.sleep(0.01)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        return await second
+
+    assert asyncio.run(scenario()) == "réponse"
+    assert cancelled == []
+
+
+def test_upstream_call_is_cancelled_when_every_requester_leaves():
+    flight = SingleFlight()
+    cancelled = []
+
+    async def upstream():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(True)
+            raise
+
+    async def scenario():
+        requesters = [asyncio.ensure_future(flight.ado("k", upstream)) for _ in range(2)]
+        await asyncio.sleep(0.01)
+        for requester in requesters:
+            requester.cancel()
+        await asyncio.gather(*requesters, return_exceptions=True)
+        await asyncio.sleep(0.01)
+
+    asyncio.run(scenario())
+
+    assert cancelled == [True]
+    assert flight.in_flight() == 0
+
+
+def test_async_stream_is_shared_and_cancelled_when_abandoned():
+    flight = SingleFlight()
+    produced, closed = [], []
+
+    async def tokens():
+        try:
+            for token in ["a", "b", "c"]:
+                produced.append(token)
+                yield token
+                await asyncio.sleep(0.01)
+        finally:
+            closed.append(True)
+
+    async def collect():
+        return [token async for token in flight.astream("k", tokens)]
+
+    async def scenario():
+        shared = await asyncio.gather(collect(), collect())
+        abandoned = flight.astream("k", tokens)
+        first = await abandoned.__anext__()
+        await abandoned.aclose()
+        await asyncio.sleep(0.01)
+        return shared, first
+
+    shared, first = asyncio.run(scenario())
+
+    assert shared == [["a", "b", "c"], ["a", "b", "c"]]
+    assert first == "a"
+    # Un flux partagé complet, puis un flux abandonné après le premier fragment
+    assert produced == ["a", "b", "c", "a"]
+    assert closed == [True, True]